@@ -29,6 +29,11 @@ TABLE IF NOT EXISTS < yourdbname >.processed_partitioned (
     'parquet.compression' = 'SNAPPY'
 );
 
+-- for the year/month layout (PARTITION_LAYOUT=year_month in stream/parquet_convert.py) the table is
+-- PARTITIONED BY (year int, month int) instead: `python stream/migrate_partitions.py <source> --layout year_month
+-- --print-ddl [--projection]` prints the statement. With --projection set PARTITION_REGISTRATION=projection
+
+-- stream/historical_ingest.py writes the same rows from the local CSV without this full text scan
 INSERT INTO
     < yourdbname >.processed_partitioned
 SELECT
@@ -45,4 +50,98 @@ ORDER BY 1;
 
 MSCK REPAIR TABLE < yourdbname >.processed_partitioned;
 
-SELECT * FROM < yourdbname >.processed_partitioned LIMIT 10;
\ No newline at end of file
+SELECT * FROM < yourdbname >.processed_partitioned LIMIT 10;
+
+-- stream/parquet_convert.py appends one file per processed day, and a day written again, or merged by its compact mode,
+-- sits in two files until the old one is deleted. Dashboards and ad-hoc queries read this view. File names sort in write
+-- order, also across month= directories, so the row from the greatest file name is the current one
+CREATE OR REPLACE VIEW < yourdbname >.processed_latest AS
+SELECT day, avg_price_usd, min_price_usd, max_price_usd, year
+FROM (
+    SELECT
+        *,
+        row_number() OVER (PARTITION BY day ORDER BY element_at(split("$path", '/'), -1) DESC, "$path" DESC) AS rn
+    FROM < yourdbname >.processed_partitioned
+)
+WHERE rn = 1;
+
+-- written by ml/batch_score.py; partition projection finds new years without MSCK REPAIR
+CREATE EXTERNAL
+TABLE IF NOT EXISTS < yourdbname >.predictions_partitioned (
+    day date,
+    avg_price_usd double,
+    min_price_usd double,
+    max_price_usd double,
+    daily_range double,
+    predicted_range double,
+    model_version string,
+    scored_at string
+) PARTITIONED BY (year int) STORED AS PARQUET LOCATION 's3://your-bucket-name/predictions_partitioned/' TBLPROPERTIES (
+    'parquet.compression' = 'SNAPPY',
+    'projection.enabled' = 'true',
+    'projection.year.type' = 'integer',
+    'projection.year.range' = '2010,2100',
+    'storage.location.template' = 's3://your-bucket-name/predictions_partitioned/year=${year}/'
+);
+
+-- OHLCV rollups written by stream/rollup.py; each level is derived from the one below it (ticks -> 5m -> 1h -> 1d)
+-- volume is null for bars built from the stream, tick_count is the number of ticks behind the bar
+CREATE EXTERNAL
+TABLE IF NOT EXISTS < yourdbname >.ohlcv_5m (
+    bar_start timestamp,
+    open double,
+    high double,
+    low double,
+    close double,
+    volume double,
+    tick_count bigint
+) PARTITIONED BY (year int, month int, day int) STORED AS PARQUET LOCATION 's3://your-bucket-name/rollups/ohlcv_5m/' TBLPROPERTIES (
+    'parquet.compression' = 'SNAPPY',
+    'projection.enabled' = 'true',
+    'projection.year.type' = 'integer',
+    'projection.year.range' = '2010,2100',
+    'projection.month.type' = 'integer',
+    'projection.month.range' = '1,12',
+    'projection.month.digits' = '2',
+    'projection.day.type' = 'integer',
+    'projection.day.range' = '1,31',
+    'projection.day.digits' = '2',
+    'storage.location.template' = 's3://your-bucket-name/rollups/ohlcv_5m/year=${year}/month=${month}/day=${day}/'
+);
+
+CREATE EXTERNAL
+TABLE IF NOT EXISTS < yourdbname >.ohlcv_1h (
+    bar_start timestamp,
+    open double,
+    high double,
+    low double,
+    close double,
+    volume double,
+    tick_count bigint
+) PARTITIONED BY (year int, month int) STORED AS PARQUET LOCATION 's3://your-bucket-name/rollups/ohlcv_1h/' TBLPROPERTIES (
+    'parquet.compression' = 'SNAPPY',
+    'projection.enabled' = 'true',
+    'projection.year.type' = 'integer',
+    'projection.year.range' = '2010,2100',
+    'projection.month.type' = 'integer',
+    'projection.month.range' = '1,12',
+    'projection.month.digits' = '2',
+    'storage.location.template' = 's3://your-bucket-name/rollups/ohlcv_1h/year=${year}/month=${month}/'
+);
+
+CREATE EXTERNAL
+TABLE IF NOT EXISTS < yourdbname >.ohlcv_1d (
+    bar_start timestamp,
+    open double,
+    high double,
+    low double,
+    close double,
+    volume double,
+    tick_count bigint
+) PARTITIONED BY (year int) STORED AS PARQUET LOCATION 's3://your-bucket-name/rollups/ohlcv_1d/' TBLPROPERTIES (
+    'parquet.compression' = 'SNAPPY',
+    'projection.enabled' = 'true',
+    'projection.year.type' = 'integer',
+    'projection.year.range' = '2010,2100',
+    'storage.location.template' = 's3://your-bucket-name/rollups/ohlcv_1d/year=${year}/'
+);
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from datetime import date
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE, os.path.join(ROOT, "ml")]
+
+import synthetic
+from forest import flatten_forest, FlatForest
+
+# joblib RandomForestRegressor vs the flattened forest: cold load, single-row and batch latency, artifact size
+
+FEATURES = ["avg_price_usd", "min_price_usd", "max_price_usd", "year"]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="flattened forest vs joblib model micro-benchmark")
+    parser.add_argument("--years", type=int, default=12, help="years of synthetic daily rows to train on")
+    parser.add_argument("--trees", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--single", type=int, default=200, help="single-row predictions to time")
+    parser.add_argument("--batch", type=int, default=10000, help="rows in the batch prediction")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import joblib
+    from sklearn.ensemble import RandomForestRegressor
+
+    daily = synthetic.generate_daily(date(2024 - args.years, 1, 1), args.years)
+    x = daily[FEATURES].astype(np.float32)
+    y = daily["max_price_usd"] - daily["min_price_usd"]
+    model = RandomForestRegressor(n_estimators=args.trees, max_depth=args.depth, random_state=42, n_jobs=-1).fit(x, y)
+    # a single-row request gains nothing from the thread pool, and that is how the endpoint serves it
+    model.set_params(n_jobs=1)
+
+    tmp = tempfile.mkdtemp(prefix="forest_bench_")
+    joblib_path, flat_path = os.path.join(tmp, "model.joblib"), os.path.join(tmp, "model.forest")
+    joblib.dump(model, joblib_path)
+    flatten_forest(model, feature_names=FEATURES).save(flat_path)
+
+    results = {}
+    results["load_s"] = {
+        "joblib": statistics.median(timed(lambda: joblib.load(joblib_path), args.repeat)),
+        "flat (mmap)": statistics.median(timed(lambda: FlatForest.load(flat_path), args.repeat)),
+        "flat (read)": statistics.median(timed(lambda: FlatForest.load(flat_path, mmap=False), args.repeat)),
+    }
+    flat = FlatForest.load(flat_path)
+
+    rng = np.random.default_rng(0)
+    rows = x.iloc[rng.integers(0, len(x), args.batch)]
+    single = rows.to_numpy()[:1]
+    single_df = rows.iloc[:1]
+    results["single"] = {
+        "sklearn": timed(lambda: model.predict(single_df), args.single),
+        "flat": timed(lambda: flat.predict(single), args.single),
+    }
+    results["batch_s"] = {
+        "sklearn": statistics.median(timed(lambda: model.predict(rows), args.repeat)),
+        "flat": statistics.median(timed(lambda: flat.predict(rows.to_numpy()), args.repeat)),
+    }
+    diff = float(np.max(np.abs(flat.predict(rows.to_numpy()) - model.predict(rows))))
+
+    print(f"forest: {args.trees} trees, depth {args.depth}, {flat.children.shape[0]} nodes, trained on {len(x)} rows")
+    print(f"artifact size: joblib {os.path.getsize(joblib_path) / 1024 ** 2:.1f} MB, "
+          f"flat {os.path.getsize(flat_path) / 1024 ** 2:.1f} MB")
+    for name, seconds in results["load_s"].items():
+        print(f"load {name:<12} {seconds * 1000:10.2f} ms")
+    for name, samples in results["single"].items():
+        print(f"single row {name:<8} p50 {percentile_ms(samples, 50):8.3f} ms  p99 {percentile_ms(samples, 99):8.3f} ms")
+    for name, seconds in results["batch_s"].items():
+        print(f"batch {args.batch} {name:<8} {seconds * 1000:10.2f} ms  {args.batch / seconds:12.0f} rows/s")
+    print(f"max abs prediction difference: {diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
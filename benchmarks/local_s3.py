@@ -0,0 +1,321 @@
+import os
+import re
+import uuid
+import hashlib
+import threading
+import email.utils
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+from xml.sax.saxutils import escape
+
+# in-process S3 stand-in: the subset of the REST API used by boto3 and awswrangler in this repo
+
+XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+def iso_ts(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def decode_aws_chunked(body):
+    # "<hex size>[;chunk-signature=...]\r\n<data>\r\n ... 0\r\n<trailers>\r\n\r\n"
+    out, pos = bytearray(), 0
+    while True:
+        eol = body.index(b"\r\n", pos)
+        size = int(body[pos:eol].split(b";")[0], 16)
+        if size == 0:
+            return bytes(out)
+        out += body[eol + 2:eol + 2 + size]
+        pos = eol + 2 + size + 2
+
+
+class LocalS3:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.objects = {}
+        self.buckets = set()
+        self.uploads = {}
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        handler = type("Handler", (S3Handler,), {"store": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def configure_env(self):
+        # must run before any boto3 client or awswrangler call is made
+        os.environ["AWS_ENDPOINT_URL_S3"] = self.endpoint_url
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        os.environ["AWS_REQUEST_CHECKSUM_CALCULATION"] = "when_required"
+        os.environ["AWS_RESPONSE_CHECKSUM_VALIDATION"] = "when_required"
+
+    def create_bucket(self, bucket):
+        self.buckets.add(bucket)
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+            self.bytes_in = self.bytes_out = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "by_operation": dict(self.requests),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+
+    def put(self, bucket, key, data):
+        etag = hashlib.md5(data).hexdigest()
+        with self.lock:
+            self.objects[(bucket, key)] = (data, etag, datetime.now(timezone.utc).timestamp())
+        return etag
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---------- plumbing ----------
+    def parse(self):
+        url = urlsplit(self.path)
+        parts = url.path.lstrip("/").split("/", 1)
+        bucket = unquote(parts[0])
+        key = unquote(parts[1]) if len(parts) > 1 else ""
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        sha = self.headers.get("x-amz-content-sha256", "")
+        if "aws-chunked" in self.headers.get("Content-Encoding", "") or sha.startswith("STREAMING"):
+            data = decode_aws_chunked(data)
+        with self.store.lock:
+            self.store.bytes_in += len(data)
+        return data
+
+    def count(self, operation):
+        with self.store.lock:
+            self.store.requests[operation] += 1
+
+    def send(self, status, body=b"", headers=None, head=False):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault("Content-Length", str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body and not head:
+            self.wfile.write(body)
+            with self.store.lock:
+                self.store.bytes_out += len(body)
+
+    def send_xml(self, status, xml):
+        self.send(status, ('<?xml version="1.0" encoding="UTF-8"?>' + xml).encode("utf-8"),
+                  {"Content-Type": "application/xml"})
+
+    def error(self, status, code, message="", head=False):
+        if head:
+            return self.send(status, head=True)
+        self.send_xml(status, f"<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>")
+
+    def get_object(self, bucket, key):
+        with self.store.lock:
+            return self.store.objects.get((bucket, key))
+
+    # ---------- verbs ----------
+    def do_HEAD(self):
+        bucket, key, _ = self.parse()
+        self.count("HeadObject" if key else "HeadBucket")
+        if not key:
+            return self.send(200 if bucket in self.store.buckets else 404, head=True)
+        obj = self.get_object(bucket, key)
+        if obj is None:
+            return self.error(404, "NoSuchKey", head=True)
+        data, etag, mtime = obj
+        self.send(200, headers={
+            "ETag": f'"{etag}"',
+            "Last-Modified": email.utils.formatdate(mtime, usegmt=True),
+            "Content-Length": str(len(data)),
+            "Accept-Ranges": "bytes",
+        }, head=True)
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        if not key:
+            self.count("ListObjectsV2")
+            return self.list_objects(bucket, query)
+        self.count("GetObject")
+        obj = self.get_object(bucket, key)
+        if obj is None:
+            return self.error(404, "NoSuchKey", "The specified key does not exist.")
+        data, etag, mtime = obj
+        headers = {"ETag": f'"{etag}"', "Last-Modified": email.utils.formatdate(mtime, usegmt=True),
+                   "Accept-Ranges": "bytes", "Content-Type": "application/octet-stream"}
+        rng = self.headers.get("Range")
+        if rng:
+            m = re.match(r"bytes=(\d*)-(\d*)", rng)
+            start, end = m.group(1), m.group(2)
+            if start == "":
+                start, end = max(0, len(data) - int(end)), len(data) - 1
+            else:
+                start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                return self.error(416, "InvalidRange")
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return self.send(206, data[start:end + 1], headers)
+        self.send(200, data, headers)
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        data = self.body()
+        if not key:
+            self.count("CreateBucket")
+            self.store.create_bucket(bucket)
+            return self.send(200)
+        if "uploadId" in query:
+            self.count("UploadPart")
+            with self.store.lock:
+                self.store.uploads[query["uploadId"]]["parts"][int(query["partNumber"])] = data
+            return self.send(200, headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+        if "x-amz-copy-source" in self.headers:
+            self.count("CopyObject")
+            src_bucket, src_key = unquote(self.headers["x-amz-copy-source"]).lstrip("/").split("/", 1)
+            src = self.get_object(src_bucket, src_key)
+            if src is None:
+                return self.error(404, "NoSuchKey")
+            etag = self.store.put(bucket, key, src[0])
+            return self.send_xml(200, f'<CopyObjectResult><ETag>"{etag}"</ETag>'
+                                      f'<LastModified>{iso_ts(datetime.now().timestamp())}</LastModified></CopyObjectResult>')
+
+        self.count("PutObject")
+        existing = self.get_object(bucket, key)
+        if_none_match, if_match = self.headers.get("If-None-Match"), self.headers.get("If-Match")
+        if if_none_match == "*" and existing is not None:
+            return self.error(412, "PreconditionFailed", "At least one of the pre-conditions you specified did not hold")
+        if if_match and (existing is None or if_match.strip('"') != existing[1]):
+            return self.error(412, "PreconditionFailed", "At least one of the pre-conditions you specified did not hold")
+        etag = self.store.put(bucket, key, data)
+        self.send(200, headers={"ETag": f'"{etag}"'})
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        if "uploadId" in query:
+            self.count("AbortMultipartUpload")
+            with self.store.lock:
+                self.store.uploads.pop(query["uploadId"], None)
+            return self.send(204)
+        self.count("DeleteObject")
+        with self.store.lock:
+            self.store.objects.pop((bucket, key), None)
+        self.send(204)
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        data = self.body()
+        if "delete" in query:
+            self.count("DeleteObjects")
+            root = ET.fromstring(data)
+            keys = [el.text for el in root.iter() if el.tag.endswith("Key")]
+            with self.store.lock:
+                for k in keys:
+                    self.store.objects.pop((bucket, k), None)
+            deleted = "".join(f"<Deleted><Key>{escape(k)}</Key></Deleted>" for k in keys)
+            return self.send_xml(200, f'<DeleteResult xmlns="{XMLNS}">{deleted}</DeleteResult>')
+        if "uploads" in query:
+            self.count("CreateMultipartUpload")
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}}
+            return self.send_xml(200, f'<InitiateMultipartUploadResult xmlns="{XMLNS}"><Bucket>{escape(bucket)}</Bucket>'
+                                      f'<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+        if "uploadId" in query:
+            self.count("CompleteMultipartUpload")
+            with self.store.lock:
+                upload = self.store.uploads.pop(query["uploadId"])
+            parts = [upload["parts"][n] for n in sorted(upload["parts"])]
+            self.store.put(bucket, key, b"".join(parts))
+            etag = hashlib.md5(b"".join(hashlib.md5(p).digest() for p in parts)).hexdigest() + f"-{len(parts)}"
+            with self.store.lock:
+                data_, _, mtime = self.store.objects[(bucket, key)]
+                self.store.objects[(bucket, key)] = (data_, etag, mtime)
+            return self.send_xml(200, f'<CompleteMultipartUploadResult xmlns="{XMLNS}"><Bucket>{escape(bucket)}</Bucket>'
+                                      f'<Key>{escape(key)}</Key><ETag>"{etag}"</ETag></CompleteMultipartUploadResult>')
+        self.error(400, "InvalidRequest", "unsupported POST")
+
+    # ---------- listing ----------
+    def list_objects(self, bucket, query):
+        if bucket not in self.store.buckets:
+            return self.error(404, "NoSuchBucket")
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter", "")
+        max_keys = int(query.get("max-keys", "1000"))
+        token = query.get("continuation-token")
+        start_after = bytes.fromhex(token).decode("utf-8") if token else query.get("start-after", "")
+        url_encode = query.get("encoding-type") == "url"
+        enc = (lambda v: quote(v, safe="/")) if url_encode else escape
+
+        with self.store.lock:
+            keys = sorted((k, v) for (b, k), v in self.store.objects.items() if b == bucket and k.startswith(prefix))
+
+        contents, prefixes, last, truncated = [], [], "", False
+        for key, (data, etag, mtime) in keys:
+            if key <= start_after:
+                continue
+            if delimiter:
+                cut = key.find(delimiter, len(prefix))
+                if cut >= 0:
+                    common = key[:cut + len(delimiter)]
+                    if common <= start_after or (prefixes and prefixes[-1] == common):
+                        continue
+                    if len(contents) + len(prefixes) >= max_keys:
+                        truncated = True
+                        break
+                    prefixes.append(common)
+                    last = common + "\uffff"
+                    continue
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+            contents.append(f"<Contents><Key>{enc(key)}</Key><LastModified>{iso_ts(mtime)}</LastModified>"
+                            f"<ETag>\"{etag}\"</ETag><Size>{len(data)}</Size><StorageClass>STANDARD</StorageClass></Contents>")
+            last = key
+
+        xml = [f'<ListBucketResult xmlns="{XMLNS}"><Name>{escape(bucket)}</Name><Prefix>{enc(prefix)}</Prefix>',
+               f"<KeyCount>{len(contents) + len(prefixes)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>",
+               f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"]
+        if delimiter:
+            xml.append(f"<Delimiter>{enc(delimiter)}</Delimiter>")
+        if url_encode:
+            xml.append("<EncodingType>url</EncodingType>")
+        if truncated:
+            xml.append(f"<NextContinuationToken>{last.encode('utf-8').hex()}</NextContinuationToken>")
+        xml.extend(contents)
+        xml.extend(f"<CommonPrefixes><Prefix>{enc(p)}</Prefix></CommonPrefixes>" for p in prefixes)
+        xml.append("</ListBucketResult>")
+        self.send_xml(200, "".join(xml))
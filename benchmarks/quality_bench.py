@@ -0,0 +1,18 @@
+import pandas as pd
+from datetime import timedelta
+
+import synthetic
+import quality_engine
+
+# the quality rules of quality_assurance/script.py on the pandas backend, so they can be timed without Spark
+
+
+def synthetic_day_frame(start, days):
+    rows = [row for i in range(days) for _, row in synthetic.stream_rows(start + timedelta(days=i))]
+    df = pd.DataFrame(rows, columns=["epoch_ms", "iso_ts", "price_usd", "source"])
+    df["price_usd"] = df["price_usd"].astype(float)
+    return df
+
+
+def run_checks(df):
+    return quality_engine.pandas_metrics(df)
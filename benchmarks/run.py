@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import threading
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path[:0] = [HERE, os.path.join(ROOT, "common"), os.path.join(ROOT, "stream"), os.path.join(ROOT, "ml"),
+                os.path.join(ROOT, "quality_assurance")]
+
+from local_s3 import LocalS3
+import synthetic
+
+BUCKET = "bench-bucket"
+BASELINE_FILE = os.path.join(HERE, "baselines.json")
+START = date(2024, 1, 1)
+
+
+class RssSampler:
+    # samples resident memory in the background; /proc is cheap enough to poll every few ms
+    def __init__(self, interval=0.005):
+        self.interval, self.peak, self.base = interval, 0, 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.base = self.peak = self.rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+    @property
+    def delta_mb(self):
+        return (self.peak - self.base) / 1024 ** 2
+
+
+class AthenaStub:
+    def __init__(self):
+        self.queries = []
+
+    def start_query_execution(self, **kwargs):
+        self.queries.append(kwargs["QueryString"])
+        return {"QueryExecutionId": f"bench-{len(self.queries)}"}
+
+    def get_query_execution(self, **kwargs):
+        return {"QueryExecution": {"Status": {"State": "SUCCEEDED"}}}
+
+
+def measure(store, name, fn, rows, setup=None, repeat=3):
+    walls, mems, s3_stats = [], [], None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        store.reset_counters()
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            fn(state)
+            walls.append(time.perf_counter() - started)
+        mems.append(sampler.delta_mb)
+        s3_stats = store.stats()
+    wall = statistics.median(walls)
+    n = rows() if callable(rows) else rows
+    return {
+        "name": name,
+        "rows": n,
+        "wall_s": round(wall, 4),
+        "rows_per_s": round(n / wall, 1) if wall else None,
+        "peak_mem_mb": round(max(mems), 1),
+        "s3_requests": s3_stats["requests"],
+        "s3_by_operation": s3_stats["by_operation"],
+        "s3_bytes_out": s3_stats["bytes_out"],
+        "s3_bytes_in": s3_stats["bytes_in"],
+    }
+
+
+def verify_ingest(client, csv_path, prefix):
+    # against synthetic.daily_from_ohlcv, the pandas port of the INSERT in athena/init.sql: days, years, min and
+    # max must be identical; avg may differ in the last bit because floating-point sums depend on their order
+    import io
+    import numpy as np
+    import pandas as pd
+    expected = synthetic.daily_from_ohlcv(pd.read_csv(csv_path, float_precision="round_trip"))
+    parts = []
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            body = client.get_object(Bucket=BUCKET, Key=obj["Key"])["Body"].read()
+            parts.append(pd.read_parquet(io.BytesIO(body)).assign(year=int(obj["Key"].split("year=")[1].split("/")[0])))
+    got = pd.concat(parts).sort_values("day", ignore_index=True)
+    got["day"] = pd.to_datetime(got["day"]).dt.date
+    ok = (
+        len(got) == len(expected)
+        and (got["day"].to_numpy() == expected["day"].to_numpy()).all()
+        and (got["year"].to_numpy() == expected["year"].to_numpy()).all()
+        and (got["min_price_usd"].to_numpy() == expected["min_price_usd"].to_numpy()).all()
+        and (got["max_price_usd"].to_numpy() == expected["max_price_usd"].to_numpy()).all()
+        and np.allclose(got["avg_price_usd"], expected["avg_price_usd"], rtol=1e-12, atol=0)
+    )
+    if not ok:
+        raise AssertionError("historical_ingest output differs from the SQL aggregation")
+    print(f"historical_ingest output matches the SQL aggregation for {len(got)} days")
+
+
+def clear_prefixes(store, *prefixes):
+    with store.lock:
+        for k in [k for k in store.objects if k[1].startswith(prefixes)]:
+            del store.objects[k]
+
+
+def run(args):
+    store = LocalS3().start()
+    store.configure_env()
+    store.create_bucket(BUCKET)
+    os.environ.update({
+        "BUCKET": BUCKET, "bucket": BUCKET, "prefix": "processed_partitioned",
+        "start_year": str(START.year - args.years), "end_year": str(START.year), "exclude_years": "",
+        "cache_enabled": "false", "n_estimators": str(args.trees), "memory_budget_mb": "0",
+    })
+    import boto3
+    client = boto3.client("s3")
+    selected = set(args.only.split(",")) if args.only else None
+    results = []
+
+    def wanted(name):
+        return selected is None or name in selected
+
+    if wanted("parquet_convert"):
+        import parquet_convert as pc
+        pc.athena = AthenaStub()
+        end = START + timedelta(days=args.days - 1)
+        ticks = sum(synthetic.write_stream_day(client, BUCKET, START + timedelta(days=i), step_minutes=args.step_minutes)
+                    for i in range(args.days))
+        event = {"mode": "backfill", "start": str(START), "end": str(end), "source": "raw"}
+        results.append(measure(
+            store, "parquet_convert", lambda _: pc.lambda_handler(event, None), ticks,
+            setup=lambda: clear_prefixes(store, "processed_partitioned/", "state/"), repeat=args.repeat,
+        ))
+
+    if wanted("load_data") or wanted("clean") or wanted("train_eval"):
+        import training_job as tj
+        daily = synthetic.generate_daily(date(START.year - args.years, 1, 1), args.years + 1)
+        clear_prefixes(store, "processed_partitioned/", "state/")
+        synthetic.write_processed(BUCKET, daily)
+        loaded = {}
+
+        def load(_):
+            loaded["df"], _m = tj.load_data()
+
+        if wanted("load_data"):
+            results.append(measure(store, "load_data", load, lambda: len(loaded["df"]), repeat=args.repeat))
+        else:
+            load(None)
+
+        if wanted("clean"):
+            results.append(measure(store, "clean", tj.clean, len(loaded["df"]),
+                                   setup=lambda: loaded["df"].copy(), repeat=args.repeat))
+        if wanted("train_eval"):
+            split = tj.split(tj.clean(loaded["df"].copy()))
+            results.append(measure(store, "train_eval", lambda s: tj.train_eval(*s), len(split[0]),
+                                   setup=lambda: split, repeat=args.repeat))
+
+    if wanted("historical_ingest"):
+        import tempfile
+        import historical_ingest
+        csv_path = os.path.join(tempfile.mkdtemp(prefix="ingest_bench_"), "btcusd.csv")
+        minutes = synthetic.write_ohlcv_csv(csv_path, date(START.year - args.ingest_years, 1, 1), args.ingest_years)
+        output = f"s3://{BUCKET}/historical_bench/"
+        results.append(measure(
+            store, "historical_ingest",
+            lambda _: historical_ingest.ingest([csv_path], output, args.ingest_workers, args.ingest_chunk_mb), minutes,
+            setup=lambda: clear_prefixes(store, "historical_bench/"), repeat=args.repeat,
+        ))
+        verify_ingest(client, csv_path, "historical_bench/")
+        os.remove(csv_path)
+
+    if wanted("quality_checks"):
+        import quality_bench
+        frame = quality_bench.synthetic_day_frame(START, args.quality_days)
+        results.append(measure(store, "quality_checks", lambda df: quality_bench.run_checks(df), len(frame),
+                               setup=lambda: frame, repeat=args.repeat))
+
+    store.stop()
+    return results
+
+
+def compare(results, baselines, tolerance):
+    regressions = []
+    for r in results:
+        base = baselines.get(r["name"])
+        if not base:
+            continue
+        if r["wall_s"] > base["wall_s"] * (1 + tolerance):
+            regressions.append(f"{r['name']}: wall {r['wall_s']}s vs baseline {base['wall_s']}s")
+        if r["peak_mem_mb"] > max(base["peak_mem_mb"] * (1 + tolerance), base["peak_mem_mb"] + 5):
+            regressions.append(f"{r['name']}: peak mem {r['peak_mem_mb']} MB vs baseline {base['peak_mem_mb']} MB")
+        if r["s3_requests"] > base["s3_requests"]:
+            regressions.append(f"{r['name']}: {r['s3_requests']} S3 requests vs baseline {base['s3_requests']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pipeline benchmarks against a local S3 stand-in")
+    parser.add_argument("--only", help="comma separated: parquet_convert,load_data,clean,train_eval,historical_ingest,"
+                                       "quality_checks")
+    parser.add_argument("--days", type=int, default=2, help="days of minute ticks for parquet_convert")
+    parser.add_argument("--step-minutes", type=int, default=1, help="minutes between synthetic ticks")
+    parser.add_argument("--years", type=int, default=12, help="years of daily history for the training benchmarks")
+    parser.add_argument("--ingest-years", type=int, default=1, help="years of minute OHLCV for historical_ingest")
+    parser.add_argument("--ingest-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--ingest-chunk-mb", type=int, default=64)
+    parser.add_argument("--quality-days", type=int, default=30, help="days of ticks for the quality checks")
+    parser.add_argument("--trees", type=int, default=100, help="n_estimators for train_eval")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging a regression")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {BASELINE_FILE}")
+    parser.add_argument("--output", help="also write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"{'benchmark':<16}{'rows':>10}{'wall s':>10}{'rows/s':>14}{'peak MB':>10}{'S3 req':>9}")
+    for r in results:
+        print(f"{r['name']:<16}{r['rows']:>10}{r['wall_s']:>10.3f}{r['rows_per_s'] or 0:>14.1f}"
+              f"{r['peak_mem_mb']:>10.1f}{r['s3_requests']:>9}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baselines = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                baselines = json.load(f)
+        baselines.update({r["name"]: r for r in results})
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {BASELINE_FILE}")
+        return
+
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import io
+import csv
+import numpy as np
+import pandas as pd
+import concurrent.futures as cf
+from datetime import datetime, timedelta, timezone
+
+# synthetic BTC/USD data: geometric Brownian motion on a minute grid, deterministic for a given seed
+
+MINUTE_MS = 60_000
+
+
+def random_walk(n, start_price=30_000.0, minute_vol=0.0008, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0, minute_vol, n)
+    return start_price * np.exp(np.cumsum(returns))
+
+
+def generate_ohlcv(start, minutes, start_price=30_000.0, seed=0):
+    # dataset/btcusd.csv layout: time (ms), open, close, high, low, volume
+    t0 = int(datetime(start.year, start.month, start.day, tzinfo=timezone.utc).timestamp() * 1000)
+    close = random_walk(minutes, start_price, seed=seed)
+    open_ = np.concatenate([[start_price], close[:-1]])
+    rng = np.random.default_rng(seed + 1)
+    spread = np.abs(rng.normal(0.0, 0.0004, minutes)) * close
+    return pd.DataFrame({
+        "time": t0 + np.arange(minutes, dtype=np.int64) * MINUTE_MS,
+        "open": open_,
+        "close": close,
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "volume": rng.gamma(2.0, 0.5, minutes),
+    })
+
+
+def write_ohlcv_csv(path, start, years, chunk_days=30, seed=0):
+    # written a month at a time so many years of minute data never sit in memory at once
+    day = start
+    end = datetime(start.year + years, start.month, start.day).date()
+    price, rows, first = 30_000.0, 0, True
+    with open(path, "w", newline="") as f:
+        while day < end:
+            days = min(chunk_days, (end - day).days)
+            chunk = generate_ohlcv(day, days * 1440, start_price=price, seed=seed + rows)
+            chunk.to_csv(f, index=False, header=first)
+            price, rows, first = float(chunk["close"].iloc[-1]), rows + len(chunk), False
+            day += timedelta(days=days)
+    return rows
+
+
+def daily_from_ohlcv(df):
+    # same aggregation as the processed_partitioned INSERT in athena/init.sql
+    ts = pd.to_datetime(df["time"], unit="ms")
+    daily = (
+        df.assign(day=ts.dt.date)
+        .groupby("day")
+        .agg(avg_price_usd=("close", "mean"), min_price_usd=("low", "min"), max_price_usd=("high", "max"))
+        .reset_index()
+    )
+    daily["year"] = pd.to_datetime(daily["day"]).dt.year
+    return daily
+
+
+def generate_daily(start, years, seed=0):
+    frames, price, day = [], 30_000.0, start
+    end = datetime(start.year + years, start.month, start.day).date()
+    while day < end:
+        days = min(30, (end - day).days)
+        chunk = generate_ohlcv(day, days * 1440, start_price=price, seed=seed + day.toordinal())
+        frames.append(daily_from_ohlcv(chunk))
+        price = float(chunk["close"].iloc[-1])
+        day += timedelta(days=days)
+    return pd.concat(frames, ignore_index=True)
+
+
+def stream_rows(day, step_minutes=1, seed=0):
+    # stream.py CSV layout: epoch_ms, iso_ts, price_usd, source
+    t0 = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    n = 1440 // step_minutes
+    prices = random_walk(n, seed=seed + day.toordinal())
+    for i in range(n):
+        ts = t0 + timedelta(minutes=i * step_minutes)
+        yield ts, [int(ts.timestamp() * 1000), ts.isoformat(), f"{prices[i]:.2f}", "coingecko"]
+
+
+def write_stream_day(client, bucket, day, prefix="raw/stream", step_minutes=1, workers=16, seed=0):
+    # one object per minute under hour=HH/, exactly as stream.py writes them
+    def put(item):
+        ts, row = item
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["epoch_ms", "iso_ts", "price_usd", "source"])
+        writer.writerow(row)
+        key = f"{prefix}/year={ts:%Y}/month={ts:%m}/day={ts:%d}/hour={ts:%H}/ticks_{ts:%Y%m%d}_{ts:%H%M}.csv"
+        client.put_object(Bucket=bucket, Key=key, Body=buf.getvalue().encode("utf-8"), ContentType="text/csv")
+        return 1
+
+    with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+        return sum(ex.map(put, stream_rows(day, step_minutes, seed)))
+
+
+def write_processed(bucket, daily, prefix="processed_partitioned"):
+    import awswrangler as wr
+    wr.s3.to_parquet(
+        df=daily,
+        path=f"s3://{bucket}/{prefix}/",
+        dataset=True,
+        mode="overwrite_partitions",
+        compression="snappy",
+        partition_cols=["year"],
+    )
+    return len(daily)
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# one JSON record per invocation with per-stage timings and S3 request/byte counts.
+# cheap enough for the per-minute ingest Lambda: a few dict updates per stage and per S3 call
+
+ENABLED = os.environ.get("INSTRUMENTATION", "true").lower() != "false"
+# optional JSON-lines file every record is appended to, for local runs and tests
+SINK_FILE = os.environ.get("INSTRUMENTATION_FILE")
+RECORD_TYPE = "pipeline_metrics"
+
+_lock = threading.Lock()
+_local = threading.local()
+_record = None
+# stage stack of the thread that opened the invocation; worker threads with no stage of their own report into it
+_main_stack = []
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _current_stage():
+    for stack in (_stack(), _main_stack):
+        try:
+            return stack[-1]
+        except IndexError:
+            continue
+    return None
+
+
+def _new_stage():
+    return {"seconds": 0.0, "calls": 0, "s3_requests": 0, "s3_bytes_in": 0, "s3_bytes_out": 0}
+
+
+def _new_record(component, fields):
+    return {
+        "type": RECORD_TYPE,
+        "component": component,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "status": "ok",
+        "duration_s": 0.0,
+        "stages": {},
+        "s3": {"requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0, "operations": {}},
+        "counters": {},
+        "fields": dict(fields),
+    }
+
+
+def start(component, **fields):
+    # for scripts without a single entry point (the Glue job); everything else uses invocation()
+    global _record, _main_stack
+    if not ENABLED:
+        return
+    with _lock:
+        _record = _new_record(component, fields)
+        _record["_started"] = time.perf_counter()
+    _main_stack = _stack()
+
+
+def finish():
+    global _record
+    if not ENABLED or _record is None:
+        return None
+    with _lock:
+        record, _record = _record, None
+    record["duration_s"] = round(time.perf_counter() - record.pop("_started"), 4)
+    for stats in record["stages"].values():
+        stats["seconds"] = round(stats["seconds"], 4)
+    emit(record)
+    return record
+
+
+@contextmanager
+def invocation(component, **fields):
+    # usable as `with invocation(...)` or as a decorator on lambda_handler / main
+    start(component, **fields)
+    try:
+        yield
+    except BaseException as e:
+        mark_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        finish()
+
+
+@contextmanager
+def stage(name):
+    # stages may nest and run concurrently in worker threads; seconds are summed across calls
+    if not ENABLED or _record is None:
+        yield
+        return
+    stack = _stack()
+    stack.append(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stack.pop()
+        with _lock:
+            if _record is not None:
+                stats = _record["stages"].setdefault(name, _new_stage())
+                stats["seconds"] += elapsed
+                stats["calls"] += 1
+
+
+def count(name, value=1):
+    if not ENABLED or _record is None:
+        return
+    with _lock:
+        if _record is not None:
+            _record["counters"][name] = _record["counters"].get(name, 0) + value
+
+
+def annotate(**fields):
+    if not ENABLED or _record is None:
+        return
+    with _lock:
+        if _record is not None:
+            _record["fields"].update(fields)
+
+
+def mark_error(message):
+    # for handlers that report failures in their return value instead of raising; the first error is kept
+    if not ENABLED or _record is None:
+        return
+    with _lock:
+        if _record is not None:
+            _record["status"] = "error"
+            _record["fields"].setdefault("error", str(message)[:500])
+
+
+def emit(record):
+    line = json.dumps(record, default=str, separators=(",", ":"))
+    print(line)
+    if SINK_FILE:
+        with _lock, open(SINK_FILE, "a") as f:
+            f.write(line + "\n")
+
+
+def _add_s3(operation, requests=0, errors=0, bytes_in=0, bytes_out=0):
+    with _lock:
+        if _record is None:
+            return
+        s3 = _record["s3"]
+        s3["requests"] += requests
+        s3["errors"] += errors
+        s3["bytes_in"] += bytes_in
+        s3["bytes_out"] += bytes_out
+        s3["operations"][operation] = s3["operations"].get(operation, 0) + requests
+        name = _current_stage()
+        if name is not None:
+            stats = _record["stages"].setdefault(name, _new_stage())
+            stats["s3_requests"] += requests
+            stats["s3_bytes_in"] += bytes_in
+            stats["s3_bytes_out"] += bytes_out
+
+
+def _on_s3_send(request, event_name="", **kwargs):
+    # fires once per HTTP attempt, so retries are counted too
+    headers = request.headers
+    size = headers.get("X-Amz-Decoded-Content-Length") or headers.get("Content-Length") or 0
+    _add_s3(event_name.rsplit(".", 1)[-1], requests=1, bytes_out=int(size))
+
+
+def _on_s3_response(http_response=None, model=None, event_name="", **kwargs):
+    if http_response is None:
+        return
+    size = 0
+    if model is None or model.http.get("method") != "HEAD":
+        size = int(http_response.headers.get("content-length") or 0)
+    _add_s3(event_name.rsplit(".", 1)[-1], errors=int(http_response.status_code >= 400), bytes_in=size)
+
+
+def track_s3(*clients):
+    # hooks the given clients and the default boto3 session, which covers clients
+    # created later, including the ones awswrangler builds per call
+    if not ENABLED:
+        return
+    import boto3
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    for events in [c.meta.events for c in clients] + [boto3.DEFAULT_SESSION.events]:
+        events.register("before-send.s3", _on_s3_send, unique_id="instrumentation-s3-send")
+        events.register("after-call.s3", _on_s3_response, unique_id="instrumentation-s3-response")
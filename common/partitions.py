@@ -0,0 +1,117 @@
+import time
+from datetime import datetime, timezone
+
+# partition layouts of processed_partitioned/, their file naming and their registration in the Glue catalog, shared by
+# stream/parquet_convert.py, historical_ingest.py and migrate_partitions.py and by the ml jobs that read the files
+# (ship it with them like instrumentation.py)
+#   year:       processed_partitioned/year=YYYY/
+#   year_month: processed_partitioned/year=YYYY/month=MM/   date-range queries read only the months they touch
+LAYOUTS = {"year": ["year"], "year_month": ["year", "month"]}
+COLUMNS = [("day", "date"), ("avg_price_usd", "double"), ("min_price_usd", "double"), ("max_price_usd", "double")]
+# Athena accepts queries up to 256 KB; a few hundred partition clauses stay well below that
+ADD_BATCH = 100
+
+
+def check(layout):
+    if layout not in LAYOUTS:
+        raise ValueError(f"unknown partition layout {layout!r}, expected one of {sorted(LAYOUTS)}")
+    return LAYOUTS[layout]
+
+
+def values(day, layout):
+    return tuple(getattr(day, c) for c in check(layout))
+
+
+def path(prefix, vals, layout):
+    parts = [f"{c}={v}" if c == "year" else f"{c}={v:02}" for c, v in zip(check(layout), vals)]
+    return "/".join(([prefix.rstrip("/")] if prefix else []) + parts)
+
+
+def of_key(key, layout):
+    # partition values of an object key, or None when the key is not inside a full partition of this layout
+    found = {}
+    for part in key.split("/")[:-1]:
+        name, _, value = part.partition("=")
+        if name in LAYOUTS[layout] and value.isdigit():
+            found[name] = int(value)
+    cols = check(layout)
+    return tuple(found[c] for c in cols) if all(c in found for c in cols) else None
+
+
+def file_stamp():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+
+
+def stamp_of(key):
+    # files not written as part-<stamp>-... (older awswrangler or historical files) have no stamp
+    name = key.rsplit("/", 1)[-1]
+    return name.split("-")[1] if name.startswith("part-") else None
+
+
+def write_order(key):
+    # part-<stamp>-... names sort in write order across partition directories; other names sort before them
+    return key.rsplit("/", 1)[-1], key
+
+
+def projection_properties(location, layout):
+    location = location.rstrip("/")
+    props = {
+        "projection.enabled": "true",
+        "projection.year.type": "integer",
+        "projection.year.range": "2010,2100",
+    }
+    if "month" in check(layout):
+        props.update({"projection.month.type": "integer", "projection.month.range": "1,12", "projection.month.digits": "2"})
+    props["storage.location.template"] = location + "".join(f"/{c}=${{{c}}}" for c in LAYOUTS[layout]) + "/"
+    return props
+
+
+def create_table_sql(database, table, location, layout, projection=False):
+    props = {"parquet.compression": "SNAPPY", **(projection_properties(location, layout) if projection else {})}
+    cols = ",\n".join(f"    {name} {kind}" for name, kind in COLUMNS)
+    parts = ", ".join(f"{c} int" for c in check(layout))
+    tblprops = ",\n".join(f"    '{k}' = '{v}'" for k, v in props.items())
+    return (f"CREATE EXTERNAL TABLE IF NOT EXISTS {database}.{table} (\n{cols}\n) PARTITIONED BY ({parts}) "
+            f"STORED AS PARQUET LOCATION '{location.rstrip('/')}/' TBLPROPERTIES (\n{tblprops}\n);")
+
+
+def add_partitions_sql(database, table, location, parts, layout):
+    clauses = []
+    for vals in sorted(parts):
+        spec = ", ".join(f"{c} = {v}" for c, v in zip(check(layout), vals))
+        clauses.append(f"PARTITION ({spec}) LOCATION '{path(location, vals, layout)}/'")
+    return f"ALTER TABLE {database}.{table} ADD IF NOT EXISTS\n" + "\n".join(clauses) + ";"
+
+
+def wait(athena, query_id, timeout):
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    while True:
+        status = athena.get_query_execution(QueryExecutionId=query_id)["QueryExecution"]["Status"]
+        if status["State"] == "SUCCEEDED":
+            return
+        if status["State"] in ("FAILED", "CANCELLED"):
+            raise RuntimeError(f"query {query_id} {status['State']}: {status.get('StateChangeReason', '')}")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"query {query_id} still {status['State']} after {timeout}s")
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+
+
+def register(athena, database, table, location, parts, layout, output, mode="alter", timeout=60):
+    # adds only the given partitions; with partition projection the catalog is not touched at all
+    if mode == "projection" or not parts:
+        return []
+    if mode != "alter":
+        raise ValueError(f"unknown partition registration {mode!r}, expected 'alter' or 'projection'")
+    parts = sorted(set(parts))
+    query_ids = []
+    for i in range(0, len(parts), ADD_BATCH):
+        query_id = athena.start_query_execution(
+            QueryString=add_partitions_sql(database, table, location, parts[i:i + ADD_BATCH], layout),
+            QueryExecutionContext={"Database": database},
+            ResultConfiguration={"OutputLocation": output},
+        )["QueryExecutionId"]
+        wait(athena, query_id, timeout)
+        query_ids.append(query_id)
+    return query_ids
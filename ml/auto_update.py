@@ -2,7 +2,12 @@ import json
 import os
 import boto3
 import time
+import hashlib
+import concurrent.futures as cf
 from datetime import datetime, timezone
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import instrumentation
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 ENDPOINT_NAME = os.getenv("ENDPOINT_NAME", "btc-volatility-endpoint")
@@ -10,87 +15,231 @@ MODEL_NAME = os.getenv("MODEL_NAME", "btc-volatility-model")
 ENDPOINT_CONFIG_PREFIX = os.getenv("ENDPOINT_CONFIG_PREFIX", "btc-volatility-config")
 BUCKET = os.getenv("BUCKET", "btc-prices-decision")
 MODEL_ARTIFACT_PREFIX = os.getenv("MODEL_ARTIFACT_PREFIX", "models/volatility_model/volatility_model.joblib")
+# content-addressed artifacts written by training_job.py: <REGISTRY_PREFIX>/<sha256>/volatility_model.joblib
+REGISTRY_PREFIX = os.getenv("REGISTRY_PREFIX", f"{os.path.dirname(MODEL_ARTIFACT_PREFIX)}/registry")
+LIVE_KEY = f"{REGISTRY_PREFIX}/live.json"
 ROLE_ARN = os.getenv("SAGEMAKER_ROLE_ARN", "<YOUR-SAGEMAKER-EXECUTION-ROLE-ARN>")
 INFERENCE_IMAGE = os.getenv("INFERENCE_IMAGE", "683313688378.dkr.ecr.us-east-1.amazonaws.com/sklearn-inference:1.2-cpu-py3")
+# endpoint status polling: first wait, cap and overall limit in seconds
+POLL_INITIAL = float(os.getenv("POLL_INITIAL", "5"))
+POLL_MAX = float(os.getenv("POLL_MAX", "60"))
+POLL_TIMEOUT = float(os.getenv("POLL_TIMEOUT", "840"))
+# models/configs of the last KEEP_VERSIONS deployed hashes survive cleanup, so rolling back to them skips create calls
+KEEP_VERSIONS = int(os.getenv("KEEP_VERSIONS", "3"))
+CLEANUP_WORKERS = int(os.getenv("CLEANUP_WORKERS", "8"))
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "50"))
 
-sagemaker = boto3.client("sagemaker", region_name=AWS_REGION)
+sagemaker = boto3.client("sagemaker", region_name=AWS_REGION, config=Config(retries={"max_attempts": 10, "mode": "adaptive"}))
+s3 = boto3.client("s3", region_name=AWS_REGION)
+instrumentation.track_s3(s3)
 
+# event options:
+#   {}                                   deploy volatility_model.joblib unless its hash is already live
+#   {"sha256": "<hash or prefix>"}       deploy a registered hash
+#   {"action": "rollback"}               redeploy the hash that was live before the current one
+#   {"force": true}                      roll out even if the hash is already live
+@instrumentation.invocation("auto_update", endpoint=ENDPOINT_NAME)
 def lambda_handler(event, context):
+    event = event if isinstance(event, dict) else {}
     try:
-        ts = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
-        new_config_name = f"{ENDPOINT_CONFIG_PREFIX}-{ts}"
-        new_model_name = f"{MODEL_NAME}-{ts}"
-        model_data_url = f"s3://{BUCKET}/{MODEL_ARTIFACT_PREFIX}"
+        live = read_live()
+        with instrumentation.stage("resolve"):
+            if event.get("action") == "rollback":
+                digest = rollback_target(live)
+            elif event.get("sha256"):
+                digest = find_registered(event["sha256"])
+            else:
+                digest = register_current()
+        instrumentation.annotate(sha256=digest)
+        names = resource_names(digest)
+        if digest == live.get("sha256") and not event.get("force") and is_serving(live.get("config")):
+            print(f"Model {digest[:12]} is already live on {ENDPOINT_NAME}, nothing to roll out")
+            instrumentation.annotate(rollout="skipped")
+            return response(200, digest, names, "Unchanged")
+
+        model_data_url = f"s3://{BUCKET}/{REGISTRY_PREFIX}/{digest}/{os.path.basename(MODEL_ARTIFACT_PREFIX)}"
         print(f"Using model artifact: {model_data_url}")
-        print(f"Creating model: {new_model_name}")
-        sagemaker.create_model(
-            ModelName=new_model_name,
-            ExecutionRoleArn=ROLE_ARN,
-            PrimaryContainer={
-                "Image": INFERENCE_IMAGE,
-                "ModelDataUrl": model_data_url,
-                "Mode": "SingleModel"
-            }
-        )
-        print(f"Creating endpoint config: {new_config_name}")
-        sagemaker.create_endpoint_config(
-            EndpointConfigName=new_config_name,
-            ProductionVariants=[
-                {
-                    "VariantName": "AllTraffic",
-                    "ModelName": new_model_name,
-                    "InitialInstanceCount": 1,
-                    "InstanceType": "ml.m5.large",
-                    "InitialVariantWeight": 1.0
-                }
-            ]
-        )
+        with instrumentation.stage("create_model"):
+            if not exists(sagemaker.describe_model, ModelName=names["model"]):
+                print(f"Creating model: {names['model']}")
+                sagemaker.create_model(
+                    ModelName=names["model"],
+                    ExecutionRoleArn=ROLE_ARN,
+                    PrimaryContainer={
+                        "Image": INFERENCE_IMAGE,
+                        "ModelDataUrl": model_data_url,
+                        "Mode": "SingleModel"
+                    }
+                )
+        with instrumentation.stage("create_config"):
+            if not exists(sagemaker.describe_endpoint_config, EndpointConfigName=names["config"]):
+                print(f"Creating endpoint config: {names['config']}")
+                sagemaker.create_endpoint_config(
+                    EndpointConfigName=names["config"],
+                    ProductionVariants=[
+                        {
+                            "VariantName": "AllTraffic",
+                            "ModelName": names["model"],
+                            "InitialInstanceCount": 1,
+                            "InstanceType": "ml.m5.large",
+                            "InitialVariantWeight": 1.0
+                        }
+                    ]
+                )
         print(f"Updating endpoint {ENDPOINT_NAME}")
-        sagemaker.update_endpoint(
-            EndpointName=ENDPOINT_NAME,
-            EndpointConfigName=new_config_name
-        )
+        with instrumentation.stage("update_endpoint"):
+            sagemaker.update_endpoint(
+                EndpointName=ENDPOINT_NAME,
+                EndpointConfigName=names["config"]
+            )
         print("Waiting for endpoint to become InService")
-        while True:
-            status = sagemaker.describe_endpoint(EndpointName=ENDPOINT_NAME)["EndpointStatus"]
-            print("Status:", status)
-            if status in ("InService", "Failed"):
-                break
-            time.sleep(60)
+        with instrumentation.stage("wait"):
+            status = wait_for_endpoint()
+        if status != "InService":
+            raise RuntimeError(f"endpoint {ENDPOINT_NAME} ended in status {status}")
+        live = write_live(live, digest, names)
+        instrumentation.annotate(rollout="deployed")
         cleanup_old = os.getenv("CLEANUP_OLD", "false").lower() == "true"
         if cleanup_old:
-            cleanup_old_resources(current_model=new_model_name, current_config=new_config_name)
-        print(f"Endpoint {ENDPOINT_NAME} is now serving model {new_model_name}")
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "endpoint": ENDPOINT_NAME,
-                "model": new_model_name,
-                "config": new_config_name,
-                "status": "InService"
-            })
-        }
+            with instrumentation.stage("cleanup"):
+                keep = [resource_names(h["sha256"]) for h in live["history"][:KEEP_VERSIONS]]
+                cleanup_old_resources(keep_models={k["model"] for k in keep}, keep_configs={k["config"] for k in keep})
+        print(f"Endpoint {ENDPOINT_NAME} is now serving model {names['model']}")
+        return response(200, digest, names, "InService")
     except Exception as e:
         print("Endpoint update failed:", e)
+        instrumentation.mark_error(f"{type(e).__name__}: {e}")
         return {"statusCode": 500, "error": str(e)}
 
-def cleanup_old_resources(current_model, current_config):
+def response(code, digest, names, status):
+    return {
+        "statusCode": code,
+        "body": json.dumps({
+            "endpoint": ENDPOINT_NAME,
+            "sha256": digest,
+            "model": names["model"],
+            "config": names["config"],
+            "status": status
+        })
+    }
+
+def resource_names(digest):
+    # named by content, so the same artifact always maps to the same model and config
+    return {"model": f"{MODEL_NAME}-{digest[:16]}", "config": f"{ENDPOINT_CONFIG_PREFIX}-{digest[:16]}"}
+
+def exists(describe, **kwargs):
+    try:
+        describe(**kwargs)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ValidationException":
+            return False
+        raise
+
+def is_serving(config):
+    if not config:
+        return False
+    try:
+        endpoint = sagemaker.describe_endpoint(EndpointName=ENDPOINT_NAME)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ValidationException":
+            return False
+        raise
+    return endpoint["EndpointStatus"] == "InService" and endpoint["EndpointConfigName"] == config
+
+def wait_for_endpoint():
+    delay, deadline = POLL_INITIAL, time.monotonic() + POLL_TIMEOUT
+    while True:
+        status = sagemaker.describe_endpoint(EndpointName=ENDPOINT_NAME)["EndpointStatus"]
+        print("Status:", status)
+        instrumentation.count("status_polls")
+        if status in ("InService", "Failed"):
+            return status
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"endpoint {ENDPOINT_NAME} still {status} after {POLL_TIMEOUT:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX)
+
+def read_live():
+    try:
+        return json.loads(s3.get_object(Bucket=BUCKET, Key=LIVE_KEY)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return {"history": []}
+
+def write_live(live, digest, names):
+    deployed = {"sha256": digest, **names, "deployed_at": datetime.now(timezone.utc).isoformat()}
+    history = [deployed] + [h for h in live.get("history", []) if h["sha256"] != digest]
+    live = {**deployed, "history": history[:HISTORY_LIMIT]}
+    s3.put_object(Bucket=BUCKET, Key=LIVE_KEY, Body=json.dumps(live, indent=2).encode("utf-8"))
+    return live
+
+def rollback_target(live):
+    history = live.get("history", [])
+    if len(history) < 2:
+        raise RuntimeError("no previous deployment to roll back to")
+    print(f"Rolling back from {history[0]['sha256'][:12]} to {history[1]['sha256'][:12]}")
+    return history[1]["sha256"]
+
+def find_registered(wanted):
+    # a full hash or a unique prefix of one
+    paginator = s3.get_paginator("list_objects_v2")
+    found = set()
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f"{REGISTRY_PREFIX}/{wanted}", Delimiter="/"):
+        found.update(cp["Prefix"].rstrip("/").rsplit("/", 1)[-1] for cp in page.get("CommonPrefixes", []))
+    if len(found) != 1:
+        raise RuntimeError(f"{len(found)} registered models match {wanted}")
+    return found.pop()
+
+def register_current():
+    # training_job.py stores the hash as object metadata and registers the artifact itself;
+    # artifacts uploaded any other way are hashed here and copied into the registry
+    head = s3.head_object(Bucket=BUCKET, Key=MODEL_ARTIFACT_PREFIX)
+    digest = head.get("Metadata", {}).get("sha256")
+    if digest is None:
+        h = hashlib.sha256()
+        for chunk in s3.get_object(Bucket=BUCKET, Key=MODEL_ARTIFACT_PREFIX, IfMatch=head["ETag"])["Body"].iter_chunks(8 * 1024 * 1024):
+            h.update(chunk)
+        digest = h.hexdigest()
+    registry_key = f"{REGISTRY_PREFIX}/{digest}/{os.path.basename(MODEL_ARTIFACT_PREFIX)}"
+    try:
+        s3.head_object(Bucket=BUCKET, Key=registry_key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        print(f"Registering {MODEL_ARTIFACT_PREFIX} as {digest[:12]}")
+        s3.copy({"Bucket": BUCKET, "Key": MODEL_ARTIFACT_PREFIX}, BUCKET, registry_key)
+        metrics_key = f"{os.path.dirname(MODEL_ARTIFACT_PREFIX)}/metrics.json"
+        try:
+            s3.copy_object(CopySource={"Bucket": BUCKET, "Key": metrics_key}, Bucket=BUCKET, Key=f"{REGISTRY_PREFIX}/{digest}/metrics.json")
+        except ClientError as e:
+            print("No metrics to register:", e)
+    return digest
+
+def cleanup_old_resources(keep_models, keep_configs):
     print("Cleaning up old endpoint configs and models")
-    configs = sagemaker.list_endpoint_configs(SortBy="CreationTime", SortOrder="Descending")
-    for c in configs.get("EndpointConfigs", []):
-        name = c["EndpointConfigName"]
-        if name != current_config and name.startswith(ENDPOINT_CONFIG_PREFIX):
-            try:
-                print(f"Deleting old config: {name}")
-                sagemaker.delete_endpoint_config(EndpointConfigName=name)
-            except Exception as e:
-                print("Failed to delete config:", e)
-    models = sagemaker.list_models(SortBy="CreationTime", SortOrder="Descending")
-    for m in models.get("Models", []):
-        name = m["ModelName"]
-        if name != current_model and name.startswith(MODEL_NAME):
+    configs = [
+        c["EndpointConfigName"]
+        for page in sagemaker.get_paginator("list_endpoint_configs").paginate(NameContains=ENDPOINT_CONFIG_PREFIX)
+        for c in page.get("EndpointConfigs", [])
+        if c["EndpointConfigName"].startswith(ENDPOINT_CONFIG_PREFIX) and c["EndpointConfigName"] not in keep_configs
+    ]
+    models = [
+        m["ModelName"]
+        for page in sagemaker.get_paginator("list_models").paginate(NameContains=MODEL_NAME)
+        for m in page.get("Models", [])
+        if m["ModelName"].startswith(MODEL_NAME) and m["ModelName"] not in keep_models
+    ]
+    deleted = {"config": 0, "model": 0}
+    with cf.ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as ex:
+        futures = {ex.submit(sagemaker.delete_endpoint_config, EndpointConfigName=name): ("config", name) for name in configs}
+        futures.update({ex.submit(sagemaker.delete_model, ModelName=name): ("model", name) for name in models})
+        for fut in cf.as_completed(futures):
+            kind, name = futures[fut]
             try:
-                print(f"Deleting old model: {name}")
-                sagemaker.delete_model(ModelName=name)
+                fut.result()
+                deleted[kind] += 1
             except Exception as e:
-                print("Failed to delete model:", e)
+                print(f"Failed to delete {kind} {name}:", e)
+    print(f"Deleted {deleted['config']} of {len(configs)} configs and {deleted['model']} of {len(models)} models")
+    instrumentation.count("configs_deleted", deleted["config"])
+    instrumentation.count("models_deleted", deleted["model"])
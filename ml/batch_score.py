@@ -0,0 +1,182 @@
+import os
+import io
+import sys
+import json
+import time
+import traceback
+import multiprocessing as mp
+import concurrent.futures as cf
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import instrumentation
+import partitions
+import training_job as tj
+
+# scores processed_partitioned/ (features_partitioned/ with feature_source=store) with the latest volatility_model.joblib into a year= partitioned dataset.
+# a year is rescored only when its input files or the model changed since the last run
+predictions_prefix = os.getenv("predictions_prefix", "predictions_partitioned")
+score_state_key = os.getenv("score_state_key", f"state/{predictions_prefix}/score_state.json")
+score_workers = int(os.getenv("score_workers", str(os.cpu_count() or 1)))
+score_chunk_rows = int(os.getenv("score_chunk_rows", "100000"))
+score_force = os.getenv("score_force", "false").lower() == "true"
+local_model_file = "scoring_model.joblib"
+
+OUTPUT_SCHEMA = pa.schema([
+    ("day", pa.date32()),
+    ("avg_price_usd", pa.float64()),
+    ("min_price_usd", pa.float64()),
+    ("max_price_usd", pa.float64()),
+    ("daily_range", pa.float64()),
+    ("predicted_range", pa.float64()),
+    ("model_version", pa.string()),
+    ("scored_at", pa.string()),
+])
+
+# set in each worker by init_worker
+_model = None
+
+def model_version():
+    head = tj.s3.head_object(Bucket=tj.bucket, Key=f"{tj.artifact_prefix}/{tj.model_name}")
+    return head["ETag"].strip('"')
+
+def read_state():
+    try:
+        body = tj.s3.get_object(Bucket=tj.bucket, Key=score_state_key)["Body"].read()
+    except tj.s3.exceptions.NoSuchKey:
+        return {"years": {}}
+    return json.loads(body)
+
+def write_state(state):
+    tj.s3.put_object(Bucket=tj.bucket, Key=score_state_key, Body=json.dumps(state, indent=2).encode("utf-8"),
+                     ContentType="application/json")
+
+def init_worker(path):
+    global _model
+    import joblib
+    _model = joblib.load(path)
+    # partitions already run one per core
+    _model.set_params(n_jobs=1)
+
+def score_chunk(df, year, version, scored_at):
+    table = tj.compact_table(df, year)
+    x = table.to_pandas()
+    x = x[x[tj.features].notna().all(axis=1)]
+    # a row without a valid day cannot be keyed in the output, so it is skipped and counted
+    null_days = int(x["day"].isna().sum())
+    x = x.dropna(subset=["day"])
+    if x.empty:
+        return None, null_days
+    preds = _model.predict(x[tj.features])
+    n = len(x)
+    return pa.table({
+        "day": pa.array(x["day"].to_numpy(dtype=np.int32), type=pa.int32()).cast(pa.date32()),
+        "avg_price_usd": x["avg_price_usd"].to_numpy(dtype=np.float64),
+        "min_price_usd": x["min_price_usd"].to_numpy(dtype=np.float64),
+        "max_price_usd": x["max_price_usd"].to_numpy(dtype=np.float64),
+        "daily_range": (x["max_price_usd"] - x["min_price_usd"]).to_numpy(dtype=np.float64),
+        "predicted_range": preds.astype(np.float64),
+        "model_version": pa.array([version] * n, type=pa.string()),
+        "scored_at": pa.array([scored_at] * n, type=pa.string()),
+    }, schema=OUTPUT_SCHEMA), null_days
+
+def score_partition(args):
+    # streams one year file by file and chunk by chunk into a single Parquet object, one row group per chunk
+    year, objects, version, scored_at = args
+    started = time.time()
+    buf = io.BytesIO()
+    rows = null_days = 0
+    # newest file first: a day appended again by parquet_convert.py is scored once, from the newest file
+    seen = set()
+    with pq.ParquetWriter(buf, OUTPUT_SCHEMA, compression="snappy") as writer:
+        for obj in sorted(objects, key=lambda o: partitions.write_order(o["Key"]), reverse=True):
+            df, _ = tj.read_object(tj.bucket, obj)
+            days = pd.to_datetime(df["day"], errors="coerce") if "day" in df.columns else None
+            if days is not None:
+                fresh = ~days.isin(seen)
+                seen.update(days[fresh].dropna())
+                df = df[fresh.to_numpy()]
+            for start in range(0, len(df), score_chunk_rows):
+                table, skipped = score_chunk(df.iloc[start:start + score_chunk_rows], year, version, scored_at)
+                null_days += skipped
+                if table is not None:
+                    writer.write_table(table)
+                    rows += table.num_rows
+
+    part_prefix = f"{predictions_prefix}/year={year}/"
+    key = f"{part_prefix}predictions-{version[:16]}.parquet"
+    if rows:
+        tj.s3.put_object(Bucket=tj.bucket, Key=key, Body=buf.getvalue())
+    # the new file is in place before older ones are removed, so readers never see an empty partition
+    stale = [o["Key"] for o in tj.list_s3(tj.bucket, part_prefix) if o["Key"] != key or not rows]
+    for i in range(0, len(stale), 1000):
+        tj.s3.delete_objects(Bucket=tj.bucket, Delete={"Objects": [{"Key": k} for k in stale[i:i + 1000]], "Quiet": True})
+    if null_days:
+        print(f"year {year}: skipped {null_days} rows without a valid day")
+    return {"year": year, "rows": rows, "null_days": null_days, "key": key if rows else None,
+            "seconds": round(time.time() - started, 2)}
+
+def plan(version, state, force=False):
+    with instrumentation.stage("list"):
+        listed = {year: [o for o in tj.list_s3(tj.bucket, f"{tj.prefix}/year={year}/") if not o["Key"].endswith("/")]
+                  for year in tj.selected_years()}
+    todo, skipped = [], []
+    for year, objects in sorted(listed.items()):
+        if not objects:
+            continue
+        inputs = tj.input_version(objects)
+        previous = state["years"].get(str(year), {})
+        if not force and previous.get("input_version") == inputs and previous.get("model_version") == version:
+            skipped.append(year)
+        else:
+            todo.append((year, objects, inputs))
+    return todo, skipped
+
+@instrumentation.invocation("batch_score")
+def main():
+    try:
+        version = model_version()
+        state = read_state()
+        todo, skipped = plan(version, state, force=score_force)
+        print(f"model {version}: {len(todo)} partitions to score, {len(skipped)} unchanged {skipped}")
+        instrumentation.annotate(model_version=version, partitions=len(todo), skipped=len(skipped))
+        if not todo:
+            return
+
+        with instrumentation.stage("load_model"):
+            tj.s3.download_file(tj.bucket, f"{tj.artifact_prefix}/{tj.model_name}", local_model_file)
+        scored_at = tj.now_iso()
+        # spawned workers build their own boto3 clients; forked ones would share the parent's connection pool
+        ctx = mp.get_context("spawn")
+        with instrumentation.stage("score"), cf.ProcessPoolExecutor(
+                max_workers=min(score_workers, len(todo)), mp_context=ctx,
+                initializer=init_worker, initargs=(local_model_file,)) as ex:
+            jobs = [(year, objects, version, scored_at) for year, objects, _ in todo]
+            try:
+                for (year, _, inputs), result in zip(todo, ex.map(score_partition, jobs)):
+                    print(json.dumps(result))
+                    instrumentation.count("rows_scored", result["rows"])
+                    instrumentation.count("rows_without_day", result["null_days"])
+                    state["years"][str(year)] = {
+                        "input_version": inputs,
+                        "model_version": version,
+                        "rows": result["rows"],
+                        "key": result["key"],
+                        "scored_at": scored_at,
+                    }
+            finally:
+                # partitions finished before a failure are not rescored on the next run
+                state["updated"] = tj.now_iso()
+                write_state(state)
+        print(f"scored {len(todo)} partitions into s3://{tj.bucket}/{predictions_prefix}/")
+    except Exception as e:
+        print("batch scoring failed:", e)
+        traceback.print_exc()
+        instrumentation.mark_error(f"{type(e).__name__}: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
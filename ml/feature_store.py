@@ -0,0 +1,173 @@
+import io
+import os
+import sys
+import json
+import traceback
+import concurrent.futures as cf
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import instrumentation
+import partitions
+import training_job as tj
+import window_features
+
+# builds features_partitioned/year=YYYY/features.parquet from processed_partitioned/: the daily prices plus
+# the lagged and rolling columns of window_features.py. A year is recomputed only when its input files changed,
+# or when the last days of the year before it (the window state it starts from) changed. Those days are kept
+# in the state file, so appending a day rereads and rewrites just the current year.
+source_prefix = os.getenv("prefix", "processed_partitioned")
+feature_state_key = os.getenv("feature_state_key", f"state/{tj.feature_prefix}/feature_state.json")
+feature_force = os.getenv("feature_force", "false").lower() == "true"
+feature_name = "features.parquet"
+windows = tj.feature_windows
+carry_days = window_features.lookback(windows)
+
+OUTPUT_SCHEMA = pa.schema(
+    [("day", pa.date32()), ("year", pa.int16())]
+    + [(c, pa.float32()) for c in window_features.PRICE_COLS + [tj.target_col] + tj.store_features]
+)
+
+def read_state():
+    try:
+        body = tj.s3.get_object(Bucket=tj.bucket, Key=feature_state_key)["Body"].read()
+    except tj.s3.exceptions.NoSuchKey:
+        return {"years": {}}
+    state = json.loads(body)
+    if state.get("windows") != list(windows):
+        print(f"feature windows changed from {state.get('windows')} to {list(windows)}, rebuilding every year")
+        return {"years": {}}
+    return state
+
+def write_state(state):
+    state["windows"] = list(windows)
+    state["updated"] = tj.now_iso()
+    tj.s3.put_object(Bucket=tj.bucket, Key=feature_state_key, Body=json.dumps(state, indent=2).encode("utf-8"),
+                     ContentType="application/json")
+
+def store_years():
+    # exclude_years only filters what training reads; the store keeps the series continuous
+    return list(range(tj.start_year, tj.end_year + 1))
+
+def read_year(year, objects):
+    # one row per day with avg/min/max; the last file wins when a day appears twice
+    frames = []
+    for obj, df, err, _ in map(tj.safe_read, [(tj.bucket, o) for o in sorted(objects, key=lambda o: partitions.write_order(o["Key"]))]):
+        if err is not None:
+            raise RuntimeError(f"failed to read s3://{tj.bucket}/{obj['Key']}: {err}")
+        frames.append(tj.compact_table(df, year).select(["day"] + window_features.PRICE_COLS).to_pandas())
+    df = pd.concat(frames, ignore_index=True).dropna()
+    df["day"] = df["day"].astype(np.int64)
+    return df.drop_duplicates("day", keep="last").sort_values("day", ignore_index=True)
+
+def build_year(year, base, carry):
+    # carry: the previous year's last carry_days days, only read by the windows and not written again
+    series = pd.concat([carry, base], ignore_index=True) if len(carry) else base
+    values = window_features.compute(series["day"].to_numpy(), series[window_features.PRICE_COLS].to_numpy(), windows)
+    values = values[len(series) - len(base):]
+    prices = base[window_features.PRICE_COLS].to_numpy(dtype=np.float32)
+    columns = {
+        "day": pa.array(base["day"].to_numpy(dtype=np.int32), type=pa.int32()).cast(pa.date32()),
+        "year": pa.array(np.full(len(base), year, dtype=np.int16)),
+    }
+    for i, c in enumerate(window_features.PRICE_COLS):
+        columns[c] = prices[:, i]
+    columns[tj.target_col] = prices[:, 2] - prices[:, 1]
+    for i, c in enumerate(tj.store_features):
+        columns[c] = values[:, i]
+    return pa.table(columns, schema=OUTPUT_SCHEMA)
+
+def tail_of(year, base):
+    last = pd.Timestamp(year, 12, 31).toordinal() - pd.Timestamp(1970, 1, 1).toordinal()
+    return base[base["day"] > last - carry_days].to_numpy().tolist()
+
+def write_year(year, table):
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression="snappy")
+    key = f"{tj.feature_prefix}/year={year}/{feature_name}"
+    tj.s3.put_object(Bucket=tj.bucket, Key=key, Body=buf.getvalue())
+    return key
+
+def delete_year(year):
+    keys = [o["Key"] for o in tj.list_s3(tj.bucket, f"{tj.feature_prefix}/year={year}/")]
+    if keys:
+        tj.s3.delete_objects(Bucket=tj.bucket, Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True})
+
+@instrumentation.invocation("feature_store")
+def main():
+    try:
+        state = read_state()
+        with instrumentation.stage("list"), cf.ThreadPoolExecutor(max_workers=tj.max_workers) as ex:
+            years = store_years()
+            listed = dict(zip(years, ex.map(
+                lambda y: [o for o in tj.list_s3(tj.bucket, f"{source_prefix}/year={y}/") if not o["Key"].endswith("/")],
+                years)))
+        versions = {y: tj.input_version(objects) for y, objects in listed.items() if objects}
+        changed = {y for y in years
+                   if feature_force or versions.get(y) != state["years"].get(str(y), {}).get("input_version")}
+        if not changed:
+            print("no input partition changed, features are up to date")
+            instrumentation.annotate(years_built=0)
+            return
+
+        # years before the first change keep their features; later ones start from the stored window state
+        first = min(changed)
+        to_read = sorted(y for y in changed if y in versions)
+        print(f"changed years {sorted(changed)}, reading {to_read}")
+        with instrumentation.stage("read"), cf.ThreadPoolExecutor(max_workers=tj.max_workers) as ex:
+            bases = dict(zip(to_read, ex.map(lambda y: read_year(y, listed[y]), to_read)))
+
+        built = []
+        try:
+            previous_tail = state["years"].get(str(first - 1), {}).get("tail", [])
+            tail_changed = False
+            for year in (y for y in years if y >= first):
+                entry = state["years"].get(str(year))
+                if year not in changed and not tail_changed:
+                    previous_tail = entry["tail"] if entry else []
+                    continue
+                if year not in versions:
+                    with instrumentation.stage("write"):
+                        delete_year(year)
+                    state["years"].pop(str(year), None)
+                    tail_changed = previous_tail != []
+                    previous_tail = []
+                    continue
+                if year not in bases:
+                    with instrumentation.stage("read"):
+                        bases[year] = read_year(year, listed[year])
+                base = bases.pop(year)
+                carry = pd.DataFrame(previous_tail, columns=["day"] + window_features.PRICE_COLS)
+                with instrumentation.stage("compute"):
+                    table = build_year(year, base, carry)
+                with instrumentation.stage("write"):
+                    key = write_year(year, table)
+                tail = tail_of(year, base)
+                tail_changed = tail != (entry or {}).get("tail")
+                previous_tail = tail
+                state["years"][str(year)] = {
+                    "input_version": versions[year],
+                    "rows": table.num_rows,
+                    "key": key,
+                    "tail": tail,
+                    "built_at": tj.now_iso(),
+                }
+                built.append(year)
+                instrumentation.count("rows_written", table.num_rows)
+                print(f"year {year}: {table.num_rows} rows -> s3://{tj.bucket}/{key}")
+        finally:
+            # years finished before a failure are not rebuilt on the next run
+            write_state(state)
+        instrumentation.annotate(years_built=len(built))
+        print(f"built {len(built)} years {built} into s3://{tj.bucket}/{tj.feature_prefix}/")
+    except Exception as e:
+        print("feature store build failed:", e)
+        traceback.print_exc()
+        instrumentation.mark_error(f"{type(e).__name__}: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import json
+import numpy as np
+
+# a fitted RandomForestRegressor flattened into contiguous node arrays shared by all trees.
+# leaves point to themselves, so every row walks exactly max_depth steps in every tree and
+# a batch of rows is evaluated across all trees with a handful of numpy gathers per level
+
+FORMAT = "flat-forest-v1"
+ALIGN = 64
+
+def flatten_forest(model, feature_names=None):
+    trees = [est.tree_ for est in model.estimators_]
+    sizes = np.array([t.node_count for t in trees], dtype=np.int64)
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+    n = int(sizes.sum())
+    feature = np.zeros(n, dtype=np.int32)
+    threshold = np.full(n, np.inf, dtype=np.float64)
+    children = np.zeros((n, 2), dtype=np.int32)
+    missing_left = np.ones(n, dtype=np.bool_)
+    value = np.zeros(n, dtype=np.float64)
+    for root, t in zip(roots, trees):
+        idx = slice(root, root + t.node_count)
+        own = np.arange(root, root + t.node_count, dtype=np.int32)
+        leaf = t.children_left == -1
+        feature[idx] = np.where(leaf, 0, t.feature)
+        threshold[idx] = np.where(leaf, np.inf, t.threshold)
+        children[idx, 0] = np.where(leaf, own, t.children_left + root)
+        children[idx, 1] = np.where(leaf, own, t.children_right + root)
+        go_left = getattr(t, "missing_go_to_left", None)
+        if go_left is not None:
+            missing_left[idx] = np.where(leaf, True, np.asarray(go_left, dtype=bool))
+        value[idx] = t.value[:, 0, 0]
+    if feature_names is None:
+        feature_names = [str(f) for f in getattr(model, "feature_names_in_", range(model.n_features_in_))]
+    meta = {
+        "format": FORMAT,
+        "n_features": int(model.n_features_in_),
+        "n_trees": len(trees),
+        "max_depth": int(max(t.max_depth for t in trees)),
+        "feature_names": list(feature_names),
+    }
+    arrays = {"roots": roots, "feature": feature, "threshold": threshold, "children": children,
+              "missing_left": missing_left, "value": value}
+    return FlatForest(arrays, meta)
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+class FlatForest:
+    def __init__(self, arrays, meta):
+        # plain ndarray views keep memmap-backed buffers but skip the np.memmap subclass overhead on every gather
+        arrays = {name: arr.view(np.ndarray) for name, arr in arrays.items()}
+        self.meta = meta
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.missing_left = arrays["missing_left"]
+        self.value = arrays["value"]
+        # children as [left, right] pairs, so the next node is child_pairs[2 * node + go_right]
+        self._child_pairs = self.children.reshape(-1)
+        self.max_depth = meta["max_depth"]
+        self.feature_names = meta["feature_names"]
+
+    def arrays(self):
+        return {"roots": self.roots, "feature": self.feature, "threshold": self.threshold,
+                "children": self.children, "missing_left": self.missing_left, "value": self.value}
+
+    def save(self, path):
+        # layout: 8-byte header length, JSON header, then each array at a 64-byte aligned offset
+        layout, offset = {}, 0
+        for name, arr in self.arrays().items():
+            layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+            offset = _aligned(offset + arr.nbytes)
+        header = json.dumps({**self.meta, "arrays": layout}).encode("utf-8")
+        data_start = _aligned(8 + len(header))
+        with open(path, "wb") as f:
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for name, arr in self.arrays().items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(np.ascontiguousarray(arr).tobytes())
+            f.truncate(data_start + offset)
+        return data_start + offset
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # with mmap the arrays are paged in on first use, so a cold start costs one header read
+        with open(path, "rb") as f:
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len))
+            raw = None if mmap else f.read()
+        data_start = _aligned(8 + header_len)
+        arrays = {}
+        for name, spec in header.pop("arrays").items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            if mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=data_start + spec["offset"], shape=shape)
+            else:
+                start = data_start + spec["offset"] - (8 + header_len)
+                count = int(np.prod(shape))
+                arrays[name] = np.frombuffer(raw, dtype=dtype, count=count, offset=start).reshape(shape)
+        if header.get("format") != FORMAT:
+            raise ValueError(f"unsupported forest format {header.get('format')}")
+        return cls(arrays, header)
+
+    def predict(self, x, chunk_rows=4096):
+        if hasattr(x, "columns"):
+            x = x[self.feature_names]
+        # same input precision as sklearn's trees: float32 features against float64 thresholds
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        out = np.empty(len(x), dtype=np.float64)
+        for start in range(0, len(x), chunk_rows):
+            out[start:start + chunk_rows] = self._predict_chunk(x[start:start + chunk_rows])
+        return out
+
+    def _predict_chunk(self, x):
+        n_rows, n_features = x.shape
+        flat = x.ravel()
+        row_base = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots))).astype(np.intp)
+        has_nan = np.isnan(flat).any()
+        for _ in range(self.max_depth):
+            values = flat[row_base + self.feature[nodes]]
+            go_right = ~(values <= self.threshold[nodes])
+            if has_nan:
+                go_right = np.where(np.isnan(values), ~self.missing_left[nodes], go_right)
+            nodes = self._child_pairs[2 * nodes + go_right]
+        return self.value[nodes].mean(axis=1)
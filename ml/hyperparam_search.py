@@ -0,0 +1,171 @@
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import itertools
+import traceback
+import multiprocessing as mp
+import concurrent.futures as cf
+from multiprocessing import shared_memory
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score, mean_squared_error
+
+import instrumentation
+import training_job as tj
+
+search_mode = os.getenv("search_mode", "grid").lower()
+search_grid = json.loads(os.getenv("search_grid", json.dumps({
+    "n_estimators": [100, 300, 500],
+    "max_depth": [6, 12, 18],
+    "min_samples_leaf": [1, 5],
+})))
+search_samples = int(os.getenv("search_samples", "20"))
+search_folds = int(os.getenv("search_folds", "4"))
+search_workers = int(os.getenv("search_workers", str(os.cpu_count() or 1)))
+# a config is stopped once a fold scores worse than prune_ratio times the best MAE seen on that fold
+prune_ratio = float(os.getenv("prune_ratio", "1.5"))
+search_prefix = f"{tj.artifact_prefix}/search"
+
+# set in each worker by init_worker; the arrays are views on shared memory, never pickled copies
+_x = _y = _shm = _best = None
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def walk_forward_folds(n, n_folds):
+    # expanding window over time-ordered rows: fold i trains on blocks 0..i and tests on block i + 1
+    edges = np.linspace(0, n, n_folds + 2, dtype=int)
+    return [(edges[i + 1], edges[i + 2]) for i in range(n_folds)]
+
+def candidate_configs():
+    keys = sorted(search_grid)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(search_grid[k] for k in keys))]
+    if search_mode == "random" and len(grid) > search_samples:
+        grid = random.Random(tj.random_state).sample(grid, search_samples)
+    return grid
+
+def share_array(arr):
+    shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+def init_worker(x_spec, y_spec, best):
+    global _x, _y, _shm, _best
+    _shm = []
+    views = []
+    for name, shape, dtype in (x_spec, y_spec):
+        shm = shared_memory.SharedMemory(name=name)
+        _shm.append(shm)
+        views.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+    _x, _y = views
+    _best = best
+
+def evaluate(args):
+    config_id, params, folds = args
+    started = time.time()
+    maes, rmses, r2s, status = [], [], [], "ok"
+    for i, (train_end, test_end) in enumerate(folds):
+        model = RandomForestRegressor(random_state=tj.random_state, n_jobs=1, **params)
+        model.fit(_x[:train_end], _y[:train_end])
+        preds = model.predict(_x[train_end:test_end])
+        y_test = _y[train_end:test_end]
+        maes.append(float(mean_absolute_error(y_test, preds)))
+        rmses.append(float(math.sqrt(mean_squared_error(y_test, preds))))
+        r2s.append(float(r2_score(y_test, preds)))
+        with _best.get_lock():
+            fold_best = _best[i]
+            _best[i] = min(fold_best, maes[-1])
+        if i < len(folds) - 1 and maes[-1] > prune_ratio * fold_best:
+            status = "pruned"
+            break
+    mean_mae = float(np.mean(maes))
+    return {
+        "config_id": config_id,
+        "params": json.dumps(params, sort_keys=True),
+        "status": status,
+        "folds": len(maes),
+        "mae": mean_mae,
+        "rmse": float(np.mean(rmses)),
+        "r2": float(np.mean(r2s)),
+        "seconds": round(time.time() - started, 2),
+    }
+
+def run_search(df):
+    df = df.sort_values("day")
+    # float32 is what the forest uses internally, so sharing it avoids a per-worker conversion copy
+    x = np.ascontiguousarray(df[tj.features].to_numpy(dtype=np.float32))
+    y = np.ascontiguousarray(df[tj.target_col].to_numpy(dtype=np.float64))
+    folds = walk_forward_folds(len(df), search_folds)
+    configs = candidate_configs()
+    print(f"searching {len(configs)} configs x {len(folds)} walk-forward folds on {search_workers} workers")
+
+    x_shm, x_spec = share_array(x)
+    y_shm, y_spec = share_array(y)
+    best = mp.Array("d", [float("inf")] * len(folds))
+    try:
+        with instrumentation.stage("search"), cf.ProcessPoolExecutor(max_workers=search_workers, initializer=init_worker,
+                                    initargs=(x_spec, y_spec, best)) as ex:
+            results = []
+            for result in ex.map(evaluate, [(i, params, folds) for i, params in enumerate(configs)]):
+                print(f"config {result['config_id']} {result['params']} {result['status']} "
+                      f"folds={result['folds']} mae={result['mae']:.3f}")
+                results.append(result)
+    finally:
+        for shm in (x_shm, y_shm):
+            shm.close()
+            shm.unlink()
+    results = pd.DataFrame(results).sort_values(["status", "mae"])
+    instrumentation.count("configs_evaluated", len(results))
+    instrumentation.count("configs_pruned", int((results["status"] == "pruned").sum()))
+    return results
+
+@instrumentation.stage("save")
+def save_results(results):
+    completed = results[results["status"] == "ok"]
+    if completed.empty:
+        raise RuntimeError("every configuration was pruned")
+    best = completed.iloc[0]
+    best_payload = {
+        "timestamp": now_iso(),
+        "params": json.loads(best["params"]),
+        "metrics": {"mae": float(best["mae"]), "rmse": float(best["rmse"]), "r2": float(best["r2"])},
+        "folds": search_folds,
+        "configs_evaluated": int(len(results)),
+        "configs_pruned": int((results["status"] == "pruned").sum()),
+    }
+    run_ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    csv_buf = io.StringIO()
+    results.to_csv(csv_buf, index=False)
+    best_bytes = json.dumps(best_payload, indent=2).encode("utf-8")
+    tj.s3.put_object(Bucket=tj.bucket, Key=f"{search_prefix}/{run_ts}/results.csv", Body=csv_buf.getvalue().encode("utf-8"))
+    tj.s3.put_object(Bucket=tj.bucket, Key=f"{search_prefix}/{run_ts}/best_config.json", Body=best_bytes)
+    tj.s3.put_object(Bucket=tj.bucket, Key=f"{search_prefix}/best_config.json", Body=best_bytes)
+    print(f"best config {best_payload['params']} mae={best_payload['metrics']['mae']:.3f}")
+    return best_payload
+
+@instrumentation.invocation("hyperparam_search", search_mode=search_mode, folds=search_folds)
+def main():
+    try:
+        df_raw, _ = tj.load_data()
+        df = tj.clean(df_raw)
+        if len(df) < tj.min_rows_to_train:
+            raise RuntimeError(f"not enough rows ({len(df)} < {tj.min_rows_to_train})")
+        results = run_search(df)
+        best = save_results(results)
+        instrumentation.annotate(best_params=best["params"], **best["metrics"])
+        print("search complete and uploaded")
+    except Exception as e:
+        print("search failed:", e)
+        traceback.print_exc()
+        instrumentation.mark_error(f"{type(e).__name__}: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import json
 import boto3
 import os
+import time
 
 sagemaker = boto3.client("sagemaker")
 
@@ -17,8 +18,12 @@ def lambda_handler(event, context):
             {
                 "InputName": "script",
                 "S3Input": {
-                    "S3Uri": "s3://<your-bucket>/scripts/train_model_pro_print.py",
-                    "LocalPath": "/opt/ml/processing/input"
+                    # training_job.py, the ml/forest.py and ml/window_features.py it imports, common/instrumentation.py and
+                    # common/partitions.py are uploaded side by side
+                    "S3Uri": "s3://<your-bucket>/scripts/",
+                    "LocalPath": "/opt/ml/processing/input",
+                    "S3DataType": "S3Prefix",
+                    "S3InputMode": "File"
                 }
             }
         ],
@@ -43,7 +48,11 @@ def lambda_handler(event, context):
         },
         Environment={
             "BUCKET": "<your-bucket>",
-            "PREFIX": "processed_partitioned"
+            "PREFIX": "processed_partitioned",
+            "train_mode": (event or {}).get("train_mode", os.environ.get("TRAIN_MODE", "full")),
+            "full_refit_every": os.environ.get("FULL_REFIT_EVERY", "7"),
+            # every Processing container starts with an empty /tmp, so the input cache would only cost writes
+            "cache_enabled": "false"
         }
     )
     return {"statusCode": 200, "body": json.dumps(response)}
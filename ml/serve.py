@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict, Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+import training_job as tj
+from forest import FlatForest
+
+# local alternative to the SageMaker endpoint: same JSON payload, SageMaker-style /invocations and /ping routes.
+# concurrent requests are grouped into micro-batches, repeated rows come from an LRU cache and the model is
+# swapped in place when its artifact ETag changes
+
+serve_host = os.getenv("serve_host", "0.0.0.0")
+serve_port = int(os.getenv("serve_port", "8080"))
+# forest (volatility_model.forest, see forest.py) or joblib (volatility_model.joblib)
+model_format = os.getenv("model_format", "forest").lower()
+model_dir = os.getenv("model_dir", "/tmp/serve_model")
+max_batch_rows = int(os.getenv("max_batch_rows", "256"))
+max_wait_ms = float(os.getenv("max_wait_ms", "2"))
+batch_workers = int(os.getenv("batch_workers", "1"))
+cache_rows = int(os.getenv("cache_rows", "100000"))
+reload_interval = float(os.getenv("reload_interval", "60"))
+latency_window = int(os.getenv("latency_window", "10000"))
+# pending connections the socket queues before accepting; the socketserver default of 5 resets bursts of clients
+listen_backlog = int(os.getenv("listen_backlog", "128"))
+
+class ModelStore:
+    def __init__(self):
+        # (model, etag) is replaced as a whole, so a batch that already picked up the old model finishes with it
+        self.active = (None, None)
+        self.lock = threading.Lock()
+        name = tj.flat_model_name if model_format == "forest" else tj.model_name
+        self.key = f"{tj.artifact_prefix}/{name}"
+
+    def refresh(self):
+        with self.lock:
+            etag = tj.s3.head_object(Bucket=tj.bucket, Key=self.key)["ETag"].strip('"')
+            if etag == self.active[1]:
+                return False
+            os.makedirs(model_dir, exist_ok=True)
+            path = os.path.join(model_dir, f"{etag}-{os.path.basename(self.key)}")
+            if not os.path.exists(path):
+                tmp = f"{path}.tmp"
+                tj.s3.download_file(tj.bucket, self.key, tmp)
+                os.replace(tmp, path)
+            self.active = (load_model(path), etag)
+            for name in os.listdir(model_dir):
+                # memory-mapped files stay readable for in-flight batches after unlink
+                if not name.startswith(etag):
+                    os.remove(os.path.join(model_dir, name))
+            print(f"serving s3://{tj.bucket}/{self.key} etag {etag}")
+            return True
+
+def load_model(path):
+    if model_format == "forest":
+        return FlatForest.load(path)
+    import joblib
+    model = joblib.load(path)
+    model.set_params(n_jobs=1)
+    return model
+
+def predict(model, x):
+    if isinstance(model, FlatForest):
+        return model.predict(x)
+    return model.predict(pd.DataFrame(x, columns=tj.features))
+
+class PredictionCache:
+    # keyed by model version and the raw float32 row, so a reload never serves stale predictions
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, version, x):
+        found = [None] * len(x)
+        if not self.max_rows:
+            return found
+        with self.lock:
+            for i, row in enumerate(x):
+                key = (version, row.tobytes())
+                value = self.entries.get(key)
+                if value is not None:
+                    self.entries.move_to_end(key)
+                    found[i] = value
+        return found
+
+    def put_many(self, version, x, preds):
+        if not self.max_rows:
+            return
+        with self.lock:
+            for row, value in zip(x, preds):
+                self.entries[(version, row.tobytes())] = float(value)
+            while len(self.entries) > self.max_rows:
+                self.entries.popitem(last=False)
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_sizes = Counter()
+        self.counts = Counter()
+
+    def record_request(self, seconds, rows, hits):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.counts.update(requests=1, rows=rows, cache_hits=hits, cache_misses=rows - hits)
+
+    def record_batch(self, rows, requests):
+        # power-of-two buckets: "1", "2", "4", ... counts batches whose row count is at most the bucket
+        bucket = 1 << max(0, rows - 1).bit_length()
+        with self.lock:
+            self.batch_sizes[str(bucket)] += 1
+            self.counts.update(batches=1, batched_requests=requests)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            counts = dict(self.counts)
+            sizes = dict(sorted(self.batch_sizes.items(), key=lambda kv: int(kv[0])))
+        return {
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+                "p99": round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+                "samples": int(len(latencies)),
+            },
+            "batch_rows_histogram": sizes,
+            **counts,
+        }
+
+class Batcher:
+    def __init__(self, store, stats):
+        self.store, self.stats = store, stats
+        self.queue = queue.Queue()
+
+    def submit(self, x):
+        item = {"x": x, "done": threading.Event(), "result": None, "version": None, "error": None}
+        self.queue.put(item)
+        item["done"].wait()
+        if item["error"] is not None:
+            raise item["error"]
+        return item["result"], item["version"]
+
+    def collect(self):
+        # waits for one request, then up to max_wait_ms for more until max_batch_rows is reached
+        batch = [self.queue.get()]
+        rows = len(batch[0]["x"])
+        deadline = time.perf_counter() + max_wait_ms / 1000
+        while rows < max_batch_rows:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item["x"])
+        return batch, rows
+
+    def run(self):
+        while True:
+            batch, rows = self.collect()
+            model, version = self.store.active
+            try:
+                preds = predict(model, np.concatenate([item["x"] for item in batch]))
+                offset = 0
+                for item in batch:
+                    n = len(item["x"])
+                    item["result"], item["version"] = preds[offset:offset + n], version
+                    offset += n
+            except Exception as e:
+                for item in batch:
+                    item["error"] = e
+            self.stats.record_batch(rows, len(batch))
+            for item in batch:
+                item["done"].set()
+
+def parse_payload(body):
+    payload = json.loads(body)
+    columns = [np.asarray(payload[f], dtype=np.float32).reshape(-1) for f in tj.features]
+    if len({len(c) for c in columns}) != 1:
+        raise ValueError("feature lists must have the same length")
+    return np.ascontiguousarray(np.column_stack(columns))
+
+def handle_invocation(x, store, cache, batcher, stats):
+    started = time.perf_counter()
+    version = store.active[1]
+    cached = cache.get_many(version, x)
+    misses = [i for i, v in enumerate(cached) if v is None]
+    preds = np.array([np.nan if v is None else v for v in cached], dtype=np.float64)
+    if misses:
+        miss_preds, served_by = batcher.submit(x[misses])
+        preds[misses] = miss_preds
+        cache.put_many(served_by, x[misses], miss_preds)
+        version = served_by
+    stats.record_request(time.perf_counter() - started, len(x), len(x) - len(misses))
+    return {"predictions": preds.tolist(), "model_version": version}
+
+def make_handler(store, cache, batcher, stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/ping":
+                ready = store.active[0] is not None
+                self.send_json(200 if ready else 503, {"status": "ok" if ready else "loading", "model_version": store.active[1]})
+            elif self.path == "/metrics":
+                self.send_json(200, {"model_version": store.active[1], **stats.snapshot()})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/invocations":
+                self.send_json(404, {"error": "not found"})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                x = parse_payload(body)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": f"bad payload: {e}"})
+                return
+            try:
+                self.send_json(200, handle_invocation(x, store, cache, batcher, stats))
+            except Exception as e:
+                print("prediction failed:", e)
+                self.send_json(500, {"error": str(e)})
+
+    return Handler
+
+def reload_loop(store):
+    while True:
+        time.sleep(reload_interval)
+        try:
+            store.refresh()
+        except Exception as e:
+            print("model reload check failed:", e)
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = listen_backlog
+    daemon_threads = True
+
+def build_server(host=serve_host, port=serve_port):
+    store, stats = ModelStore(), Stats()
+    store.refresh()
+    cache, batcher = PredictionCache(cache_rows), Batcher(store, stats)
+    for _ in range(batch_workers):
+        threading.Thread(target=batcher.run, daemon=True).start()
+    if reload_interval > 0:
+        threading.Thread(target=reload_loop, args=(store,), daemon=True).start()
+    server = Server((host, port), make_handler(store, cache, batcher, stats))
+    return server, store, stats
+
+def main():
+    server, _, _ = build_server()
+    print(f"listening on {serve_host}:{server.server_address[1]} (max_batch_rows={max_batch_rows}, max_wait_ms={max_wait_ms})")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -6,29 +6,50 @@ import time
 import math
 import gzip
 import boto3
+import hashlib
+import resource
+import threading
 import traceback
 import concurrent.futures as cf
 from datetime import datetime, timezone
 
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO 
+from botocore.config import Config as BotoConfig
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, r2_score, mean_squared_error
 
+import instrumentation
+import partitions
+import forest
+import window_features
+
 aws_region = boto3.Session().region_name or os.getenv("aws_region", "<your-aws-region>")
 s3 = boto3.client("s3", config=BotoConfig(retries={"max_attempts": 5, "mode": "adaptive"}, read_timeout=60), region_name=aws_region)
+instrumentation.track_s3(s3)
 
 bucket = os.getenv("bucket", "<your-bucket-name>")
 prefix = os.getenv("prefix", "processed_partitioned")
 start_year = int(os.getenv("start_year", "2013"))
-end_year = int(os.getenv("end_year", "2025"))
+# defaults to the current UTC year, so new days are trained on (and feature_store.py builds their year) without a config change
+end_year = int(os.getenv("end_year") or datetime.now(timezone.utc).year)
 exclude_years = {int(y) for y in os.getenv("exclude_years", "2024").split(",") if y.strip()}
 
 max_workers = int(os.getenv("max_workers", "16"))
 s3_max_attempts = int(os.getenv("s3_max_attempts", "3"))
 min_rows_to_train = int(os.getenv("min_rows_to_train", "200"))
+# objects above this size are read with ranged GETs (footer + needed column chunks only)
+range_read_min_bytes = int(os.getenv("range_read_min_bytes", str(8 * 1024 * 1024)))
+
+# local cache of S3 inputs keyed by bucket, key and ETag; least recently used files are evicted above the cap
+cache_enabled = os.getenv("cache_enabled", "true").lower() == "true"
+cache_dir = os.getenv("cache_dir", "/tmp/s3_cache")
+cache_max_bytes = int(os.getenv("cache_max_bytes", str(10 * 1024 ** 3)))
 
 time_aware_split = os.getenv("time_aware_split", "true").lower() == "true"
 test_size = float(os.getenv("test_size", "0.2"))
@@ -37,97 +58,330 @@ random_state = int(os.getenv("random_state", "42"))
 n_estimators = int(os.getenv("n_estimators", "500"))
 max_depth = int(os.getenv("max_depth", "12"))
 
+# peak RSS is checked against this budget after each stage and reported in metrics.json (0 disables the check)
+memory_budget_mb = int(os.getenv("memory_budget_mb", "6144"))
+memory_budget_strict = os.getenv("memory_budget_strict", "false").lower() == "true"
+
+# incremental mode adds incremental_trees fitted on the days no previous run trained on to the previous model
+train_mode = os.getenv("train_mode", "full").lower()
+incremental_trees = int(os.getenv("incremental_trees", "50"))
+full_refit_every = int(os.getenv("full_refit_every", "7"))
+# counted in days (one row per day)
+min_rows_incremental = int(os.getenv("min_rows_incremental", "1"))
+
 artifact_prefix = os.getenv("artifact_prefix", "models/volatility_model")
 model_name = "volatility_model.joblib"
 metrics_name = "metrics.json"
 features_name = "feature_importances.csv"
 manifest_name = "training_manifest.jsonl.gz"
+metrics_history_prefix = "metrics_history"
+# flattened copy of the forest for low-latency inference (see forest.py); checked against sklearn before upload
+export_flat_forest = os.getenv("export_flat_forest", "true").lower() == "true"
+flat_model_name = "volatility_model.forest"
+# content-addressed copies: <artifact_prefix>/registry/<sha256>/{volatility_model.joblib, metrics.json}, read by auto_update.py
+registry_prefix = os.getenv("registry_prefix", f"{artifact_prefix}/registry")
+flat_tolerance = float(os.getenv("flat_tolerance", "1e-6"))
 
 required_cols = ["day", "avg_price_usd", "min_price_usd", "max_price_usd", "year"]
 numeric_cols = ["avg_price_usd", "min_price_usd", "max_price_usd", "year"]
+price_cols = ["avg_price_usd", "min_price_usd", "max_price_usd"]
 target_col = "daily_range"
 features = ["avg_price_usd", "min_price_usd", "max_price_usd", "year"]
+float_cols = list(price_cols)
+
+# feature_source=store reads features_partitioned/ (written by feature_store.py) instead of processed_partitioned/
+# and adds the lagged/rolling columns to the model features; batch_score.py and serve.py follow the same switch
+feature_source = os.getenv("feature_source", "processed").lower()
+feature_prefix = os.getenv("feature_prefix", "features_partitioned")
+feature_windows = tuple(int(w) for w in os.getenv("feature_windows", "7,30").split(","))
+store_features = window_features.feature_names(feature_windows)
+if feature_source == "store":
+    prefix = feature_prefix
+    required_cols = required_cols + store_features
+    numeric_cols = numeric_cols + store_features
+    float_cols = float_cols + store_features
+    features = features + store_features
+
+stage_rss_mb = {}
 
 def now_iso():
     return datetime.now(timezone.utc).isoformat()
 
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def check_memory(stage):
+    peak = round(peak_rss_mb(), 1)
+    stage_rss_mb[stage] = peak
+    print(f"peak rss after {stage}: {peak} MB (budget {memory_budget_mb or 'off'})")
+    if memory_budget_mb and peak > memory_budget_mb:
+        msg = f"peak rss {peak} MB exceeds budget {memory_budget_mb} MB after {stage}"
+        if memory_budget_strict:
+            raise MemoryError(msg)
+        print(f"warning: {msg}")
+
+def memory_report():
+    peak = round(peak_rss_mb(), 1)
+    return {
+        "peak_rss_mb": peak,
+        "budget_mb": memory_budget_mb,
+        "within_budget": not memory_budget_mb or peak <= memory_budget_mb,
+        "stages": dict(stage_rss_mb),
+    }
+
+def compact_table(df, year):
+    # float32 prices (and store features), int32 day numbers (days since 1970-01-01) and int16 year; missing columns become nulls
+    n = len(df)
+    columns = {}
+    if "day" in df.columns:
+        days = pd.to_datetime(df["day"], errors="coerce")
+        if getattr(days.dt, "tz", None) is not None:
+            days = days.dt.tz_convert(None)
+        day_numbers = days.to_numpy(dtype="datetime64[D]").astype(np.int64)
+        columns["day"] = pa.array(day_numbers.astype(np.int32), type=pa.int32(), mask=days.isna().to_numpy())
+    else:
+        columns["day"] = pa.nulls(n, type=pa.int32())
+    for c in float_cols:
+        if c in df.columns:
+            values = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=np.float32)
+            columns[c] = pa.array(values, type=pa.float32(), from_pandas=True)
+        else:
+            columns[c] = pa.nulls(n, type=pa.float32())
+    columns["year"] = pa.array(np.full(n, year, dtype=np.int16))
+    return pa.table(columns)
+
 def list_s3(bucket, prefix):
     paginator = s3.get_paginator("list_objects_v2")
     for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
         for obj in page.get("Contents", []):
-            yield obj["Key"]
+            yield obj
+
+def selected_years():
+    return [y for y in range(start_year, end_year + 1) if y not in exclude_years]
 
-def read_object(bucket, key):
+class S3RangeFile(io.RawIOBase):
+    def __init__(self, bucket, key, size):
+        self.bucket, self.key, self.size, self.pos = bucket, key, size, 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def readinto(self, b):
+        if self.pos >= self.size or len(b) == 0:
+            return 0
+        end = min(self.pos + len(b), self.size) - 1
+        data = s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.pos}-{end}")["Body"].read()
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+def detect_format(key, head):
+    name = key.lower()
+    if name.endswith(".parquet"):
+        return "parquet"
+    if name.endswith((".csv", ".csv.gz", ".txt")):
+        return "csv"
+    return "parquet" if head[:4] == b"PAR1" else "csv"
+
+def select_row_groups(pf):
+    # skips row groups whose day statistics fall outside start_year..end_year
+    names = pf.schema_arrow.names
+    if "day" not in names:
+        return list(range(pf.num_row_groups))
+    lo, hi = pd.Timestamp(start_year, 1, 1), pd.Timestamp(end_year, 12, 31)
+    day_idx = names.index("day")
+    groups = []
+    for i in range(pf.num_row_groups):
+        stats = pf.metadata.row_group(i).column(day_idx).statistics
+        if stats is not None and stats.has_min_max:
+            if pd.Timestamp(stats.max) < lo or pd.Timestamp(stats.min) > hi:
+                continue
+        groups.append(i)
+    return groups
+
+def read_parquet_columns(source):
+    pf = pq.ParquetFile(source)
+    columns = [c for c in required_cols if c in pf.schema_arrow.names]
+    return pf.read_row_groups(select_row_groups(pf), columns=columns).to_pandas()
+
+def read_csv_columns(buf):
+    try:
+        return pd.read_csv(buf, usecols=lambda c: c in required_cols)
+    except UnicodeDecodeError:
+        buf.seek(0)
+        return pd.read_csv(buf, usecols=lambda c: c in required_cols, encoding="latin-1")
+
+def cache_path(bucket, key, version):
+    digest = hashlib.sha256(f"{bucket}/{key}@{version}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest)
+
+def fetch_cached(bucket, obj):
+    version = obj.get("ETag", "").strip('"') or obj["LastModified"].isoformat()
+    path = cache_path(bucket, obj["Key"], version)
+    if os.path.exists(path):
+        os.utime(path)
+        return path, "hit"
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    s3.download_file(bucket, obj["Key"], tmp)
+    os.replace(tmp, path)
+    return path, "miss"
+
+def evict_cache():
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".tmp") or not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= cache_max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        evicted += 1
+    return evicted
+
+def read_local(key, path):
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if detect_format(key, head) == "parquet":
+        return read_parquet_columns(path)
+    with open(path, "rb") as f:
+        return read_csv_columns(f)
+
+def read_object(bucket, obj):
+    # format comes from the extension, or the magic bytes when there is none; each file is parsed once
+    key, size = obj["Key"], obj["Size"]
+    if cache_enabled:
+        path, cache_status = fetch_cached(bucket, obj)
+        return read_local(key, path), cache_status
+    if size > range_read_min_bytes:
+        head = b"" if key.lower().endswith((".parquet", ".csv", ".csv.gz", ".txt")) else \
+            s3.get_object(Bucket=bucket, Key=key, Range="bytes=0-3")["Body"].read()
+        if detect_format(key, head) == "parquet":
+            return read_parquet_columns(io.BufferedReader(S3RangeFile(bucket, key, size), buffer_size=1024 * 1024)), "off"
     buf = BytesIO()
     s3.download_fileobj(bucket, key, buf)
     buf.seek(0)
-    for read_func in (pd.read_parquet, lambda b: pd.read_csv(b), lambda b: pd.read_csv(b, encoding="latin-1")):
-        try:
-            return read_func(buf)
-        except Exception:
-            buf.seek(0)
-    raise RuntimeError(f"unreadable file {key}")
+    if detect_format(key, buf.getvalue()[:4]) == "parquet":
+        return read_parquet_columns(buf), "off"
+    return read_csv_columns(buf), "off"
 
 def safe_read(args):
-    bucket, key = args
+    bucket, obj = args
     for attempt in range(1, s3_max_attempts + 1):
         try:
-            df = read_object(bucket, key)
-            return key, df, None
+            df, cache_status = read_object(bucket, obj)
+            return obj, df, None, cache_status
         except Exception as e:
             err = f"{type(e).__name__}: {e}"
             time.sleep(min(2 ** attempt, 10))
-    return key, None, err
+    return obj, None, err, None
+
+def input_version(objects):
+    digest = hashlib.sha256()
+    for obj in sorted(objects, key=lambda o: o["Key"]):
+        etag = obj.get("ETag", "").strip('"')
+        digest.update(f"{obj['Key']}@{etag}\n".encode("utf-8"))
+    return digest.hexdigest()
 
-def load_data():
+def list_year(year):
+    objects = [obj for obj in list_s3(bucket, f"{prefix}/year={year}/") if not obj["Key"].endswith("/")]
+    return [(year, obj) for obj in sorted(objects, key=lambda o: partitions.write_order(o["Key"]))]
+
+def load_data(known=None):
     print(f"scanning s3://{bucket}/{prefix}/ for {start_year}..{end_year} excluding {sorted(exclude_years)}")
+    # partitions are pruned by year before anything is listed or downloaded
     candidates = []
-    for key in list_s3(bucket, prefix):
-        if "year=" not in key or key.endswith("/"):
-            continue
-        try:
-            year = int(key.split("year=")[1].split("/")[0])
-        except:
-            continue
-        if start_year <= year <= end_year and year not in exclude_years:
-            candidates.append((year, key))
+    with instrumentation.stage("list"), cf.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        for found in ex.map(list_year, selected_years()):
+            candidates.extend(found)
     if not candidates:
         raise RuntimeError("no data files found")
     print(f"found {len(candidates)} files across {len(set(y for y, _ in candidates))} years")
 
-    manifest, dfs = [], []
-    with cf.ThreadPoolExecutor(max_workers=max_workers) as ex:
-        for key, df, err in ex.map(safe_read, [(bucket, k) for _, k in candidates]):
+    manifest, tables = [], []
+    if known:
+        # files whose ETag matches the previous manifest were already trained on
+        unchanged = [o for _, o in candidates if o["Key"] in known and known[o["Key"]].get("etag") == o.get("ETag", "").strip('"')]
+        manifest.extend({**known[o["Key"]], "status": "unchanged"} for o in unchanged)
+        candidates = [(y, o) for y, o in candidates if o["Key"] not in {u["Key"] for u in unchanged}]
+        print(f"{len(unchanged)} files unchanged since the previous run, {len(candidates)} new or changed")
+        if not candidates:
+            return None, manifest
+
+    with instrumentation.stage("read"), cf.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        for obj, df, err, cache_status in ex.map(safe_read, [(bucket, o) for _, o in candidates]):
+            key = obj["Key"]
             year = int(key.split("year=")[1].split("/")[0])
             manifest.append({
                 "time": now_iso(),
                 "key": key,
+                "etag": obj.get("ETag", "").strip('"'),
+                "size": int(obj["Size"]),
                 "year": year,
                 "rows": 0 if df is None else int(df.shape[0]),
                 "status": "ok" if err is None else "error",
                 "error": err,
+                "cache": cache_status,
+                "bytes_saved": int(obj["Size"]) if cache_status == "hit" else 0,
+                "days": [],
             })
             if df is not None:
-                df["year"] = year
-                dfs.append(df)
-    if not dfs:
+                tables.append(compact_table(df, year))
+                # day numbers held by the file; incremental runs decide which days are new against these
+                manifest[-1]["days"] = np.unique(tables[-1].column("day").drop_null().to_numpy()).tolist()
+    if not tables:
         raise RuntimeError("all file reads failed")
-    df = pd.concat(dfs, ignore_index=True)
-    print(f"loaded {df.shape[0]} rows x {df.shape[1]} cols")
+    # concat_tables only links the chunks; self_destruct frees each Arrow column as it is converted
+    table = pa.concat_tables(tables)
+    del tables
+    df = table.to_pandas(split_blocks=True, self_destruct=True, types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+    del table
+    # parquet_convert.py appends a day written again as a newer file; files are read in write order, so the last row wins
+    repeated = df["day"].notna() & df.duplicated(subset=["day"], keep="last")
+    if repeated.any():
+        df.drop(index=df.index[repeated], inplace=True)
+        print(f"dropped {int(repeated.sum())} rows of days superseded by newer files")
+    instrumentation.count("rows_loaded", int(df.shape[0]))
+    print(f"loaded {df.shape[0]} rows x {df.shape[1]} cols, {df.memory_usage(deep=True).sum() / 1024 ** 2:.2f} MB")
+    if cache_enabled:
+        hits = sum(1 for m in manifest if m["status"] != "unchanged" and m["cache"] == "hit")
+        misses = sum(1 for m in manifest if m["status"] != "unchanged" and m["cache"] == "miss")
+        saved = sum(m["bytes_saved"] for m in manifest if m["status"] != "unchanged")
+        print(f"cache hits={hits} misses={misses} bytes_saved={saved} evicted={evict_cache()}")
     return df, manifest
 
+@instrumentation.stage("clean")
 def clean(df):
-    df = df[[c for c in required_cols if c in df.columns]].copy()
-    if "day" in df.columns:
-        df["day"] = pd.to_datetime(df["day"], errors="coerce")
+    # in place: load_data already hands over compact, typed columns
+    df.drop(columns=[c for c in df.columns if c not in required_cols], inplace=True)
     for c in numeric_cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-    df.dropna(subset=["avg_price_usd", "min_price_usd", "max_price_usd", "year"], inplace=True)
-    before = len(df)
+        if c in df.columns and not pd.api.types.is_numeric_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], errors="coerce", downcast="float")
+    # store features are NaN until their window is filled and around missing days
+    df.dropna(subset=features, inplace=True)
     df.drop_duplicates(inplace=True)
     df[target_col] = df["max_price_usd"] - df["min_price_usd"]
-    df = df[df[target_col] > 0].dropna(subset=[target_col])
+    df.drop(index=df.index[~(df[target_col] > 0)], inplace=True)
     print(f"clean shape {df.shape}")
     return df
 
@@ -147,8 +401,10 @@ def split(df):
 
 def train_eval(x_train, x_test, y_train, y_test):
     model = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth, random_state=random_state, n_jobs=-1)
-    model.fit(x_train, y_train)
-    preds = model.predict(x_test)
+    with instrumentation.stage("fit"):
+        model.fit(x_train, y_train)
+    with instrumentation.stage("predict"):
+        preds = model.predict(x_test)
     metrics = {
         "mae": float(mean_absolute_error(y_test, preds)),
         "rmse": float(math.sqrt(mean_squared_error(y_test, preds))),
@@ -157,7 +413,61 @@ def train_eval(x_train, x_test, y_train, y_test):
     print(f"mae={metrics['mae']:.3f} rmse={metrics['rmse']:.3f} r2={metrics['r2']:.3f}")
     return model, metrics
 
-def save_artifacts(model, metrics, manifest):
+def latest_rows(df):
+    # the newest test_size share of the new days
+    df_sorted = df.sort_values("day")
+    n_test = max(1, int(len(df_sorted) * test_size))
+    return df_sorted.iloc[-n_test:][features], df_sorted.iloc[-n_test:][target_col]
+
+def train_incremental(model, x_new, y_new, x_eval, y_eval):
+    # the added trees are fitted on every new day; the score is the updated model on the latest of them
+    model.set_params(warm_start=True, n_estimators=model.n_estimators + incremental_trees)
+    with instrumentation.stage("fit"):
+        model.fit(x_new, y_new)
+    with instrumentation.stage("predict"):
+        preds = model.predict(x_eval)
+    metrics = {
+        "mae": float(mean_absolute_error(y_eval, preds)),
+        "rmse": float(math.sqrt(mean_squared_error(y_eval, preds))),
+        # undefined on a single day
+        "r2": float(r2_score(y_eval, preds)) if len(y_eval) > 1 else None,
+        "eval_rows": int(len(y_eval)),
+    }
+    print(f"incremental trees={model.n_estimators} mae={metrics['mae']:.3f} rmse={metrics['rmse']:.3f} r2={metrics['r2']}")
+    return model, metrics
+
+def load_previous_run():
+    try:
+        metrics_body = s3.get_object(Bucket=bucket, Key=f"{artifact_prefix}/{metrics_name}")["Body"].read()
+        manifest_body = s3.get_object(Bucket=bucket, Key=f"{artifact_prefix}/{manifest_name}")["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None, None
+    manifest = [json.loads(line) for line in gzip.decompress(manifest_body).splitlines() if line.strip()]
+    return json.loads(metrics_body), manifest
+
+def load_previous_model():
+    import joblib
+    local = f"previous_{model_name}"
+    s3.download_file(bucket, f"{artifact_prefix}/{model_name}", local)
+    return joblib.load(local)
+
+def resolve_mode(previous_metrics, previous_manifest):
+    if train_mode != "incremental":
+        return "full"
+    if previous_metrics is None:
+        print("no previous run found, falling back to a full refit")
+        return "full"
+    if any("etag" not in m or "days" not in m for m in previous_manifest):
+        print("previous manifest has no etags or days, falling back to a full refit")
+        return "full"
+    runs = previous_metrics.get("incremental_runs", 0)
+    if runs >= full_refit_every:
+        print(f"{runs} incremental runs since the last full refit, refitting from scratch")
+        return "full"
+    return "incremental"
+
+@instrumentation.stage("save")
+def save_artifacts(model, metrics, manifest, run_info=None, metrics_field="metrics"):
     import joblib
     model_file = model_name
     joblib.dump(model, model_file)
@@ -165,31 +475,121 @@ def save_artifacts(model, metrics, manifest):
     metrics_key = f"{artifact_prefix}/{metrics_name}"
     manifest_key = f"{artifact_prefix}/{manifest_name}"
 
-    metrics_payload = {"timestamp": now_iso(), "metrics": metrics, "bucket": bucket, "prefix": prefix}
+    metrics_payload = {"timestamp": now_iso(), metrics_field: metrics, "bucket": bucket, "prefix": prefix, **(run_info or {})}
     manifest_buf = io.BytesIO()
     with gzip.GzipFile(fileobj=manifest_buf, mode="wb") as gz:
         for m in manifest:
             gz.write((json.dumps(m) + "\n").encode("utf-8"))
     manifest_bytes = manifest_buf.getvalue()
 
-    s3.upload_file(model_file, bucket, model_key)
-    s3.put_object(Bucket=bucket, Key=metrics_key, Body=json.dumps(metrics_payload, indent=2).encode("utf-8"))
+    metrics_bytes = json.dumps(metrics_payload, indent=2).encode("utf-8")
+    run_ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    history_key = f"{artifact_prefix}/{metrics_history_prefix}/{run_ts}-{metrics_payload.get('mode', 'full')}.json"
+    digest = file_sha256(model_file)
+    s3.upload_file(model_file, bucket, model_key, ExtraArgs={"Metadata": {"sha256": digest}})
+    s3.put_object(Bucket=bucket, Key=metrics_key, Body=metrics_bytes)
+    s3.put_object(Bucket=bucket, Key=history_key, Body=metrics_bytes)
     s3.put_object(Bucket=bucket, Key=manifest_key, Body=manifest_bytes)
-    print("upload complete")
+    register_artifact(model_key, digest, metrics_bytes)
+    print(f"upload complete, model sha256 {digest}")
+    return digest
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def register_artifact(model_key, digest, metrics_bytes):
+    # a byte-identical model is stored once; its metrics are refreshed with the latest run
+    registry_key = f"{registry_prefix}/{digest}/{model_name}"
+    try:
+        s3.head_object(Bucket=bucket, Key=registry_key)
+        print(f"model {digest[:12]} already registered")
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        s3.copy({"Bucket": bucket, "Key": model_key}, bucket, registry_key)
+    s3.put_object(Bucket=bucket, Key=f"{registry_prefix}/{digest}/{metrics_name}", Body=metrics_bytes)
 
+@instrumentation.stage("export")
+def export_forest(model, x_check):
+    flat = forest.flatten_forest(model, feature_names=features)
+    size = flat.save(flat_model_name)
+    diff = float(np.max(np.abs(flat.predict(x_check) - model.predict(x_check)))) if len(x_check) else 0.0
+    if diff > flat_tolerance:
+        raise RuntimeError(f"flattened forest differs from sklearn by {diff} (tolerance {flat_tolerance})")
+    s3.upload_file(flat_model_name, bucket, f"{artifact_prefix}/{flat_model_name}")
+    print(f"exported flattened forest: {flat.meta['n_trees']} trees, {size / 1024 ** 2:.1f} MB, max diff {diff:.2e}")
+    return {"bytes": size, "max_abs_diff": diff}
+
+@instrumentation.invocation("training_job", train_mode=train_mode)
 def main():
     try:
-        df_raw, manifest = load_data()
-        df = clean(df_raw)
-        if len(df) < min_rows_to_train:
-            raise RuntimeError(f"not enough rows ({len(df)} < {min_rows_to_train})")
-        x_train, x_test, y_train, y_test = split(df)
-        model, metrics = train_eval(x_train, x_test, y_train, y_test)
-        save_artifacts(model, metrics, manifest)
-        print("training complete and uploaded")
+        previous_metrics, previous_manifest = (None, None)
+        if train_mode == "incremental":
+            previous_metrics, previous_manifest = load_previous_run()
+        mode = resolve_mode(previous_metrics, previous_manifest)
+        started = time.time()
+
+        if mode == "incremental":
+            known = {m["key"]: m for m in previous_manifest if m["status"] in ("ok", "unchanged")}
+            known_days = {d for m in known.values() for d in m["days"]}
+            df_raw, manifest = load_data(known=known)
+            if df_raw is None:
+                print("no new or changed partitions, nothing to train")
+                return
+            # new means a day no file of the previous run held: a compacted file or a rewritten day adds nothing
+            # (rewritten days are picked up by the next full refit)
+            df_raw.drop(index=df_raw.index[df_raw["day"].isna() | df_raw["day"].isin(known_days)], inplace=True)
+            check_memory("load")
+            df = clean(df_raw)
+            check_memory("clean")
+            if len(df) < min_rows_incremental:
+                print(f"not enough new days ({len(df)} < {min_rows_incremental}), skipping until more data arrives")
+                return
+            x_train, y_train = df[features], df[target_col]
+            x_test, y_test = latest_rows(df)
+            with instrumentation.stage("load_model"):
+                previous_model = load_previous_model()
+            model, metrics = train_incremental(previous_model, x_train, y_train, x_test, y_test)
+            incremental_runs = previous_metrics.get("incremental_runs", 0) + 1
+        else:
+            df_raw, manifest = load_data()
+            check_memory("load")
+            df = clean(df_raw)
+            check_memory("clean")
+            if len(df) < min_rows_to_train:
+                raise RuntimeError(f"not enough rows ({len(df)} < {min_rows_to_train})")
+            x_train, x_test, y_train, y_test = split(df)
+            model, metrics = train_eval(x_train, x_test, y_train, y_test)
+            incremental_runs = 0
+        check_memory("fit")
+
+        run_info = {
+            "mode": mode,
+            "incremental_runs": incremental_runs,
+            "n_estimators": int(model.n_estimators),
+            "train_rows": int(len(x_train)),
+            "test_rows": int(len(x_test)),
+            "files_read": sum(1 for m in manifest if m["status"] == "ok"),
+            "train_seconds": round(time.time() - started, 2),
+            "memory": memory_report(),
+        }
+        # incremental runs are scored on their latest new days, which the added trees were fitted on, so their scores
+        # are not comparable with full refits (metrics) and are kept under their own name
+        metrics_field = "incremental_metrics" if mode == "incremental" else "metrics"
+        model_sha256 = save_artifacts(model, metrics, manifest, run_info, metrics_field)
+        if export_flat_forest:
+            instrumentation.annotate(flat_forest=export_forest(model, x_test))
+        instrumentation.annotate(mode=mode, model_sha256=model_sha256,
+                                 **(metrics if metrics_field == "metrics" else {metrics_field: metrics}))
+        print(f"{mode} training complete and uploaded")
     except Exception as e:
         print("training failed:", e)
         traceback.print_exc()
+        instrumentation.mark_error(f"{type(e).__name__}: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+# lagged and rolling volatility features over the day-sorted daily series. The series is laid out on a full
+# calendar (one slot per day), so shifts and windows are in days: a missing day yields NaN, never a silent
+# lag to an older row. Every feature of day t depends only on days t - lookback(windows) .. t, which is what
+# lets feature_store.py recompute just the tail of the history.
+
+PRICE_COLS = ["avg_price_usd", "min_price_usd", "max_price_usd"]
+WINDOWS = (7, 30)
+
+def feature_names(windows=WINDOWS):
+    names = ["log_return_1d", "range_lag_1d", "rel_range_lag_1d"]
+    for w in windows:
+        names += [f"log_return_{w}d", f"volatility_{w}d", f"range_mean_{w}d", f"range_max_{w}d"]
+    return names
+
+def lookback(windows=WINDOWS):
+    # days of history before t read by any feature of day t: log_return_{w}d and volatility_{w}d reach t - w,
+    # the range windows end the day before t and reach t - w as well
+    return max(max(windows), 1)
+
+def compute(days, prices, windows=WINDOWS):
+    # days: int day numbers (days since 1970-01-01), unique and sorted; prices: (n, 3) avg/min/max.
+    # returns a float32 (n, len(feature_names)) array aligned with days
+    days = np.asarray(days, dtype=np.int64)
+    n = len(days)
+    if n == 0:
+        return np.empty((0, len(feature_names(windows))), dtype=np.float32)
+    slots = days - days[0]
+    span = int(slots[-1]) + 1
+    avg = np.full(span, np.nan)
+    daily_range = np.full(span, np.nan)
+    prices = np.asarray(prices, dtype=np.float64)
+    avg[slots] = prices[:, 0]
+    daily_range[slots] = prices[:, 2] - prices[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_avg = np.log(np.where(avg > 0, avg, np.nan))
+
+    def shift(a, k):
+        out = np.full_like(a, np.nan)
+        out[k:] = a[:-k]
+        return out
+
+    log_return_1d = log_avg - shift(log_avg, 1)
+    # today's range is the training target, so range features stop at yesterday
+    range_prev = pd.Series(shift(daily_range, 1))
+    returns = pd.Series(log_return_1d)
+    columns = [log_return_1d, range_prev.to_numpy(), range_prev.to_numpy() / shift(avg, 1)]
+    for w in windows:
+        columns += [
+            log_avg - shift(log_avg, w),
+            returns.rolling(w, min_periods=w).std().to_numpy(),
+            range_prev.rolling(w, min_periods=w).mean().to_numpy(),
+            range_prev.rolling(w, min_periods=w).max().to_numpy(),
+        ]
+    return np.column_stack(columns)[slots].astype(np.float32)
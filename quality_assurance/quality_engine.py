@@ -0,0 +1,138 @@
+# quality rules for the minute ticks, defined once and evaluated on pandas (local runs, benchmarks)
+# or on Spark (the Glue job). Every metric is a per-day sum over the ticks plus a few lag columns,
+# so all of them come out of a single grouped aggregation.
+
+# columns written by stream/stream.py; compact_hours.py writes the same schema to Parquet
+SCHEMA = [("epoch_ms", "bigint"), ("iso_ts", "string"), ("price_usd", "double"), ("source", "string"), ("asset", "string")]
+# stream.py writes a row per pair into every minute file; only this one is checked. Rows without an asset
+# come from files written before the asset column and are all BTC-USD
+ASSET = "BTC-USD"
+SPARK_SCHEMA = ", ".join(f"{name} {dtype}" for name, dtype in SCHEMA)
+
+MINUTE_MS = 60_000
+DAY_MS = 86_400_000
+# consecutive ticks further apart than this count as a gap
+GAP_MS = 90_000
+# absolute minute-over-minute return above which a tick counts as a price jump
+JUMP_RATIO = 0.05
+
+# pass/fail thresholds of the daily report
+MIN_ROWS = 1000
+MAX_ROWS = 2000
+
+# metrics are grouped by a "day" column when the input has one (e.g. the partition the ticks were read from),
+# otherwise by the UTC day of the tick timestamp. Derived columns available to the rules, computed per day:
+#   prev_time, prev_price    previous tick by timestamp
+#   prev_arrival_time        previous tick in write order (file name, then row position)
+#   time_delta               time - prev_time
+#   missed_minutes           whole minutes missing inside a gap, 0 elsewhere
+#   abs_return               |price_usd / prev_price - 1|
+# rule: (metric, op, operands); operands are column names or numbers
+def rules(gap_ms=GAP_MS, jump_ratio=JUMP_RATIO):
+    return [
+        ("rows", "count", ()),
+        ("null_prices", "is_null", ("price_usd",)),
+        ("neg_prices", "lt", ("price_usd", 0)),
+        ("duplicate_timestamps", "eq", ("time", "prev_time")),
+        ("minute_gaps", "gt", ("time_delta", gap_ms)),
+        ("missing_minutes", "sum", ("missed_minutes",)),
+        ("out_of_order_ticks", "lt", ("time", "prev_arrival_time")),
+        ("price_jumps", "gt", ("abs_return", jump_ratio)),
+    ]
+
+METRICS = [name for name, _, _ in rules()]
+# columns of a daily report under quality_reports/year=YYYY/month=MM/day=DD/; day is the date as YYYY/MM/DD, as in
+# the reports written before these metrics, which read the newer metric columns as null
+REPORT_COLUMNS = ["day", *METRICS, "status"]
+
+
+def status(metrics, min_rows=MIN_ROWS, max_rows=MAX_ROWS):
+    ok = (min_rows < metrics["rows"] < max_rows and metrics["null_prices"] == 0
+          and metrics["neg_prices"] == 0 and metrics["duplicate_timestamps"] == 0)
+    return "PASSED" if ok else "FAILED"
+
+
+def pandas_metrics(df, gap_ms=GAP_MS, jump_ratio=JUMP_RATIO):
+    # rows are taken to be in write order, as they come out of the files
+    import numpy as np
+    import pandas as pd
+
+    if "asset" in df.columns:
+        df = df[df["asset"].isna() | (df["asset"] == ASSET)]
+    time_col = "time" if "time" in df.columns else "epoch_ms"
+    frame = pd.DataFrame({
+        "time": pd.to_numeric(df[time_col], errors="coerce").to_numpy(),
+        "price_usd": pd.to_numeric(df["price_usd"], errors="coerce").to_numpy(),
+    })
+    if "day" in df.columns:
+        frame["day"] = df["day"].astype(str).to_numpy()
+    else:
+        frame["day"] = pd.to_datetime(frame["time"] // DAY_MS * DAY_MS, unit="ms").dt.strftime("%Y-%m-%d")
+    frame["prev_arrival_time"] = frame.groupby("day")["time"].shift()
+    frame = frame.sort_values(["day", "time"], kind="stable")
+    by_day = frame.groupby("day")
+    frame["prev_time"] = by_day["time"].shift()
+    frame["prev_price"] = by_day["price_usd"].shift()
+    frame["time_delta"] = frame["time"] - frame["prev_time"]
+    frame["missed_minutes"] = np.where(frame["time_delta"] > gap_ms, (frame["time_delta"] / MINUTE_MS).round() - 1, 0)
+    frame["abs_return"] = (frame["price_usd"] / frame["prev_price"] - 1).abs()
+
+    def operand(x):
+        return frame[x] if isinstance(x, str) else x
+
+    ops = {
+        "count": lambda: pd.Series(1, index=frame.index),
+        "is_null": lambda a: frame[a].isna(),
+        "lt": lambda a, b: operand(a) < operand(b),
+        "gt": lambda a, b: operand(a) > operand(b),
+        "eq": lambda a, b: operand(a) == operand(b),
+        "sum": lambda a: frame[a].fillna(0),
+    }
+    values = pd.DataFrame({name: ops[op](*args) for name, op, args in rules(gap_ms, jump_ratio)})
+    values["day"] = frame["day"]
+    per_day = values.groupby("day").sum()
+    return [{"day": day, **{m: int(row[m]) for m in METRICS}} for day, row in per_day.iterrows()]
+
+
+def spark_metrics(df, gap_ms=GAP_MS, jump_ratio=JUMP_RATIO):
+    # one Spark job: two window sorts per day feeding a single groupBy; collects one row per day
+    from pyspark.sql import functions as F, Window
+
+    if "asset" in df.columns:
+        df = df.where(F.col("asset").isNull() | (F.col("asset") == ASSET))
+    if "epoch_ms" in df.columns:
+        df = df.withColumnRenamed("epoch_ms", "time")
+    if "day" not in df.columns:
+        df = df.withColumn("day", F.date_format(F.expr(f"date_from_unix_date(cast(floor(time / {DAY_MS}) as int))"), "yyyy-MM-dd"))
+    df = (
+        df.select("time", "price_usd", F.col("day").cast("string").alias("day"))
+        .withColumn("_file", F.input_file_name())
+        .withColumn("_row", F.monotonically_increasing_id())
+    )
+    by_arrival = Window.partitionBy("day").orderBy("_file", "_row")
+    by_time = Window.partitionBy("day").orderBy("time")
+    df = (
+        df.withColumn("prev_arrival_time", F.lag("time").over(by_arrival))
+        .withColumn("prev_time", F.lag("time").over(by_time))
+        .withColumn("prev_price", F.lag("price_usd").over(by_time))
+        .withColumn("time_delta", F.col("time") - F.col("prev_time"))
+        .withColumn("missed_minutes", F.when(F.col("time_delta") > gap_ms,
+                                             F.round(F.col("time_delta") / MINUTE_MS) - 1).otherwise(0))
+        .withColumn("abs_return", F.abs(F.col("price_usd") / F.col("prev_price") - 1))
+    )
+
+    def operand(x):
+        return F.col(x) if isinstance(x, str) else F.lit(x)
+
+    ops = {
+        "count": lambda: F.lit(1),
+        "is_null": lambda a: F.col(a).isNull(),
+        "lt": lambda a, b: operand(a) < operand(b),
+        "gt": lambda a, b: operand(a) > operand(b),
+        "eq": lambda a, b: operand(a) == operand(b),
+        "sum": lambda a: F.col(a),
+    }
+    aggs = [F.coalesce(F.sum(ops[op](*args).cast("long")), F.lit(0)).alias(name)
+            for name, op, args in rules(gap_ms, jump_ratio)]
+    rows = df.groupBy("day").agg(*aggs).orderBy("day").collect()
+    return [{"day": r["day"], **{m: int(r[m]) for m in METRICS}} for r in rows]
@@ -1,13 +1,14 @@
-
- 
-
 from pyspark.sql import SparkSession, functions as F
 from datetime import datetime, timedelta
 import sys
+import boto3
+import concurrent.futures as cf
 from awsglue.context import GlueContext
 from awsglue.utils import getResolvedOptions
 from awsglue.job import Job
 from pyspark.context import SparkContext
+import instrumentation
+import quality_engine
  
 try:
     args = getResolvedOptions(sys.argv, ['JOB_NAME'])
@@ -15,6 +16,16 @@ try:
 except Exception: 
     job_name = "btc_daily_quality_manual"
 
+# optional job parameters: --start_day / --end_day (YYYY/MM/DD or YYYY-MM-DD) switch to range mode,
+# --force true re-checks days that already have a report
+def optional_arg(name, default=None):
+    if f"--{name}" not in sys.argv:
+        return default
+    return getResolvedOptions(sys.argv, [name])[name]
+
+def parse_day(value):
+    return datetime.strptime(value.replace("-", "/"), "%Y/%m/%d").date()
+
 glueContext = GlueContext(SparkContext.getOrCreate())
 spark = glueContext.spark_session
 
@@ -24,67 +35,134 @@ job.init(job_name, {})
 
 print("starting")
 
-today = (datetime.utcnow() - timedelta(days=1)).strftime("%Y/%m/%d")
-path = f"s3://<your-bucket-name>/raw/stream/year={today[:4]}/month={today[5:7]}/day={today[8:10]}/"
-print(f"reading from: {path}")
- 
-df = (
-    spark.read
-         .option("header", True)
-         .option("inferSchema", True)
-         .csv(path)
-)
-
-print("\n schema:")
-df.printSchema()
-df.show(5, truncate=False)
- 
-cols = [c.lower() for c in df.columns]
-print(f"\n detected columns: {cols}")
-
-rename_map = {
-    "epoch_ms": "time",
-    "iso_ts": "iso_ts",
-    "price_usd": "price_usd",
-    "source": "source",
-    "volume": "volume",
-    "hour": "hour"   
-}
- 
-select_expr = [f"{col} as {rename_map[col]}" for col in cols if col in rename_map]
-df = df.selectExpr(*select_expr)
- 
-df.printSchema()
-df.show(5, truncate=False)
- 
-total_rows = df.count()
-null_prices = df.filter(F.col("price_usd").isNull()).count()
-neg_prices = df.filter(F.col("price_usd") < 0).count()
-dup_timestamps = df.count() - df.dropDuplicates(["time"]).count()
-
-print(f"total rows ..........: {total_rows}")
-print(f"null price_usd ......: {null_prices}")
-print(f"negative price_usd ..: {neg_prices}")
-print(f"duplicate timestamps : {dup_timestamps}")
-
-
-if 1000 < total_rows < 2000 and null_prices == 0 and neg_prices == 0 and dup_timestamps == 0:
-    status = "PASSED"
-    print("\n data quality PASSED for today.")
+yesterday = (datetime.utcnow() - timedelta(days=1)).date()
+start_day = parse_day(optional_arg("start_day", f"{yesterday:%Y/%m/%d}"))
+end_day = parse_day(optional_arg("end_day", f"{start_day:%Y/%m/%d}"))
+force = optional_arg("force", "false").lower() == "true"
+list_workers = int(optional_arg("list_workers", "16"))
+bucket = "<your-bucket-name>"
+reports_prefix = "quality_reports"
+days = [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+print(f"checking {len(days)} days from {start_day} to {end_day}")
+
+def day_path(day):
+    return f"year={day:%Y}/month={day:%m}/day={day:%d}"
+
+# only the boto3 listing is counted as S3 traffic; Spark reads go through the Hadoop S3 connector
+instrumentation.start("quality_assurance", job=job_name, start_day=f"{start_day}", end_day=f"{end_day}")
+
+s3 = boto3.client("s3")
+instrumentation.track_s3(s3)
+paginator = s3.get_paginator("list_objects_v2")
+
+def reported_days(year):
+    found = set()
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{reports_prefix}/year={year}/"):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(".parquet"):
+                y, m, d = (part.split("=")[1] for part in obj["Key"].split("/")[1:4])
+                found.add(f"{y}/{m}/{d}")
+    return found
+
+# prefer the hourly files written by stream/compact_hours.py, fall back to minute CSVs per hour
+def list_day_sources(day):
+    compacted_hours = set()
+    csv_hours = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"raw/stream_compacted/{day_path(day)}/"):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(".parquet"):
+                compacted_hours.add(obj["Key"].rsplit("hour=", 1)[-1][:2])
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"raw/stream/{day_path(day)}/hour=", Delimiter="/"):
+        for cp in page.get("CommonPrefixes", []):
+            if cp["Prefix"].split("hour=")[-1].rstrip("/") not in compacted_hours:
+                csv_hours.append(f"s3://{bucket}/{cp['Prefix']}")
+    return compacted_hours, csv_hours
+
+compacted_paths = []
+csv_paths = []
+with instrumentation.stage("list"):
+    reported = set()
+    if not force:
+        for year in sorted({d.year for d in days}):
+            reported |= reported_days(year)
+    todo = [d for d in days if f"{d:%Y/%m/%d}" not in reported]
+    skipped = len(days) - len(todo)
+    with cf.ThreadPoolExecutor(max_workers=list_workers) as ex:
+        for day, (compacted_hours, csv_hours) in zip(todo, ex.map(list_day_sources, todo)):
+            if compacted_hours:
+                compacted_paths.append(f"s3://{bucket}/raw/stream_compacted/{day_path(day)}/")
+            csv_paths.extend(csv_hours)
+print(f"days to check: {len(todo)}, skipped with a report: {skipped}, "
+      f"compacted days: {len(compacted_paths)}, csv hours: {len(csv_paths)}")
+
+if not todo:
+    print("\n every day in the range already has a report, pass --force true to re-check.")
+    instrumentation.count("days_skipped", skipped)
+    instrumentation.finish()
+    job.commit()
+    sys.exit(0)
+
+# declared schema instead of inferSchema, which would scan every CSV once more before the checks
+columns = [F.col(name).cast(dtype) for name, dtype in quality_engine.SCHEMA]
+frames = []
+if compacted_paths:
+    # hour files compacted before the asset column have no such column; mergeSchema reads it as null there
+    frames.append(spark.read.option("mergeSchema", True).parquet(*compacted_paths).select(*columns))
+if csv_paths:
+    frames.append(
+        spark.read
+             .option("header", True)
+             .schema(quality_engine.SPARK_SCHEMA)
+             .csv(csv_paths)
+             .select(*columns)
+    )
+
+# every metric for every day in one aggregation pass, grouped by the day partition each file was read from,
+# whatever the tick timestamps say; same rules as the pandas engine used locally
+metrics_by_day = {}
+if frames:
+    df = frames[0]
+    for other in frames[1:]:
+        df = df.unionByName(other)
+    day_pattern = r"year=(\d{4})/month=(\d{2})/day=(\d{2})/"
+    df = df.withColumn("day", F.concat_ws("/", *[F.regexp_extract(F.input_file_name(), day_pattern, i) for i in (1, 2, 3)]))
+    with instrumentation.stage("checks"):
+        metrics_by_day = {m["day"]: m for m in quality_engine.spark_metrics(df)}
+
+reports = []
+failed = []
+for day in todo:
+    key = f"{day:%Y/%m/%d}"
+    # a day without any ticks still gets a (failed) report
+    metrics = metrics_by_day.get(key, {"day": key, **{m: 0 for m in quality_engine.METRICS}})
+    status = quality_engine.status(metrics)
+    print(f"{key}: {status}  " + "  ".join(f"{name}={metrics[name]}" for name in quality_engine.METRICS))
+    if status != "PASSED":
+        failed.append(key)
+    reports.append((day, (key, *[metrics[name] for name in quality_engine.METRICS], status)))
+
+if failed:
+    print(f"\n data quality FAILED for {len(failed)} of {len(reports)} days — investigate anomalies: {', '.join(failed)}")
 else:
-    status = "FAILED"
-    print("\n data quality FAILED — investigate anomalies.")
-
-result_df = spark.createDataFrame(
-    [(today, total_rows, null_prices, neg_prices, dup_timestamps, status)],
-    ["day", "rows", "null_prices", "neg_prices", "duplicate_timestamps", "status"]
-)
-
-out_path = f"s3://<your-bucket-name>/quality_reports/year={today[:4]}/month={today[5:7]}/day={today[8:10]}/"
-result_df.write.mode("overwrite").parquet(out_path)
-
-print("\n quality check completed and report saved successfully.")
+    print(f"\n data quality PASSED for all {len(reports)} days.")
+
+# one report per day under quality_reports/year=YYYY/month=MM/day=DD/, the layout and day column (YYYY/MM/DD) of
+# the daily reports written before range mode; the small writes run concurrently
+def write_report(item):
+    day, row = item
+    out_path = f"s3://{bucket}/{reports_prefix}/{day_path(day)}/"
+    spark.createDataFrame([row], quality_engine.REPORT_COLUMNS).coalesce(1).write.mode("overwrite").parquet(out_path)
+
+with instrumentation.stage("write"), cf.ThreadPoolExecutor(max_workers=list_workers) as ex:
+    list(ex.map(write_report, reports))
+instrumentation.count("rows_checked", sum(m["rows"] for m in metrics_by_day.values()))
+instrumentation.count("days_checked", len(reports))
+instrumentation.count("days_skipped", skipped)
+instrumentation.annotate(quality_status="FAILED" if failed else "PASSED", failed_days=len(failed))
+
+print("\n quality check completed and reports saved successfully.")
  
 print("\n glue job completed and committed successfully.")
 
-job.commit()
\ No newline at end of file
+instrumentation.finish()
+job.commit()
@@ -0,0 +1,245 @@
+import io
+import os
+import sys
+import mmap
+import time
+import argparse
+import concurrent.futures as cf
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import instrumentation
+import partitions
+
+# local replacement for the historical INSERT INTO processed_partitioned ... GROUP BY in athena/init.sql.
+# the OHLCV CSVs are memory-mapped and cut into byte ranges on line boundaries; each worker process parses
+# one range and returns per-day partial aggregates (close sum/count, low min, high max), which are merged
+# like Athena merges its split-level partial aggregations. Peak memory is about workers x chunk size.
+#
+# same semantics as the SQL:
+#   - columns are positional (time, open, close, high, low, volume); the first line of every file is skipped
+#   - day = date(from_unixtime(time / 1000)) in UTC, with time / 1000 truncated like a bigint division
+#   - avg(close), min(low), max(high) skip nulls; a day whose values are all null gets nulls
+#   - output: year=YYYY/ (or year=YYYY/month=MM/) partitions of (day date, avg_price_usd, min_price_usd, max_price_usd double)
+# rows without a parseable time would form a NULL day in the SQL; they are skipped and counted instead
+
+OUTPUT_SCHEMA = pa.schema([
+    ("day", pa.date32()),
+    ("avg_price_usd", pa.float64()),
+    ("min_price_usd", pa.float64()),
+    ("max_price_usd", pa.float64()),
+])
+
+def split_ranges(path, chunk_bytes):
+    # (start, end) byte offsets ending on a newline; the header line is left out
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header_end = mm.find(b"\n")
+        start = size if header_end == -1 else header_end + 1
+        ranges = []
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                newline = mm.find(b"\n", end - 1)
+                end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def day_numbers(ms):
+    # from_unixtime(time / 1000): bigint division truncates toward zero, the date then floors to the UTC day
+    seconds = np.where(ms >= 0, ms // 1000, -(-ms // 1000))
+    return seconds // 86_400
+
+def aggregate_range(args):
+    path, start, end = args
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # round_trip parses every number to the nearest double, as the SQL engine does
+        frame = pd.read_csv(io.BytesIO(mm[start:end]), header=None, usecols=[0, 2, 3, 4],
+                            names=["time", "open", "close", "high", "low", "volume"], float_precision="round_trip")
+    rows = len(frame)
+    ms = pd.to_numeric(frame["time"], errors="coerce")
+    valid = ms.notna().to_numpy() & (ms.to_numpy() % 1 == 0)
+    values = pd.DataFrame({
+        "day": day_numbers(ms.to_numpy()[valid].astype(np.int64)),
+        "close": pd.to_numeric(frame["close"], errors="coerce").to_numpy()[valid],
+        "low": pd.to_numeric(frame["low"], errors="coerce").to_numpy()[valid],
+        "high": pd.to_numeric(frame["high"], errors="coerce").to_numpy()[valid],
+    })
+    grouped = values.groupby("day", sort=False)
+    partial = pd.DataFrame({
+        "close_sum": grouped["close"].sum(),
+        "close_count": grouped["close"].count(),
+        "low_min": grouped["low"].min(),
+        "high_max": grouped["high"].max(),
+    })
+    return partial, rows, rows - int(valid.sum())
+
+def merge_partials(partials):
+    merged = pd.concat(partials).groupby(level=0).agg(
+        close_sum=("close_sum", "sum"), close_count=("close_count", "sum"),
+        low_min=("low_min", "min"), high_max=("high_max", "max"),
+    ).sort_index()
+    days = merged.index.to_numpy(dtype=np.int64)
+    count = merged["close_count"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = np.where(count > 0, merged["close_sum"].to_numpy() / count, np.nan)
+    daily = pd.DataFrame({
+        "day": days,
+        "avg_price_usd": avg,
+        "min_price_usd": merged["low_min"].to_numpy(dtype=np.float64),
+        "max_price_usd": merged["high_max"].to_numpy(dtype=np.float64),
+    })
+    daily["year"] = days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+    return daily
+
+def year_table(df_year):
+    return pa.table({
+        "day": pa.array(df_year["day"].to_numpy(dtype=np.int32), type=pa.int32()).cast(pa.date32()),
+        "avg_price_usd": pa.array(df_year["avg_price_usd"].to_numpy(), type=pa.float64(), from_pandas=True),
+        "min_price_usd": pa.array(df_year["min_price_usd"].to_numpy(), type=pa.float64(), from_pandas=True),
+        "max_price_usd": pa.array(df_year["max_price_usd"].to_numpy(), type=pa.float64(), from_pandas=True),
+    }, schema=OUTPUT_SCHEMA)
+
+class Output:
+    # partitions under an s3://bucket/prefix URL or a local directory
+    def __init__(self, url):
+        self.s3 = None
+        if url.startswith("s3://"):
+            import boto3
+            self.s3 = boto3.client("s3")
+            instrumentation.track_s3(self.s3)
+            self.bucket, _, self.prefix = url[5:].partition("/")
+        else:
+            self.bucket, self.prefix = None, url
+        self.prefix = self.prefix.rstrip("/")
+
+    def partition_files(self, part):
+        # files directly in the partition directory; deeper partitions are not part of it
+        part = f"{self.prefix}/{part}/"
+        if self.s3:
+            paginator = self.s3.get_paginator("list_objects_v2")
+            return [o["Key"] for page in paginator.paginate(Bucket=self.bucket, Prefix=part, Delimiter="/")
+                    for o in page.get("Contents", []) if o["Key"].endswith(".parquet")]
+        if not os.path.isdir(part):
+            return []
+        return [os.path.join(part, n) for n in sorted(os.listdir(part)) if n.endswith(".parquet")]
+
+    def read(self, key):
+        if self.s3:
+            return pq.read_table(io.BytesIO(self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()))
+        return pq.read_table(key)
+
+    def write(self, part, name, table):
+        buf = io.BytesIO()
+        pq.write_table(table, buf, compression="snappy")
+        key = f"{self.prefix}/{part}/{name}"
+        if self.s3:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=buf.getvalue())
+        else:
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+            with open(f"{key}.tmp", "wb") as f:
+                f.write(buf.getvalue())
+            os.replace(f"{key}.tmp", key)
+        return key
+
+    def delete(self, keys):
+        if self.s3:
+            for i in range(0, len(keys), 1000):
+                self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+        else:
+            for key in keys:
+                os.remove(key)
+
+def write_partition(output, part, df_part, merge):
+    # merge keeps days already in the partition (e.g. appended by parquet_convert.py) that the CSV does not cover;
+    # like every reader of the partition, a day in several files is taken from the file with the greatest key
+    table = year_table(df_part)
+    existing = sorted(output.partition_files(part), key=partitions.write_order)
+    if merge and existing:
+        kept = []
+        covered = pa.array(df_part["day"].to_numpy(dtype=np.int32), type=pa.int32()).cast(pa.date32())
+        for key in reversed(existing):
+            old = output.read(key)
+            old = old.select([c for c in OUTPUT_SCHEMA.names if c in old.column_names]).cast(OUTPUT_SCHEMA)
+            old = old.filter(pc.invert(pc.is_in(old["day"], value_set=covered)))
+            kept.append(old)
+            covered = pa.concat_arrays([covered, old["day"].combine_chunks()])
+        table = pa.concat_tables(kept + [table]).sort_by("day")
+    # same naming as parquet_convert.py, so days appended after the ingest still sort after it and win
+    name = f"part-{partitions.file_stamp()}-historical.parquet"
+    key = output.write(part, name, table)
+    # the new file is in place before older ones are removed, so readers never see an empty partition
+    output.delete([k for k in existing if k != key])
+    return key, table.num_rows
+
+@instrumentation.invocation("historical_ingest")
+def ingest(paths, output_url, workers, chunk_mb, years=None, merge=True, layout="year"):
+    partitions.check(layout)
+    with instrumentation.stage("split"):
+        jobs = [(p, start, end) for p in paths for start, end in split_ranges(p, chunk_mb * 1024 * 1024)]
+    print(f"{len(paths)} files, {sum(os.path.getsize(p) for p in paths) / 1024 ** 2:.1f} MB in {len(jobs)} chunks, {workers} workers")
+
+    partials, rows, skipped = [], 0, 0
+    with instrumentation.stage("aggregate"), cf.ProcessPoolExecutor(max_workers=workers) as ex:
+        for partial, n, bad in ex.map(aggregate_range, jobs):
+            partials.append(partial)
+            rows += n
+            skipped += bad
+    if not partials:
+        raise RuntimeError("no rows found")
+    daily = merge_partials(partials)
+    if years:
+        daily = daily[daily["year"].isin(years)]
+    daily["month"] = daily["day"].to_numpy(dtype=np.int64).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+    instrumentation.count("rows_read", rows)
+    instrumentation.count("rows_skipped", skipped)
+    print(f"aggregated {rows} rows into {len(daily)} days ({skipped} rows without a valid time skipped)")
+
+    output = Output(output_url)
+    written = []
+    with instrumentation.stage("write"):
+        for vals, df_part in daily.groupby(partitions.LAYOUTS[layout]):
+            vals = tuple(int(v) for v in vals)
+            part = partitions.path("", vals, layout)
+            key, n = write_partition(output, part, df_part, merge)
+            written.append({"partition": part, "days": n, "key": key})
+            print(f"{part}: {len(df_part)} days from the CSV, {n} in the partition -> {key}")
+    instrumentation.count("days_written", int(len(daily)))
+    return written
+
+def parse_years(value):
+    years = set()
+    for part in value.split(","):
+        lo, _, hi = part.partition("-")
+        years.update(range(int(lo), int(hi or lo) + 1))
+    return years
+
+def main():
+    parser = argparse.ArgumentParser(description="aggregate 1-minute OHLCV CSVs into processed_partitioned/ partitions")
+    parser.add_argument("paths", nargs="+", help="OHLCV CSV files (time,open,close,high,low,volume)")
+    parser.add_argument("--output", required=True, help="s3://<bucket>/processed_partitioned/ or a local directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-mb", type=int, default=64, help="bytes of CSV parsed per task")
+    parser.add_argument("--years", type=parse_years, help="only write these years, e.g. 2013-2020,2023")
+    parser.add_argument("--replace", action="store_true",
+                        help="replace the partitions instead of keeping days the CSV does not cover")
+    parser.add_argument("--layout", choices=sorted(partitions.LAYOUTS), default="year",
+                        help="year=YYYY/ or year=YYYY/month=MM/ partitions (see partitions.py)")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    try:
+        ingest(args.paths, args.output, args.workers, args.chunk_mb, args.years, merge=not args.replace, layout=args.layout)
+    except Exception as e:
+        print("historical ingest failed:", e)
+        sys.exit(1)
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
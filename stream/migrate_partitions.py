@@ -0,0 +1,195 @@
+import io
+import sys
+import time
+import argparse
+import concurrent.futures as cf
+
+import boto3
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import instrumentation
+import partitions
+
+# rewrites processed_partitioned/ into a partition layout (e.g. year=YYYY/ -> year=YYYY/month=MM/), one year per task.
+# each target partition gets a single part-<stamp>-compacted.parquet with one row per day, the newest file winning as
+# for every reader. The written files are read back and their row counts checked before any source file is deleted.
+# In place (no --target) readers see the same rows throughout: the new files sort after the old ones.
+
+SCHEMA = pa.schema([
+    ("day", pa.date32()),
+    ("avg_price_usd", pa.float64()),
+    ("min_price_usd", pa.float64()),
+    ("max_price_usd", pa.float64()),
+])
+
+s3 = boto3.client("s3")
+instrumentation.track_s3(s3)
+
+def split_url(url):
+    if not url.startswith("s3://"):
+        raise ValueError(f"expected an s3:// URL, got {url}")
+    bucket, _, prefix = url[5:].partition("/")
+    return bucket, prefix.rstrip("/")
+
+def list_source(bucket, prefix, years):
+    # {year: [keys]} of every Parquet file under prefix/year=YYYY/, whatever the layout below it
+    found = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/year="):
+        for obj in page.get("Contents", []):
+            vals = partitions.of_key(obj["Key"], "year")
+            if vals and obj["Key"].endswith(".parquet") and (not years or vals[0] in years):
+                found.setdefault(vals[0], []).append(obj["Key"])
+    return found
+
+def read_file(bucket, key):
+    table = pq.read_table(io.BytesIO(s3.get_object(Bucket=bucket, Key=key)["Body"].read()))
+    return table.select([c for c in SCHEMA.names if c in table.column_names]).cast(SCHEMA)
+
+def latest_rows(tables):
+    # tables in write order; a day keeps the row of the last table that has it
+    kept, covered = [], pa.array([], type=pa.date32())
+    for table in reversed(tables):
+        table = table.filter(pc.invert(pc.is_in(table["day"], value_set=covered)))
+        kept.append(table)
+        covered = pa.concat_arrays([covered, table["day"].combine_chunks()])
+    return pa.concat_tables(kept).sort_by("day") if kept else SCHEMA.empty_table()
+
+def migrate_year(job):
+    src_bucket, year, keys, dst_bucket, dst_prefix, layout = job
+    keys = sorted(keys, key=partitions.write_order)
+    with instrumentation.stage("read"):
+        tables = [read_file(src_bucket, k) for k in keys]
+    source_rows = sum(t.num_rows for t in tables)
+    table = latest_rows(tables)
+    table = table.filter(pc.is_valid(table["day"]))
+    # the stamp of the newest input: the new files sort after every input, and after nothing written later
+    stamps = [st for st in map(partitions.stamp_of, keys) if st]
+    name = f"part-{max(stamps) if stamps else '0' * 21}-compacted.parquet"
+
+    groups = {}
+    for i, day in enumerate(table["day"].to_pylist()):
+        groups.setdefault(partitions.values(day, layout), []).append(i)
+    written = []
+    with instrumentation.stage("write"):
+        for vals, rows in sorted(groups.items()):
+            part = table.take(pa.array(rows))
+            buf = io.BytesIO()
+            pq.write_table(part, buf, compression="snappy")
+            key = f"{partitions.path(dst_prefix, vals, layout)}/{name}"
+            s3.put_object(Bucket=dst_bucket, Key=key, Body=buf.getvalue())
+            written.append({"partition": vals, "key": key, "rows": part.num_rows})
+    print(f"year {year}: {len(keys)} files, {source_rows} rows, {table.num_rows} days -> {len(written)} partitions")
+    return {"year": year, "keys": keys, "source_rows": source_rows, "days": table.num_rows, "written": written}
+
+def check_file(bucket, written, layout):
+    # reads the written file back: its row count, and that every day belongs to its partition
+    table = read_file(bucket, written["key"])
+    problems = []
+    if table.num_rows != written["rows"]:
+        problems.append(f"{written['key']}: {table.num_rows} rows, expected {written['rows']}")
+    if any(partitions.values(d, layout) != written["partition"] for d in table["day"].to_pylist()):
+        problems.append(f"{written['key']}: days outside partition {written['partition']}")
+    return problems
+
+def verify(bucket, results, layout, workers):
+    # every year must have written all its days, and every file must read back as written
+    problems = []
+    for r in results:
+        if sum(w["rows"] for w in r["written"]) != r["days"]:
+            problems.append(f"year {r['year']}: {sum(w['rows'] for w in r['written'])} rows written, expected {r['days']}")
+    written = [w for r in results for w in r["written"]]
+    with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+        for found in ex.map(lambda w: check_file(bucket, w, layout), written):
+            problems.extend(found)
+    return problems
+
+def delete_keys(bucket, keys):
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+
+@instrumentation.invocation("migrate_partitions")
+def migrate(source, target, layout, workers, years=None, keep_source=False, register=None):
+    partitions.check(layout)
+    src_bucket, src_prefix = split_url(source)
+    dst_bucket, dst_prefix = split_url(target or source)
+    in_place = (src_bucket, src_prefix) == (dst_bucket, dst_prefix)
+
+    with instrumentation.stage("list"):
+        listed = list_source(src_bucket, src_prefix, years)
+    if not listed:
+        raise RuntimeError(f"no Parquet files under {source}")
+    print(f"{sum(len(k) for k in listed.values())} files in {len(listed)} years, {layout} layout "
+          f"{'in place' if in_place else f'into s3://{dst_bucket}/{dst_prefix}/'}, {workers} workers")
+
+    jobs = [(src_bucket, year, keys, dst_bucket, dst_prefix, layout) for year, keys in sorted(listed.items())]
+    with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+        results = list(ex.map(migrate_year, jobs))
+    instrumentation.count("rows_read", sum(r["source_rows"] for r in results))
+    instrumentation.count("days_written", sum(r["days"] for r in results))
+
+    with instrumentation.stage("verify"):
+        problems = verify(dst_bucket, results, layout, workers)
+    if problems:
+        for p in problems:
+            print("verification failed:", p)
+        raise RuntimeError(f"{len(problems)} row count mismatches, source files left in place")
+    print(f"verified {sum(len(r['written']) for r in results)} files, {sum(r['days'] for r in results)} days "
+          f"({sum(r['source_rows'] for r in results)} source rows)")
+
+    if in_place and not keep_source:
+        written = {w["key"] for r in results for w in r["written"]}
+        old = [k for r in results for k in r["keys"] if k not in written]
+        with instrumentation.stage("write"):
+            delete_keys(src_bucket, old)
+        print(f"deleted {len(old)} source files")
+
+    if register:
+        with instrumentation.stage("register"):
+            parts = {w["partition"] for r in results for w in r["written"]}
+            partitions.register(boto3.client("athena"), register["database"], register["table"],
+                                f"s3://{dst_bucket}/{dst_prefix}", parts, layout, register["output"])
+        print(f"registered {len(parts)} partitions in {register['database']}.{register['table']}")
+    return results
+
+def parse_years(value):
+    years = set()
+    for part in value.split(","):
+        lo, _, hi = part.partition("-")
+        years.update(range(int(lo), int(hi or lo) + 1))
+    return years
+
+def main():
+    parser = argparse.ArgumentParser(description="rewrite processed_partitioned/ into another partition layout")
+    parser.add_argument("source", help="s3://<bucket>/processed_partitioned/")
+    parser.add_argument("--layout", choices=sorted(partitions.LAYOUTS), required=True)
+    parser.add_argument("--target", help="s3://<bucket>/<prefix>/ to write to; default: rewrite the source in place")
+    parser.add_argument("--workers", type=int, default=8, help="years migrated concurrently")
+    parser.add_argument("--years", type=parse_years, help="only these years, e.g. 2013-2020,2023")
+    parser.add_argument("--keep-source", action="store_true", help="in place: keep the old files after verification")
+    parser.add_argument("--database", help="register the written partitions in this Athena database")
+    parser.add_argument("--table", default="processed_partitioned")
+    parser.add_argument("--athena-output", help="s3:// location for Athena query results (with --database)")
+    parser.add_argument("--print-ddl", action="store_true", help="print the CREATE TABLE for the target layout and exit")
+    parser.add_argument("--projection", action="store_true", help="with --print-ddl: use partition projection")
+    args = parser.parse_args()
+
+    if args.print_ddl:
+        print(partitions.create_table_sql(args.database or "<yourdbname>", args.table, args.target or args.source,
+                                          args.layout, projection=args.projection))
+        return
+    if args.database and not args.athena_output:
+        parser.error("--database needs --athena-output")
+    register = {"database": args.database, "table": args.table, "output": args.athena_output} if args.database else None
+    started = time.perf_counter()
+    try:
+        migrate(args.source, args.target, args.layout, args.workers, args.years, args.keep_source, register)
+    except Exception as e:
+        print("migration failed:", e)
+        sys.exit(1)
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,434 @@
 import awswrangler as wr
-import boto3, os, pandas as pd
-from datetime import datetime
+import boto3, os, json, time, pandas as pd
+import concurrent.futures as cf
+from datetime import datetime, timedelta, timezone
+import instrumentation
+import partitions
 
 s3 = boto3.client("s3")
 athena = boto3.client("athena")
+instrumentation.track_s3(s3)
 
 BUCKET = os.environ.get("BUCKET", "<your-bucket-name>")
 RAW_PREFIX = "raw/stream"
+COMPACT_PREFIX = "raw/stream_compacted"
 PROC_PREFIX = "processed_partitioned"
 DATABASE = "<your-catalog-name>"
 TABLE = "processed_partitioned"
 ATHENA_OUTPUT = f"s3://{BUCKET}/athena/output/" 
-def list_raw_days(bucket, prefix, year):
+# per-year index of processed days, kept outside the dataset root so Parquet readers never see it
+INDEX_PREFIX = f"state/{PROC_PREFIX}/day_index"
+# closed months never change, so their day listings are cached here
+LISTING_CACHE_PREFIX = f"state/{RAW_PREFIX}/closed_months"
+LIST_WORKERS = int(os.environ.get("LIST_WORKERS", "12"))
+# running daily aggregates written by stream.py on every tick
+STATE_PREFIX = "state/daily_agg"
+USE_DAILY_STATE = os.environ.get("USE_DAILY_STATE", "true").lower() == "true"
+RECONCILE_TOLERANCE = float(os.environ.get("RECONCILE_TOLERANCE", "1e-6"))
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "8"))
+BACKFILL_BATCH_DAYS = int(os.environ.get("BACKFILL_BATCH_DAYS", "31"))
+# processed days are appended as part-<stamp>-<day>.parquet; compact mode merges them into part-<stamp>-compacted.parquet.
+# stamps sort in write order (partitions.write_order), so readers keep the row of a day from the newest file
+COMPACT_MIN_FILES = int(os.environ.get("COMPACT_MIN_FILES", "2"))
+# files merged into a compacted file are deleted by the next daily run or compaction, once readers listed before it
+# have finished
+COMPACT_GRACE_MINUTES = int(os.environ.get("COMPACT_GRACE_MINUTES", "60"))
+OUTPUT_COLUMNS = ["day", "avg_price_usd", "min_price_usd", "max_price_usd"]
+# the pair aggregated into processed_partitioned/; rows without an asset predate multi-asset collection and are BTC-USD
+ASSET = os.environ.get("ASSET", "BTC-USD")
+# year or year_month (processed_partitioned/year=YYYY/month=MM/), see partitions.py and migrate_partitions.py
+PARTITION_LAYOUT = os.environ.get("PARTITION_LAYOUT", "year")
+# alter: ALTER TABLE ADD IF NOT EXISTS PARTITION for the partitions written; projection: the table uses partition projection
+PARTITION_REGISTRATION = os.environ.get("PARTITION_REGISTRATION", "alter")
+
+def list_common_prefixes(bucket, prefix):
     paginator = s3.get_paginator("list_objects_v2")
-    prefix_path = f"{prefix}/year={year}/month="
-    days_found = set()
+    found = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        found.extend(cp["Prefix"] for cp in page.get("CommonPrefixes", []))
+    return found
+
+
+def list_month_days(bucket, prefix, year, month):
+    days = []
+    for day_prefix in list_common_prefixes(bucket, f"{prefix}/year={year}/month={month:02}/day="):
+        days.append(int(day_prefix.split("day=")[-1].rstrip("/")))
+    return sorted(days)
+
+
+def read_listing_cache(bucket, year):
+    try:
+        body = s3.get_object(Bucket=bucket, Key=f"{LISTING_CACHE_PREFIX}/{year}.json")["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return {int(m): days for m, days in json.loads(body)["months"].items()}
 
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix_path, Delimiter="/"):
-        for cp in page.get("CommonPrefixes", []):
-            if "month=" in cp["Prefix"]:
-                month_prefix = cp["Prefix"]
-                month = int(month_prefix.split("month=")[-1].rstrip("/"))
-                for subpage in s3.get_paginator("list_objects_v2").paginate(
-                    Bucket=bucket, Prefix=month_prefix, Delimiter="/"
-                ):
-                    for subcp in subpage.get("CommonPrefixes", []):
-                        if "day=" in subcp["Prefix"]:
-                            day = int(subcp["Prefix"].split("day=")[-1].rstrip("/"))
-                            days_found.add(datetime(year, month, day).date())
+
+def write_listing_cache(bucket, year, months):
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{LISTING_CACHE_PREFIX}/{year}.json",
+        Body=json.dumps({"year": year, "months": {str(m): d for m, d in sorted(months.items())}}).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def month_is_closed(year, month, today):
+    # one day of grace after the month ends for late minute files
+    next_month = datetime(year + month // 12, month % 12 + 1, 1).date()
+    return next_month < today
+
+
+@instrumentation.stage("list")
+def list_raw_days(bucket, prefix, year):
+    today = datetime.utcnow().date()
+    last_month = today.month if year == today.year else 12
+    if year > today.year:
+        return []
+
+    cached = read_listing_cache(bucket, year)
+    to_list = [m for m in range(1, last_month + 1) if m not in cached]
+
+    listed = {}
+    with cf.ThreadPoolExecutor(max_workers=LIST_WORKERS) as ex:
+        futures = {ex.submit(list_month_days, bucket, prefix, year, m): m for m in to_list}
+        for fut in cf.as_completed(futures):
+            listed[futures[fut]] = fut.result()
+
+    newly_closed = {m: days for m, days in listed.items() if month_is_closed(year, m, today)}
+    if newly_closed:
+        write_listing_cache(bucket, year, {**cached, **newly_closed})
+    print(f"listed {len(to_list)} months for {year}, {len(cached)} served from cache")
+
+    days_found = set()
+    for month, days in {**cached, **listed}.items():
+        days_found.update(datetime(year, month, d).date() for d in days)
     return sorted(days_found)
 
- 
+
+def list_partition_objects(bucket, year):
+    paginator = s3.get_paginator("list_objects_v2")
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{PROC_PREFIX}/year={year}/"):
+        objects.extend(obj for obj in page.get("Contents", []) if not obj["Key"].endswith("/"))
+    return objects
+
+
+def list_partition_files(bucket, year):
+    return {obj["Key"]: obj["ETag"].strip('"') for obj in list_partition_objects(bucket, year)}
+
+
+def asset_ticks(df):
+    # stream.py writes a row per pair into every minute file
+    if "asset" not in df.columns:
+        return df
+    return df[df["asset"].isna() | (df["asset"] == ASSET)].drop(columns="asset")
+
+
+@instrumentation.stage("read")
+def read_raw_day(bucket, day):
+    # compacted hour files from compact_hours.py are preferred; minute CSVs only for the hours not compacted yet
+    day_path = f"year={day.year}/month={day.month:02}/day={day.day:02}"
+    paginator = s3.get_paginator("list_objects_v2")
+    compacted, csv_by_hour, sizes = {}, {}, {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{COMPACT_PREFIX}/{day_path}/"):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(".parquet"):
+                compacted[obj["Key"].rsplit("hour=", 1)[-1][:2]] = f"s3://{bucket}/{obj['Key']}"
+                sizes[obj["Key"]] = obj["Size"]
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{RAW_PREFIX}/{day_path}/hour="):
+        for obj in page.get("Contents", []):
+            hour = obj["Key"].split("hour=")[-1][:2]
+            if obj["Key"].endswith(".csv") and hour not in compacted:
+                csv_by_hour.setdefault(hour, []).append(f"s3://{bucket}/{obj['Key']}")
+                sizes[obj["Key"]] = obj["Size"]
+
+    frames = []
+    if compacted:
+        frames.append(wr.s3.read_parquet(path=sorted(compacted.values())))
+    csv_paths = [p for hour in sorted(csv_by_hour) for p in csv_by_hour[hour]]
+    if csv_paths:
+        frames.append(wr.s3.read_csv(csv_paths))
+    print(f"read {day}: {len(compacted)} compacted hours, {len(csv_by_hour)} csv hours")
+    df = asset_ticks(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame()
+    instrumentation.count("rows_read", len(df))
+    return df, sum(sizes.values())
+
+
+@instrumentation.stage("aggregate")
+def aggregate_day(df_raw):
+    df_raw = df_raw.drop_duplicates(subset=["iso_ts", "price_usd"])
+    df_raw["ts"] = pd.to_datetime(df_raw["iso_ts"])
+    daily = (
+        df_raw.assign(day=df_raw["ts"].dt.floor("D"))
+        .groupby("day")
+        .agg(
+            avg_price_usd=("price_usd", "mean"),
+            min_price_usd=("price_usd", "min"),
+            max_price_usd=("price_usd", "max"),
+        )
+        .reset_index()
+    )
+    daily["day"] = pd.to_datetime(daily["day"]).dt.date
+    daily["year"] = daily["day"].map(lambda d: d.year)
+    return daily
+
+
+def state_key(day):
+    return f"{STATE_PREFIX}/year={day.year}/month={day.month:02}/day={day.day:02}.json"
+
+
+@instrumentation.stage("state")
+def read_daily_state(bucket, day):
+    try:
+        body = s3.get_object(Bucket=bucket, Key=state_key(day))["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None, 0
+    return json.loads(body), len(body)
+
+
+def write_daily_state(bucket, day, state):
+    s3.put_object(Bucket=bucket, Key=state_key(day), Body=json.dumps(state).encode("utf-8"),
+                  ContentType="application/json")
+
+
+def daily_from_state(state):
+    day = datetime.strptime(state["day"], "%Y-%m-%d").date()
+    return pd.DataFrame([{
+        "day": day,
+        "avg_price_usd": state["sum"] / state["count"],
+        "min_price_usd": state["min"],
+        "max_price_usd": state["max"],
+        "year": day.year,
+    }])
+
+
+def state_from_raw(df_raw, day):
+    df_raw = df_raw.drop_duplicates(subset=["iso_ts", "price_usd"])
+    prices = df_raw["price_usd"].astype(float)
+    return {
+        "day": str(day),
+        "count": int(len(df_raw)),
+        "sum": float(prices.sum()),
+        "min": float(prices.min()),
+        "max": float(prices.max()),
+        "last_epoch_ms": int(df_raw["epoch_ms"].max()),
+    }
+
+
+def state_drift(state, expected, tolerance):
+    if state is None:
+        return ["missing"]
+    drift = [f for f in ("count", "min", "max") if abs(state[f] - expected[f]) > tolerance]
+    if abs(state["sum"] - expected["sum"]) > tolerance * max(1.0, abs(expected["sum"])):
+        drift.append("sum")
+    return drift
+
+
+def process_day(bucket, day, use_state=USE_DAILY_STATE):
+    started = time.perf_counter()
+    stats = {"day": str(day), "rows": 0, "bytes_read": 0, "elapsed_s": 0.0, "status": "ok", "source": "raw"}
+    daily = None
+    try:
+        if use_state:
+            state, stats["bytes_read"] = read_daily_state(bucket, day)
+            if state and state["count"] > 0:
+                stats.update(rows=state["count"], source="state",
+                             elapsed_s=round(time.perf_counter() - started, 3))
+                instrumentation.count("days_from_state")
+                return daily_from_state(state), stats
+        df_raw, stats["bytes_read"] = read_raw_day(bucket, day)
+        stats["rows"] = len(df_raw)
+        if df_raw.empty:
+            stats["status"] = "empty"
+        else:
+            daily = aggregate_day(df_raw)
+    except Exception as e:
+        print(f"Could not read raw data for {day}: {e}")
+        stats["status"] = "error"
+        stats["error"] = str(e)
+    stats["elapsed_s"] = round(time.perf_counter() - started, 3)
+    instrumentation.count(f"days_{stats['status']}")
+    return daily, stats
+
+
+@instrumentation.stage("write")
+def write_days(bucket, df_new):
+    # append-only: one small file per day and nothing existing is rewritten, so a failed run cannot leave a partition
+    # half written. A day written again lands in a newer file that wins over the older one until compaction
+    rows_total, written = 0, set()
+    for year, df_year in df_new.groupby("year"):
+        year = int(year)
+        days = load_existing_days(bucket, year)
+        for day, df_day in df_year.drop_duplicates(subset=["day"], keep="last").groupby("day"):
+            part = partitions.values(day, PARTITION_LAYOUT)
+            wr.s3.to_parquet(
+                df=df_day[OUTPUT_COLUMNS],
+                path=f"s3://{bucket}/{partitions.path(PROC_PREFIX, part, PARTITION_LAYOUT)}/part-{partitions.file_stamp()}-{day}.parquet",
+                compression="snappy",
+                index=False,
+            )
+            written.add(part)
+        days |= set(df_year["day"])
+        write_day_index(bucket, year, days, list_partition_files(bucket, year))
+        rows_total += len(days)
+    instrumentation.count("rows_written", len(df_new))
+    return rows_total, written
+
+
+@instrumentation.stage("register")
+def register_partitions(parts):
+    # only the partitions this run wrote; MSCK REPAIR TABLE would rescan every partition of the table
+    try:
+        partitions.register(athena, DATABASE, TABLE, f"s3://{BUCKET}/{PROC_PREFIX}", parts, PARTITION_LAYOUT,
+                            ATHENA_OUTPUT, PARTITION_REGISTRATION)
+    except Exception as e:
+        print(f"could not register partitions {sorted(parts)}: {e}")
+        instrumentation.mark_error(f"partition registration failed: {e}")
+
+
+def read_day_index(bucket, year):
+    try:
+        body = s3.get_object(Bucket=bucket, Key=f"{INDEX_PREFIX}/{year}.json")["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+
+def write_day_index(bucket, year, days, files):
+    index = {
+        "year": year,
+        "updated": datetime.now(timezone.utc).isoformat(),
+        "days": sorted(str(d) for d in days),
+        "files": files,
+    }
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{INDEX_PREFIX}/{year}.json",
+        Body=json.dumps(index).encode("utf-8"),
+        ContentType="application/json",
+    )
+    return index
+
+
+def rebuild_day_index(bucket, year, files):
+    days = set()
+    if files:
+        df_days = wr.s3.read_parquet(path=[f"s3://{bucket}/{k}" for k in files], columns=["day"])
+        days = set(pd.to_datetime(df_days["day"]).dt.date)
+    return write_day_index(bucket, year, days, files)
+
+
+@instrumentation.stage("index")
+def load_existing_days(bucket, year):
+    # the index is trusted only while it describes exactly the files in the partition
+    files = list_partition_files(bucket, year)
+    index = read_day_index(bucket, year)
+    if index is None or index.get("files") != files:
+        print(f"day index for {year} missing or stale, rebuilding from {len(files)} parquet files")
+        index = rebuild_day_index(bucket, year, files)
+    return {datetime.strptime(d, "%Y-%m-%d").date() for d in index["days"]}
+
+
+@instrumentation.stage("read")
+def read_partition_files(bucket, keys):
+    # in write order, so drop_duplicates(keep="last") keeps the newest row of a day
+    keys = sorted(keys, key=partitions.write_order)
+    with cf.ThreadPoolExecutor(max_workers=LIST_WORKERS) as ex:
+        frames = list(ex.map(lambda k: wr.s3.read_parquet(path=f"s3://{bucket}/{k}"), keys))
+    df = pd.concat(frames, ignore_index=True)
+    df["day"] = pd.to_datetime(df["day"]).dt.date
+    return df.drop_duplicates(subset=["day"], keep="last").sort_values("day", ignore_index=True)
+
+
+def split_superseded(objects):
+    # (superseded, live, latest compacted) of one partition directory: files before the latest compacted file are merged into it
+    objects = sorted(objects, key=lambda o: o["Key"])
+    compacted = [o for o in objects if o["Key"].endswith("-compacted.parquet")]
+    latest = compacted[-1] if compacted else None
+    superseded = [o["Key"] for o in objects if latest and o["Key"] < latest["Key"]]
+    live = [o["Key"] for o in objects if not latest or o["Key"] >= latest["Key"]]
+    return superseded, live, latest
+
+
+def delete_superseded(bucket, objects, grace_minutes):
+    superseded, _, latest = split_superseded(objects)
+    if not superseded or latest["LastModified"] >= datetime.now(timezone.utc) - timedelta(minutes=grace_minutes):
+        return 0
+    with instrumentation.stage("write"):
+        for i in range(0, len(superseded), 1000):
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in superseded[i:i + 1000]], "Quiet": True})
+    instrumentation.count("files_deleted", len(superseded))
+    return len(superseded)
+
+
+def sweep_superseded(bucket, year, grace_minutes=COMPACT_GRACE_MINUTES):
+    # the daily run deletes what the last compaction merged once the grace period is over, so the per-day files and
+    # the compacted file do not both stay in the table until the next compaction
+    directories = {}
+    for obj in list_partition_objects(bucket, year):
+        directories.setdefault(obj["Key"].rsplit("/", 1)[0], []).append(obj)
+    deleted = sum(delete_superseded(bucket, objects, grace_minutes) for objects in directories.values())
+    if deleted:
+        print(f"deleted {deleted} files merged into compacted files of {year}")
+    return deleted
+
+
+def compact_partition(bucket, directory, objects, min_files, grace_minutes):
+    _, live, _ = split_superseded(objects)
+    deleted = delete_superseded(bucket, objects, grace_minutes)
+    result = {"partition": directory, "files": len(objects), "deleted": deleted, "compacted": None}
+
+    if len(live) >= min_files:
+        df = read_partition_files(bucket, live)
+        # the stamp of the newest input: files written after the listing get a later stamp and still win
+        stamps = [st for st in map(partitions.stamp_of, live) if st]
+        key = f"{directory}/part-{max(stamps) if stamps else '0' * 21}-compacted.parquet"
+        with instrumentation.stage("write"):
+            wr.s3.to_parquet(df=df[OUTPUT_COLUMNS], path=f"s3://{bucket}/{key}", compression="snappy", index=False)
+        instrumentation.count("files_compacted", len(live))
+        result.update(compacted=key, inputs=len(live), rows=len(df))
+        print(f"compacted {len(live)} files into s3://{bucket}/{key} ({len(df)} days)")
+    return result
+
+
+def compact_year(bucket, year, min_files, grace_minutes):
+    # every partition directory (year=YYYY/ or year=YYYY/month=MM/) is compacted on its own
+    directories = {}
+    for obj in list_partition_objects(bucket, year):
+        directories.setdefault(obj["Key"].rsplit("/", 1)[0], []).append(obj)
+    results = [compact_partition(bucket, d, objects, min_files, grace_minutes) for d, objects in sorted(directories.items())]
+    if any(r["deleted"] or r["compacted"] for r in results):
+        rebuild_day_index(bucket, year, list_partition_files(bucket, year))
+    return {"year": year, "partitions": results}
+
+
+@instrumentation.invocation("parquet_convert")
 def lambda_handler(event, context):
+    instrumentation.annotate(mode=(event or {}).get("mode", "daily"))
+    if (event or {}).get("mode") == "backfill":
+        return backfill(event)
+    if (event or {}).get("mode") == "reconcile":
+        return reconcile(event)
+    if (event or {}).get("mode") == "compact":
+        return compact(event)
+
     current_year = datetime.utcnow().year
     today = datetime.utcnow().date()
 
     parquet_path = f"s3://{BUCKET}/{PROC_PREFIX}/"
+
+    try:
+        sweep_superseded(BUCKET, current_year)
+    except Exception as e:
+        print(f"could not delete superseded files for {current_year}: {e}")
+        instrumentation.mark_error(f"superseded file sweep failed: {e}")
  
     try:
-        df_existing = wr.s3.read_parquet(path=parquet_path, dataset=True)
-        df_existing["day"] = pd.to_datetime(df_existing["day"]).dt.date
-        df_existing = df_existing[df_existing["year"] == current_year]
-        existing_days = set(df_existing["day"].unique())
+        existing_days = load_existing_days(BUCKET, current_year)
         print(f"existing days in parquet for {current_year}: {sorted(existing_days)}")
-    except Exception:
-        df_existing = pd.DataFrame()
+    except Exception as e:
+        print(f"could not load day index for {current_year}: {e}")
         existing_days = set()
 
     available_days = set(list_raw_days(BUCKET, RAW_PREFIX, current_year))
@@ -59,61 +443,16 @@ def lambda_handler(event, context):
  
     all_new = []
     for date_to_process in missing_days:
-        y, m, d = date_to_process.year, f"{date_to_process.month:02}", f"{date_to_process.day:02}"
-        raw_path = f"s3://{BUCKET}/{RAW_PREFIX}/year={y}/month={m}/day={d}/"
-        print(f"raw data from: {raw_path}")
-
-        try:
-            df_raw = wr.s3.read_csv(raw_path)
-        except Exception as e:
-            print(f"Could not read {raw_path}: {e}")
-            continue
-
-        if df_raw.empty:
-            continue
-
-        df_raw = df_raw.drop_duplicates(subset=["iso_ts", "price_usd"])
-        df_raw["ts"] = pd.to_datetime(df_raw["iso_ts"])
-        daily = (
-            df_raw.assign(day=df_raw["ts"].dt.floor("D"))
-            .groupby("day")
-            .agg(
-                avg_price_usd=("price_usd", "mean"),
-                min_price_usd=("price_usd", "min"),
-                max_price_usd=("price_usd", "max"),
-            )
-            .reset_index()
-        )
-        daily["year"] = y
-        all_new.append(daily)
+        daily, stats = process_day(BUCKET, date_to_process)
+        if daily is not None:
+            all_new.append(daily)
 
     if not all_new:
         return {"status": "no_new_data", "year": current_year}
 
     df_new_all = pd.concat(all_new, ignore_index=True)
-
-    if not df_existing.empty:
-        df_existing = df_existing[~df_existing["day"].isin(df_new_all["day"])]
-        merged = pd.concat([df_existing, df_new_all], ignore_index=True)
-    else:
-        merged = df_new_all
-
-    merged = merged.drop_duplicates(subset=["day"]).sort_values("day")
-
-    wr.s3.to_parquet(
-        df=merged,
-        path=parquet_path,
-        dataset=True,
-        mode="overwrite_partitions",   
-        compression="snappy",
-        partition_cols=["year"],
-    )
- 
-    athena.start_query_execution(
-        QueryString=f"MSCK REPAIR TABLE {DATABASE}.{TABLE};",
-        QueryExecutionContext={"Database": DATABASE},
-        ResultConfiguration={"OutputLocation": ATHENA_OUTPUT},
-    )
+    rows_total, written = write_days(BUCKET, df_new_all)
+    register_partitions(written)
 
     print(f"updated  for  {current_year}.")
     return {
@@ -121,6 +460,116 @@ def lambda_handler(event, context):
         "year": current_year,
         "processed_days": [str(d) for d in missing_days],
         "rows_new": len(df_new_all),
-        "rows_total": len(merged),
+        "rows_total": rows_total,
         "parquet_path": parquet_path,
     }
+
+
+def backfill(event):
+    # bounded memory: at most batch_days daily frames are held before they are written
+    today = datetime.utcnow().date()
+    start = datetime.strptime(event["start"], "%Y-%m-%d").date()
+    end = datetime.strptime(event["end"], "%Y-%m-%d").date() if "end" in event else today - timedelta(days=1)
+    end = min(end, today - timedelta(days=1))
+    workers = int(event.get("workers", BACKFILL_WORKERS))
+    batch_days = int(event.get("batch_days", BACKFILL_BATCH_DAYS))
+    force = bool(event.get("force", False))
+    use_state = event.get("source", "state") == "state" and USE_DAILY_STATE
+
+    to_process = []
+    for year in range(start.year, end.year + 1):
+        available = {d for d in list_raw_days(BUCKET, RAW_PREFIX, year) if start <= d <= end}
+        if not force:
+            available -= load_existing_days(BUCKET, year)
+        to_process.extend(sorted(available))
+    print(f"backfill {start}..{end}: {len(to_process)} days, {workers} workers, batches of {batch_days}")
+    if not to_process:
+        return {"status": "up_to_date", "start": str(start), "end": str(end)}
+
+    report, rows_new, written = [], 0, set()
+    with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+        for i in range(0, len(to_process), batch_days):
+            batch = to_process[i:i + batch_days]
+            frames = []
+            for daily, stats in ex.map(lambda d: process_day(BUCKET, d, use_state), batch):
+                print(json.dumps(stats))
+                report.append(stats)
+                if daily is not None:
+                    frames.append(daily)
+            if frames:
+                df_batch = pd.concat(frames, ignore_index=True)
+                written |= write_days(BUCKET, df_batch)[1]
+                rows_new += len(df_batch)
+            print(f"batch {i // batch_days + 1}: wrote {len(frames)} of {len(batch)} days")
+
+    register_partitions(written)
+    return {
+        "status": "ok",
+        "mode": "backfill",
+        "start": str(start),
+        "end": str(end),
+        "rows_new": rows_new,
+        "days": report,
+    }
+
+
+def reconcile_day(bucket, day, tolerance):
+    df_raw, _ = read_raw_day(bucket, day)
+    state, _ = read_daily_state(bucket, day)
+    if df_raw.empty:
+        return {"day": str(day), "drift": ["no_raw_data"] if state else [], "state": state, "expected": None}
+    expected = state_from_raw(df_raw, day)
+    return {"day": str(day), "drift": state_drift(state, expected, tolerance), "state": state, "expected": expected}
+
+
+def reconcile(event):
+    # recomputes the daily state from raw files and flags (optionally repairs) any drift
+    today = datetime.utcnow().date()
+    start = datetime.strptime(event["start"], "%Y-%m-%d").date()
+    end = datetime.strptime(event["end"], "%Y-%m-%d").date() if "end" in event else today - timedelta(days=1)
+    workers = int(event.get("workers", BACKFILL_WORKERS))
+    tolerance = float(event.get("tolerance", RECONCILE_TOLERANCE))
+    repair = bool(event.get("repair", False))
+
+    days = []
+    for year in range(start.year, end.year + 1):
+        days.extend(d for d in list_raw_days(BUCKET, RAW_PREFIX, year) if start <= d <= end)
+    print(f"reconciling {len(days)} days {start}..{end}")
+
+    with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+        results = list(ex.map(lambda d: reconcile_day(BUCKET, d, tolerance), days))
+    drifted = [r for r in results if r["drift"]]
+    for r in drifted:
+        print(f"drift on {r['day']}: {r['drift']} state={r['state']} expected={r['expected']}")
+
+    repaired = []
+    if repair:
+        # only closed days; today's state is still being written by stream.py
+        fixed = []
+        for r in drifted:
+            if r["expected"] is None or r["day"] >= str(today):
+                continue
+            write_daily_state(BUCKET, datetime.strptime(r["day"], "%Y-%m-%d").date(), r["expected"])
+            repaired.append(r["day"])
+            fixed.append(daily_from_state(r["expected"]))
+        if fixed:
+            register_partitions(write_days(BUCKET, pd.concat(fixed, ignore_index=True))[1])
+
+    return {
+        "status": "drift" if drifted and not repair else "ok",
+        "mode": "reconcile",
+        "days_checked": len(results),
+        "drifted": [{"day": r["day"], "drift": r["drift"]} for r in drifted],
+        "repaired": repaired,
+    }
+
+
+def compact(event):
+    # scheduled separately from the daily run; every year with at least min_files live files is merged into one file
+    years = event.get("years") or [
+        int(p.split("year=")[-1].rstrip("/")) for p in list_common_prefixes(BUCKET, f"{PROC_PREFIX}/year=")
+    ]
+    min_files = int(event.get("min_files", COMPACT_MIN_FILES))
+    grace_minutes = int(event.get("grace_minutes", COMPACT_GRACE_MINUTES))
+    results = [compact_year(BUCKET, int(year), min_files, grace_minutes) for year in sorted(years)]
+    return {"status": "ok", "mode": "compact", "years": results}
@@ -0,0 +1,200 @@
+import awswrangler as wr
+import boto3, os
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+import instrumentation
+
+s3 = boto3.client("s3")
+instrumentation.track_s3(s3)
+
+BUCKET = os.environ.get("BUCKET", "<your-bucket-name>")
+RAW_PREFIX = os.environ.get("PREFIX", "raw/stream")
+COMPACT_PREFIX = os.environ.get("COMPACT_PREFIX", "raw/stream_compacted")
+ROLLUP_PREFIX = os.environ.get("ROLLUP_PREFIX", "rollups")
+# the pair rolled up; rows without an asset predate multi-asset collection and are BTC-USD
+ASSET = os.environ.get("ASSET", "BTC-USD")
+# minutes to wait after an hour ends before its ticks are considered complete
+GRACE_MINUTES = int(os.environ.get("GRACE_MINUTES", "10"))
+
+# OHLCV bars plus the number of ticks behind them. Every level is rolled up from the one below it:
+# ticks -> 5 minutes -> 1 hour -> 1 day. Files are sized by how often they change:
+#   ohlcv_5m: year=/month=/day=DD/hour=HH.parquet   written once per hour
+#   ohlcv_1h: year=/month=MM/day=DD.parquet         rewritten when an hour of that day is rolled up
+#   ohlcv_1d: year=YYYY/month=MM.parquet            rewritten when a day of that month changes
+LEVELS = [("ohlcv_5m", 5 * 60_000), ("ohlcv_1h", 3_600_000), ("ohlcv_1d", 86_400_000)]
+BAR_COLUMNS = ["bar_start_ms", "open", "high", "low", "close", "volume", "tick_count"]
+SCHEMA = {"bar_start": "timestamp", "open": "double", "high": "double", "low": "double", "close": "double",
+          "volume": "double", "tick_count": "bigint"}
+
+
+def day_path(day):
+    return f"year={day.year}/month={day.month:02}/day={day.day:02}"
+
+
+def rollup(bars, bucket_ms):
+    # bars sorted by bar_start_ms; volume stays null when no input bar has one (the stream has no volume)
+    start = bars["bar_start_ms"] // bucket_ms * bucket_ms
+    grouped = bars.groupby(start.rename("bar_start_ms"), sort=True)
+    out = grouped.agg(
+        open=("open", "first"), high=("high", "max"), low=("low", "min"), close=("close", "last"),
+        tick_count=("tick_count", "sum"),
+    )
+    out["volume"] = grouped["volume"].sum(min_count=1)
+    return out.reset_index()[BAR_COLUMNS]
+
+
+def ticks_as_bars(df):
+    df = df.dropna(subset=["epoch_ms", "price_usd"]).drop_duplicates(subset=["epoch_ms", "price_usd"]).sort_values("epoch_ms")
+    price = df["price_usd"].astype("float64").to_numpy()
+    return pd.DataFrame({
+        "bar_start_ms": df["epoch_ms"].astype("int64").to_numpy(), "open": price, "high": price, "low": price,
+        "close": price, "volume": float("nan"), "tick_count": 1,
+    })
+
+
+def to_table(bars):
+    out = bars.drop(columns="bar_start_ms")
+    out.insert(0, "bar_start", pd.to_datetime(bars["bar_start_ms"], unit="ms").astype("datetime64[ms]"))
+    out["tick_count"] = out["tick_count"].astype("int64")
+    return out
+
+
+def from_table(df):
+    bars = df.drop(columns="bar_start")
+    bars.insert(0, "bar_start_ms", pd.to_datetime(df["bar_start"]).astype("datetime64[ms]").astype("int64"))
+    return bars[BAR_COLUMNS]
+
+
+def list_keys(bucket, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"]
+
+
+@instrumentation.stage("list")
+def source_hours(bucket, day):
+    # {hour: s3 path}: compacted hour files from compact_hours.py, minute CSV folders for the other hours
+    sources = {
+        int(key.rsplit("hour=", 1)[-1][:2]): ("parquet", f"s3://{bucket}/{key}")
+        for key in list_keys(bucket, f"{COMPACT_PREFIX}/{day_path(day)}/")
+        if key.endswith(".parquet")
+    }
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{RAW_PREFIX}/{day_path(day)}/hour=", Delimiter="/"):
+        for cp in page.get("CommonPrefixes", []):
+            sources.setdefault(int(cp["Prefix"].split("hour=")[-1].rstrip("/")), ("csv", f"s3://{bucket}/{cp['Prefix']}"))
+    return sources
+
+
+@instrumentation.stage("list")
+def rolled_hours(bucket, day):
+    return {
+        int(key.rsplit("hour=", 1)[-1][:2])
+        for key in list_keys(bucket, f"{ROLLUP_PREFIX}/ohlcv_5m/{day_path(day)}/")
+        if key.endswith(".parquet")
+    }
+
+
+@instrumentation.stage("read")
+def read_ticks(kind, path):
+    # hour files written before stream.py collected several pairs have no asset column
+    if kind == "parquet":
+        df = wr.s3.read_parquet(path)
+    else:
+        df = wr.s3.read_csv(path, usecols=lambda c: c in ("epoch_ms", "price_usd", "asset"), dtype={"asset": str})
+    if "asset" in df.columns:
+        df = df[df["asset"].isna() | (df["asset"] == ASSET)]
+    return df[["epoch_ms", "price_usd"]]
+
+
+@instrumentation.stage("read")
+def read_bars(path):
+    try:
+        return from_table(wr.s3.read_parquet(path))
+    except wr.exceptions.NoFilesFound:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+
+
+@instrumentation.stage("write")
+def write_bars(bars, path):
+    wr.s3.to_parquet(df=to_table(bars), path=path, dtype=SCHEMA, compression="snappy", index=False)
+
+
+def merge_bars(existing, new, lo_ms, hi_ms):
+    # bars of [lo_ms, hi_ms) come from new, everything else is kept
+    starts = existing["bar_start_ms"].astype("int64")
+    kept = existing[(starts < lo_ms) | (starts >= hi_ms)]
+    merged = pd.concat([kept, new], ignore_index=True) if len(kept) else new
+    return merged.astype({"bar_start_ms": "int64"}).sort_values("bar_start_ms", ignore_index=True)
+
+
+def rollup_day(bucket, day, hours, sources):
+    # one pass per day: each hour's ticks are read once and rolled up through every level
+    day_ms = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+    hourly_new, rolled = [], []
+    for hour in hours:
+        lo, hi = day_ms + hour * 3_600_000, day_ms + (hour + 1) * 3_600_000
+        ticks = ticks_as_bars(read_ticks(*sources[hour]))
+        outside = ticks[(ticks["bar_start_ms"] < lo) | (ticks["bar_start_ms"] >= hi)]
+        ticks = ticks[(ticks["bar_start_ms"] >= lo) & (ticks["bar_start_ms"] < hi)]
+        if len(outside):
+            print(f"{day} hour {hour:02}: ignoring {len(outside)} ticks stamped outside the hour")
+        five = rollup(ticks, LEVELS[0][1])
+        if five.empty:
+            continue
+        write_bars(five, f"s3://{bucket}/{ROLLUP_PREFIX}/ohlcv_5m/{day_path(day)}/hour={hour:02}.parquet")
+        hourly_new.append(rollup(five, LEVELS[1][1]))
+        rolled.append({"day": str(day), "hour": hour, "ticks": int(ticks["tick_count"].sum()), "bars_5m": len(five)})
+        instrumentation.count("ticks_rolled", int(ticks["tick_count"].sum()))
+    if not hourly_new:
+        return rolled
+
+    hourly_path = f"s3://{bucket}/{ROLLUP_PREFIX}/ohlcv_1h/year={day.year}/month={day.month:02}/day={day.day:02}.parquet"
+    hourly = read_bars(hourly_path)
+    for bars in hourly_new:
+        start = int(bars["bar_start_ms"].iloc[0])
+        hourly = merge_bars(hourly, bars, start, start + 3_600_000)
+    write_bars(hourly, hourly_path)
+
+    daily_path = f"s3://{bucket}/{ROLLUP_PREFIX}/ohlcv_1d/year={day.year}/month={day.month:02}.parquet"
+    daily = merge_bars(read_bars(daily_path), rollup(hourly, LEVELS[2][1]), day_ms, day_ms + 86_400_000)
+    write_bars(daily, daily_path)
+    return rolled
+
+
+@instrumentation.invocation("rollup")
+def lambda_handler(event, context):
+    event = event or {}
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(minutes=GRACE_MINUTES)
+    force = bool(event.get("force", False))
+
+    if "start" in event:
+        start = datetime.strptime(event["start"], "%Y-%m-%d").date()
+        end = datetime.strptime(event.get("end", event["start"]), "%Y-%m-%d").date()
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    elif "day" in event:
+        days = [datetime.strptime(event["day"], "%Y-%m-%d").date()]
+    else:
+        days = [(now - timedelta(days=1)).date(), now.date()]
+
+    rolled = []
+    for day in days:
+        sources = source_hours(BUCKET, day)
+        done = set() if force else rolled_hours(BUCKET, day)
+        hours = set(sources)
+        if "hours" in event:
+            hours &= {int(h) for h in event["hours"]}
+        day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        hours = sorted(h for h in hours - done if day_start + timedelta(hours=h + 1) <= cutoff)
+        if not hours:
+            continue
+        try:
+            rolled.extend(rollup_day(BUCKET, day, hours, sources))
+        except Exception as e:
+            print(f"rollup failed for {day} hours {hours}: {e}")
+            instrumentation.mark_error(f"rollup failed for {day}: {e}")
+
+    print(f"rolled up {len(rolled)} hours")
+    return {"status": "ok", "rolled": rolled}
@@ -1,50 +1,214 @@
 import json
 import csv
 import io
-import urllib.request
+import math
+import time
+import asyncio
+import concurrent.futures as cf
+import urllib3
 import boto3
+from botocore.exceptions import ClientError
 from datetime import datetime, timezone
 import os
+import instrumentation
 
 # ---------- config for streaming ----------
 S3 = boto3.client("s3")
+instrumentation.track_s3(S3)
 BUCKET = os.environ.get("BUCKET", "<your-bucket-name>")      
 PREFIX = os.environ.get("PREFIX", "raw/stream")             
+STATE_PREFIX = os.environ.get("STATE_PREFIX", "state/daily_agg")
+STATE_MAX_ATTEMPTS = int(os.environ.get("STATE_MAX_ATTEMPTS", "5"))
+# every asset is collected in every quote currency; each pair is one row of the minute file (asset column, e.g. BTC-USD)
+ASSETS = [a.strip().upper() for a in os.environ.get("ASSETS", "BTC,ETH").split(",") if a.strip()]
+QUOTES = [q.strip().upper() for q in os.environ.get("QUOTES", "USD").split(",") if q.strip()]
+PAIRS = [f"{a}-{q}" for a in ASSETS for q in QUOTES]
+# the pair behind the daily aggregate, parquet_convert.py and rollup.py
+STATE_ASSET = os.environ.get("STATE_ASSET", "BTC-USD")
+# tried in order; a source only fetches the pairs the ones before it did not deliver
+SOURCES = [s.strip() for s in os.environ.get("SOURCES", "coingecko,coinbase,bitstamp").split(",") if s.strip()]
+# per-source latency budget, "source:ms,..."; a source still busy after its budget is abandoned for the next one
+SOURCE_BUDGETS_MS = {"coingecko": 2500, "coinbase": 1500, "bitstamp": 1500, **{
+    name.strip(): int(ms) for name, ms in
+    (item.split(":") for item in os.environ.get("SOURCE_BUDGETS_MS", "").split(",") if item.strip())
+}}
+# base URLs, overridable to run against a local HTTP stub
+SOURCE_URLS = {
+    "coingecko": os.environ.get("COINGECKO_URL", "https://api.coingecko.com"),
+    "coinbase": os.environ.get("COINBASE_URL", "https://api.coinbase.com"),
+    "bitstamp": os.environ.get("BITSTAMP_URL", "https://www.bitstamp.net"),
+}
+COINGECKO_IDS = {"BTC": "bitcoin", "ETH": "ethereum", "SOL": "solana", "LTC": "litecoin", "XRP": "ripple",
+                 "DOGE": "dogecoin", "ADA": "cardano"}
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
 # ----------------------------
 
-def get_price():
-    url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-    with urllib.request.urlopen(url, timeout=10) as r:
-        data = json.loads(r.read().decode())
-    return float(data["bitcoin"]["usd"])
+# module level, so warm invocations reuse the open keep-alive connections; urllib3 ships with botocore
+HTTP = urllib3.PoolManager(num_pools=len(SOURCE_URLS), maxsize=HTTP_POOL_SIZE, retries=False,
+                           headers={"Accept": "application/json", "User-Agent": "btc-ml-end-to-end/stream"})
+# blocking requests run here; asyncio.run does not wait for this pool, so a request past its budget never holds up the write
+EXECUTOR = cf.ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE)
 
+def get_json(url, timeout):
+    r = HTTP.request("GET", url, timeout=urllib3.Timeout(total=timeout))
+    if r.status != 200:
+        raise RuntimeError(f"HTTP {r.status} from {url}")
+    return json.loads(r.data)
+
+async def fetch_json(url, timeout):
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, get_json, url, timeout)
+
+def as_price(value):
+    price = float(value)
+    if not math.isfinite(price) or price <= 0:
+        raise ValueError(f"bad price {value!r}")
+    return price
+
+async def from_coingecko(pairs, budget):
+    # one request for every pair: /simple/price?ids=bitcoin,ethereum&vs_currencies=usd,eur
+    ids = {p: COINGECKO_IDS[p.split("-")[0]] for p in pairs if p.split("-")[0] in COINGECKO_IDS}
+    if not ids:
+        return {}
+    url = (f"{SOURCE_URLS['coingecko']}/api/v3/simple/price?ids={','.join(sorted(set(ids.values())))}"
+           f"&vs_currencies={','.join(sorted({p.split('-')[1].lower() for p in ids}))}")
+    data = await fetch_json(url, budget)
+    prices = {}
+    for pair, coin in ids.items():
+        try:
+            prices[pair] = as_price(data[coin][pair.split("-")[1].lower()])
+        except Exception as e:
+            print(f"coingecko {pair} failed: {e!r}")
+    return prices
+
+async def per_pair(name, pairs, budget, url_of, price_of):
+    # one request per pair, all at once; pairs that fail are left to the next source
+    results = await asyncio.gather(*(fetch_json(url_of(p), budget) for p in pairs), return_exceptions=True)
+    prices = {}
+    for pair, result in zip(pairs, results):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            prices[pair] = as_price(price_of(result))
+        except Exception as e:
+            print(f"{name} {pair} failed: {e!r}")
+    return prices
+
+async def from_coinbase(pairs, budget):
+    return await per_pair("coinbase", pairs, budget, lambda p: f"{SOURCE_URLS['coinbase']}/v2/prices/{p}/spot",
+                          lambda r: r["data"]["amount"])
+
+async def from_bitstamp(pairs, budget):
+    return await per_pair("bitstamp", pairs, budget,
+                          lambda p: f"{SOURCE_URLS['bitstamp']}/api/v2/ticker/{p.replace('-', '').lower()}/",
+                          lambda r: r["last"])
+
+FETCHERS = {"coingecko": from_coingecko, "coinbase": from_coinbase, "bitstamp": from_bitstamp}
+
+async def collect(pairs):
+    # {pair: (price, source)}, each pair from the first source in SOURCES that delivered it within its budget
+    prices, latency_ms = {}, {}
+    for name in SOURCES:
+        missing = [p for p in pairs if p not in prices]
+        if not missing:
+            break
+        budget = SOURCE_BUDGETS_MS.get(name, 2000) / 1000
+        started = time.perf_counter()
+        try:
+            got = await asyncio.wait_for(FETCHERS[name](missing, budget), budget)
+        except Exception as e:
+            got = {}
+            print(f"{name} failed for {missing}: {e!r}")
+            instrumentation.count("source_failures")
+        latency_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+        prices.update({pair: (price, name) for pair, price in got.items()})
+    instrumentation.annotate(source_latency_ms=latency_ms)
+    return prices
+
+def update_daily_state(ts, epoch_ms, price):
+    # running count/sum/min/max for the day; conditional writes keep concurrent invocations from losing ticks.
+    # price is rounded like the CSV so the state and a replay of the raw files agree
+    key = f"{STATE_PREFIX}/year={ts:%Y}/month={ts:%m}/day={ts:%d}.json"
+    for attempt in range(STATE_MAX_ATTEMPTS):
+        try:
+            obj = S3.get_object(Bucket=BUCKET, Key=key)
+            state, condition = json.loads(obj["Body"].read()), {"IfMatch": obj["ETag"]}
+        except S3.exceptions.NoSuchKey:
+            state, condition = {"day": ts.strftime("%Y-%m-%d"), "count": 0, "sum": 0.0,
+                                "min": None, "max": None, "last_epoch_ms": 0}, {"IfNoneMatch": "*"}
+
+        if epoch_ms == state["last_epoch_ms"]:
+            return state
+        state["count"] += 1
+        state["sum"] += price
+        state["min"] = price if state["min"] is None else min(state["min"], price)
+        state["max"] = price if state["max"] is None else max(state["max"], price)
+        state["last_epoch_ms"] = max(state["last_epoch_ms"], epoch_ms)
+
+        try:
+            S3.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(state).encode("utf-8"),
+                          ContentType="application/json", **condition)
+            return state
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            print(f"state update conflict on {key}, attempt {attempt + 1}")
+            instrumentation.count("state_conflicts")
+    raise RuntimeError(f"could not update {key} after {STATE_MAX_ATTEMPTS} attempts")
+
+@instrumentation.invocation("stream")
 def lambda_handler(event, context):
-    try:
-        price = get_price()
-    except Exception as e:
-        print(f"price fetch failed: {e}")
-        return {"status": "error", "message": str(e)}
+    with instrumentation.stage("fetch"):
+        prices = asyncio.run(collect(PAIRS))
+    missing = [p for p in PAIRS if p not in prices]
+    instrumentation.count("ticks", len(prices))
+    if missing:
+        print(f"no price for {missing}")
+        instrumentation.annotate(missing_pairs=missing)
+    if not prices:
+        instrumentation.mark_error(f"price fetch failed for {PAIRS}")
+        return {"status": "error", "message": f"no source delivered a price for {PAIRS}"}
 
     ts = datetime.now(timezone.utc)
     epoch_ms = int(ts.timestamp() * 1000)
  
     y, m, d, H, M = ts.strftime("%Y %m %d %H %M").split()
-    key = f"{PREFIX}/year={y}/month={m}/day={d}/hour={H}/btc_{y}{m}{d}_{H}{M}.csv"
+    # minute files from before multi-asset collection are named btc_...csv; readers take every .csv in the hour
+    key = f"{PREFIX}/year={y}/month={m}/day={d}/hour={H}/ticks_{y}{m}{d}_{H}{M}.csv"
  
+    # one file per minute with a row per pair, all stamped with the same time
     buf = io.StringIO()
     writer = csv.writer(buf)
-    writer.writerow(["epoch_ms", "iso_ts", "price_usd", "source"])
-    writer.writerow([epoch_ms, ts.isoformat(), f"{price:.2f}", "coingecko"])
+    writer.writerow(["epoch_ms", "iso_ts", "price_usd", "source", "asset"])
+    for pair in PAIRS:
+        if pair in prices:
+            price, source = prices[pair]
+            writer.writerow([epoch_ms, ts.isoformat(), f"{price:.2f}", source, pair])
 
     try:
-        S3.put_object(
-            Bucket=BUCKET,
-            Key=key,
-            Body=buf.getvalue().encode("utf-8"),
-            ContentType="text/csv"
-        )
-        print(f"saved to s3://{BUCKET}/{key}")
-        return {"status": "ok", "price": price, "s3_key": key}
+        with instrumentation.stage("write"):
+            S3.put_object(
+                Bucket=BUCKET,
+                Key=key,
+                Body=buf.getvalue().encode("utf-8"),
+                ContentType="text/csv"
+            )
+        print(f"saved {len(prices)} ticks to s3://{BUCKET}/{key}")
     except Exception as e:
         print(f"upload failed: {e}")
+        instrumentation.mark_error(f"upload failed: {e}")
         return {"status": "error", "message": str(e)}
+
+    # price is the STATE_ASSET price, as before several pairs were collected
+    result = {"status": "ok", "price": prices.get(STATE_ASSET, (None,))[0],
+              "prices": {pair: price for pair, (price, _) in prices.items()}, "s3_key": key}
+    if STATE_ASSET not in prices:
+        return result
+    # the CSV stays the source of truth; state drift is repaired by parquet_convert's reconcile mode
+    try:
+        with instrumentation.stage("state"):
+            update_daily_state(ts, epoch_ms, round(prices[STATE_ASSET][0], 2))
+    except Exception as e:
+        print(f"daily state update failed: {e}")
+        instrumentation.annotate(state_error=str(e))
+        return {**result, "state": "error"}
+    return result